@@ -31,7 +31,7 @@
 
 # -------------- glink proper
 
-import argparse, json, string, functools, fnmatch
+import argparse, json, string, functools, fnmatch, re, bisect
 import os, sys, traceback, copy, builtins
 import builtins
 import glccver
@@ -57,6 +57,7 @@ the_pc = 0
 the_pass = 0
 
 final_pass = False
+optimize = False
 hops_enabled = False
 short_function = False
 lbranch_counter = 0
@@ -71,6 +72,8 @@ map_libraries = None
 map_segments = None
 map_describe = None
 map_place = None
+overlay_banks = None
+overlay_staging = None
 
 zpsize = 0
 
@@ -204,8 +207,9 @@ def resolve(s, ignore=None):
 
 class Fragment:
     "Class for representing the code/data fragments in a module"
-    __slots__ = ('segment', 'name','func', 'size', 'align', 'nohop', 'amin', 'amax')
-    def __init__(self, segment, name, func, size = None, align = None):
+    __slots__ = ('segment', 'name','func', 'size', 'align', 'nohop', 'amin', 'amax', 'refs', 'bank', 'readonly',
+                 'stack', 'pushes', 'calls', 'indirect', 'entries')
+    def __init__(self, segment, name, func, size = None, align = None, *flags):
         self.segment = segment     # CODE, DATA, BSS, COMMON
         self.name = name           # fragment name
         self.func = func           # fragment code
@@ -214,6 +218,14 @@ class Fragment:
         self.nohop = False         # short function
         self.amin = None           # min address range
         self.amax = None           # max address range
+        self.refs = set()          # symbols referenced when measuring
+        self.bank = None           # overlay bank (None when resident)
+        self.readonly = 'CONST' in flags  # read-only data (rcc literals)
+        self.stack = 0             # stack frame size
+        self.pushes = 0            # bytes pushed on the stack when SP is vSP
+        self.calls = set()         # symbols called directly, with call offset
+        self.indirect = False      # makes indirect calls
+        self.entries = {}          # offsets of the global labels
     def __repr__(self):
         return f"Fragment({self.segment},'{self.name}',...)"
 
@@ -233,6 +245,7 @@ class Module:
         self.symrefs = {}
         self.symdefs = {}
         self.sympass = {}
+        self.labelfrags = {}
         # inner function to process a placement fragment
         def placement(tp):
             matches = [f for f in self.code if fnmatch.fnmatchcase(f.name, tp[1])]
@@ -258,7 +271,7 @@ class Module:
             elif tp[0] == 'CODE':
                 self.code.append(Fragment(*tp))               # ('CODE', "name", func)
             elif tp[0] == 'DATA' or tp[0] == 'BSS' or tp[0] == 'COMMON':
-                self.code.append(Fragment(*tp))               # ('DATA|BSS|COMMON', "name", func, size, align)
+                self.code.append(Fragment(*tp))               # ('DATA|BSS|COMMON', "name", func, size, align [,'CONST'])
             elif tp[0] in ('ORG','PLACE','NOHOP'):            # ('PLACE', "pattern", minaddr, maxaddr)
                 if placement(tp) < 1:                         # ('ORG', "pattern", addr)
                     error(f"Cannot locate fragment for {tp}") # ('NOHOP', "pattern")
@@ -296,20 +309,25 @@ class Module:
 
 class Segment:
     '''Represent memory segments to be populated with code/data'''
-    __slots__ = ('saddr', 'eaddr', 'pc', 'flags', 'buffer', 'nbss')
-    def __init__(self, saddr, eaddr, flags=False):
+    __slots__ = ('saddr', 'eaddr', 'pc', 'flags', 'buffer', 'nbss', 'bank')
+    def __init__(self, saddr, eaddr, flags=False, bank=None):
         self.saddr = saddr
         self.eaddr = eaddr
         self.pc = saddr
         self.flags = flags or False # 0x1: no code, 0x2 : no data, 0x4 : no heap
         self.buffer = None
         self.nbss = None
+        self.bank = bank            # overlay bank (None when always mapped)
     def __repr__(self):
         d = f",flags={hex(self.flags)}" if self.flags else ''
-        return f"Segment({hex(self.saddr)},{hex(self.eaddr)}{d})"
+        b = f",bank={self.bank}" if self.bank != None else ''
+        return f"Segment({hex(self.saddr)},{hex(self.eaddr)}{d}{b})"
 
 def emit(*args):
-    global final_pass, the_pc, the_segment
+    global final_pass, the_pc, the_segment, peephole_state, zpage_pending
+    peephole_state = zpage_pending = None
+    if icf_trace != None:
+        icf_trace.extend(args)
     if final_pass:
         if not the_segment.buffer:
             the_segment.buffer = bytearray()
@@ -324,12 +342,14 @@ def extern(sym):
        inserts the appropriate runtime routines.'''
     if the_pass == 0 and sym not in the_module.imports:
         the_module.imports.append(sym)
+    if the_pass == 0 and the_fragment:
+        the_fragment.refs.add(sym)
 
 fraginfo = {}
 addrinfo = {}
 
 def record_fragment_address(addr):
-    # record fragment addresses for option --frags
+    # record fragment addresses for options --frags and --map-json
     global fraginfo, addrinfo
     if args.fragments and final_pass:
         fid = id(the_fragment)
@@ -340,6 +360,18 @@ def record_fragment_address(addr):
             addrinfo[(finfo[1],addr)] = (finfo[0], the_fragment, the_module)
             fraginfo[fid] = (finfo[0],)
 
+hopinfo = {}
+baseline_hopinfo = None
+hop_stubs = {}
+
+def record_fragment_hops(nhops, nlbranches, nbytes):
+    # record hops and long branches for option --hop-report
+    global hopinfo
+    if args.hop_report and final_pass:
+        fid = id(the_fragment)
+        (h, l, b) = hopinfo.get(fid, (0, 0, 0))
+        hopinfo[fid] = (h + nhops, l + nlbranches, b + nbytes)
+
 
 # ------------- jumps and hops
 
@@ -373,11 +405,14 @@ def hop(sz, jump):
             hops_enabled = False
             the_segment.pc = the_pc
             lfss = args.lfss or 32
-            ns = find_code_segment(max(lfss, sz))
+            ns = find_code_segment(max(lfss, sz), spread=True)
             if not ns:
                 fatal(f"map memory exhausted while fitting function `{the_fragment.name}'")
             if jump:
+                if args.map_json and final_pass:
+                    hop_stubs[the_pc] = size_long_jump()
                 emit_long_jump(ns.pc)
+            record_fragment_hops(1, 0, size_long_jump() if jump else 0)
             hops_enabled = True
             the_segment.pc = the_pc
             if args.fragments and final_pass:
@@ -390,12 +425,16 @@ def hop(sz, jump):
 
 def emitjump(d):
     global hops_enabled, lbranch_counter
+    if args.O and peephole_jump(d):
+        return
+    d = v(d)
     save_hops_enabled = hops_enabled
     hops_enabled = False
     if short_function or is_pcpage(d):
         BRA(d)
     else:
         lbranch_counter += size_long_jump() - 2
+        record_fragment_hops(0, 1, size_long_jump() - 2)
         emit_long_jump(d)
     hops_enabled = save_hops_enabled
     tryhop(jump=False)
@@ -422,6 +461,7 @@ def emitjcc(BCC, BNCC, JCC, d):
             emit_long_jump(d)
             label(lbl, hop=0)
             lbranch_counter += size_long_jump()
+            record_fragment_hops(0, 1, size_long_jump())
             break;
         else:
             hops_enabled = True
@@ -430,12 +470,247 @@ def emitjcc(BCC, BNCC, JCC, d):
             hops_enabled = False
     hops_enabled = save_hops_enabled
 
+# ------------- peephole optimizer (option -O)
+
+peephole_state = None
+peephole_stats = {}
+peephole_jumps = {}     # jump state ('emitted','omitted','kept'), pc and size
+peephole_jumpno = 0     # rank of the next jump in the current fragment
+peephole_cycles = { 'LDW': 20, 'STW': 20, 'LDI': 16, 'LDWI': 20, 'BRA': 28,
+                    'CALLI': 28, 'LONGJUMP': 108, 'LDWI+DEEK': 28, 'LDWI+PEEK': 24 }
+
+def peephole_record(rule, op, nbytes):
+    # record savings for option --peephole-report
+    if final_pass:
+        (n, b, c) = peephole_stats.get(rule, (0, 0, 0))
+        peephole_stats[rule] = (n + 1, b + nbytes, c + peephole_cycles[op])
+
+def peephole_op(opargs):
+    '''Called by emit_op before emitting an instruction. Return True if
+       the instruction is redundant and should be omitted.  This relies on
+       the state left by the previous instruction, which is invalidated by
+       emit(), label(), and hops. Nothing is done in pass 0 because the
+       fragment sizes measured in pass 0 must be upper bounds, nor in pass 1
+       because forward references are not yet resolved.'''
+    st = peephole_state
+    if the_pass <= 1 or not st or st[0] is not the_segment or st[1] != the_pc:
+        return False
+    (_, _, vac, copies) = st
+    op = opargs[0]
+    if isinstance(opargs[-1], Unk):
+        return False
+    if op == 'LDW' and opargs[1] in copies:
+        peephole_record("LDW of a copy of vAC", op, 2)
+        return True
+    if op == 'STW' and opargs[1] in copies:
+        peephole_record("STW into a copy of vAC", op, 2)
+        return True
+    if op == 'LDI' and vac != None and vac == opargs[1]:
+        peephole_record("LDI with known vAC", op, 2)
+        return True
+    if op == 'LDWI' and vac != None and vac == opargs[1] + (opargs[2] << 8):
+        peephole_record("LDWI with known vAC", op, 3)
+        return True
+    return False
+
+def peephole_update(opargs, st):
+    '''Called by emit_op after emitting an instruction in order to
+       remember the value of vAC when known and the set of zero page
+       words known to contain a copy of vAC. Argument `st' is the state
+       before emitting the instruction.'''
+    global peephole_state
+    op = opargs[0]
+    vac = None
+    copies = ()
+    if not st or st[0] is not the_segment or st[1] != the_pc - len(opargs):
+        st = (None, None, None, ())
+    if isinstance(opargs[-1], Unk):
+        pass                            # unresolved symbol
+    elif op == 'LDI':
+        vac = opargs[1]
+    elif op == 'LDWI':
+        vac = opargs[1] + (opargs[2] << 8)
+    elif op == 'LDW':
+        copies = (opargs[1],)
+    elif op == 'STW':
+        d = opargs[1]
+        vac = st[2]
+        copies = tuple(a for a in st[3] if abs(a - d) > 1) + (d,)
+    elif op == 'ST':
+        d = opargs[1]
+        vac = st[2]
+        copies = tuple(a for a in st[3] if a != d and a != d - 1)
+    elif op in ('STLW', 'POKE', 'DOKE'):
+        vac = st[2]                     # these instructions preserve vAC
+    peephole_state = (the_segment, the_pc, vac, copies)
+
+def peephole_jump(d):
+    '''Called by emitjump. Return True if the jump targets the next
+       instruction and can be omitted. The target must be a forward label
+       of the current fragment. Decisions rely on the layout of the
+       previous pass: a jump that was emitted is omitted if its target
+       immediately followed it, and an omitted jump remains omitted as
+       long as its target stayed at the jump address. Once a jump is
+       kept, it is kept for good. Each jump therefore changes at most
+       twice, each change counts as a label change, and no change can
+       happen in the final pass.'''
+    global peephole_jumpno, labelchange_counter
+    key = (id(the_fragment), peephole_jumpno)
+    peephole_jumpno += 1
+    if the_pass < 1 or not isinstance(d, str):
+        return False
+    if the_module.labelfrags.get(d) is not the_fragment:
+        return False
+    if the_module.sympass.get(d) == the_pass:
+        return False                    # backward label
+    addr = v(d)
+    if isinstance(addr, Unk):
+        return False
+    if short_function or is_pcpage(addr):
+        (op, size) = ('BRA', 2)
+    else:
+        (op, size) = ('CALLI' if args.cpu >= 5 else 'LONGJUMP', size_long_jump())
+    (state, pc, emitted) = peephole_jumps.get(key, (None, None, None))
+    if state == None:
+        # first sighting: emit the jump and decide in the next pass
+        omit = None
+    elif state == 'emitted':
+        omit = addr == pc + emitted and size <= bytes_left()
+    else:
+        omit = state == 'omitted' and addr == pc
+    peephole_jumps[key] = ('omitted' if omit else 'kept' if omit == False else 'emitted',
+                           the_pc, 0 if omit else size)
+    if state == None or (omit and state != 'omitted') or (state == 'omitted' and not omit):
+        if final_pass:
+            fatal(f"internal error: jump to '{d}' in fragment '{the_fragment.name}' changed in the final pass")
+        labelchange_counter += 1
+    if omit:
+        peephole_record("jump to next instruction", op, size)
+    return bool(omit)
+
+
+# ------------- zero page promotion (option --zp-promote)
+
+zpage_pending = None
+zpage_refcounts = {}
+zpage_promoted = []
+
+def zpage_note(x, d):
+    '''Called by LDWI(x) after emitting the instruction. In pass 0,
+       remember the symbol so that zpage_fold() can count the sequences
+       LDWI+DEEK and LDWI+PEEK that could use a zero page operand.
+       In later passes, remember the address when it is in page zero.'''
+    global zpage_pending
+    if the_pass == 0:
+        zpage_pending = (the_fragment, the_pc, x)
+    elif isinstance(d, int) and not isinstance(d, Unk) and d < 0xff:
+        zpage_pending = (the_segment, the_pc, d)
+
+def zpage_fold(op):
+    '''Called by DEEK() and PEEK(). Return the zero page address loaded
+       by the LDWI instruction that immediately precedes, after removing
+       it from the code, or None. The state is invalidated by emit() and
+       label(). Since the address of a promoted fragment is unknown in
+       pass 0, this pass only counts the foldable sequences.'''
+    global zpage_pending, the_pc
+    st = zpage_pending
+    if not st or st[1] != the_pc:
+        return None
+    if the_pass == 0:
+        if st[0] is the_fragment and st[0] and icf_trace == None:
+            refs = zpage_refcounts.setdefault(id(st[0]), {})
+            refs[st[2]] = refs.get(st[2], 0) + 1
+        return None
+    if st[0] is not the_segment:
+        return None
+    the_pc -= 3
+    if final_pass:
+        del the_segment.buffer[-3:]
+    peephole_record(f"{op} of a zero page variable", op, 2)
+    zpage_pending = None
+    return st[2]
+
+def find_data_fragment(m, sym):
+    '''Return the data fragment that defines label `sym'
+       as seen from module `m', or None.'''
+    for mm in (m, exporters.get(sym)):
+        if mm and sym in mm.labelfrags:
+            return mm.labelfrags[sym]
+        if mm:
+            for frag in mm.code:
+                if frag.segment in ('DATA', 'BSS') and frag.name == sym:
+                    return frag
+    return None
+
+def promote_zero_page():
+    '''Select the small data fragments that are most often accessed
+       with LDWI+DEEK or LDWI+PEEK and pin them in the free zero page
+       locations. Each access is weighted by the cycles spent in the
+       accessing function when a profile is given with option --profile.
+       Addresses are assigned in the order used by run_pass() to place
+       the data fragments in order to avoid splitting the free runs.'''
+    global zpage_promoted
+    cycles = {}
+    if args.profile:
+        cycles = read_profile(args.profile, args.profile_frags)
+    weights = {}
+    for m in module_list:
+        for frag in m.code:
+            refs = zpage_refcounts.get(id(frag))
+            if frag.segment != 'CODE' or not refs:
+                continue
+            w = cycles.get((frag.name, m.fname), 0) + 1
+            for (sym, n) in refs.items():
+                df = find_data_fragment(m, sym)
+                if df:
+                    weights[id(df)] = weights.get(id(df), 0) + n * w
+    cands = []
+    for seg in ('DATA', 'BSS'):
+        for m in module_list:
+            for frag in m.code:
+                if frag.segment == seg and frag.amin == None and id(frag) in weights \
+                   and frag.size and frag.size <= 4 and not frag.name.startswith('__glink_'):
+                    cands.append((m, frag))
+    runs = [ (s.saddr, s.eaddr) for s in create_zpage_segments() ]
+    def pack(chosen):
+        addrs = []
+        r = 0
+        addr = runs[0][0] if runs else 0
+        for (m, frag) in cands:
+            if id(frag) in chosen:
+                addr = aligned(addr, frag.align)
+                while r < len(runs) and addr + frag.size > runs[r][1]:
+                    r += 1
+                    addr = aligned(runs[r][0], frag.align) if r < len(runs) else 0
+                if r >= len(runs):
+                    return None
+                addrs.append((m, frag, addr))
+                addr += frag.size
+        return addrs
+    chosen = set()
+    placement = []
+    for (m, frag) in sorted(cands, key = lambda x : -weights[id(x[1])] / x[1].size):
+        p = pack(chosen | { id(frag) })
+        if p != None:
+            chosen.add(id(frag))
+            placement = p
+    zpage_promoted = []
+    for (m, frag, addr) in placement:
+        frag.amin = addr
+        frag.amax = addr + frag.size - 1
+        zpage_promoted.append((m, frag, weights[id(frag)]))
+        debug(f"promoting {frag.segment} fragment '{frag.name}' to zero page address {hex(addr)}")
+
+
 # ------------- opcode helpers
 
 def emit_op(*args):
     '''Calls emits with strings replaced by opcodes according to interface.json.
        This displaces the knowledge of the correct opcodes into inteface[-dev].json
        but one still has to provide the right arguments.'''
+    if optimize and peephole_op(args):
+        return
+    st = peephole_state
     bytes=[]
     for arg in args:
         if not isinstance(arg, str):
@@ -454,6 +729,8 @@ def emit_op(*args):
             bytes.append(op & 0xff)
     tryhop(len(bytes))
     emit(*bytes)
+    if optimize:
+        peephole_update(args, st)
 
 
 # ------------- mulq
@@ -681,15 +958,26 @@ def zpReserve(addr0,addr1,lbl):
 def pc():
     return the_pc
 @vasm
-def v(x):
-    '''Possible resolve symbol `x'.'''
+def v(x, call=False):
+    '''Possible resolve symbol `x'. Argument `call' indicates
+       a direct call that can reach a function of the same bank.'''
     if not isinstance(x,str):
         return x
+    if the_fragment and the_pass == 0:
+        the_fragment.refs.add(x)
+        if call:
+            the_fragment.calls.add((x, the_pc))
+        if icf_trace != None:
+            icf_trace.append(x)
     if the_module:
         the_module.symrefs[x] = the_pass
         if x in the_module.symdefs:
+            if far_thunks:
+                return far_address(the_module, x, the_module.symdefs[x], call)
             return the_module.symdefs[x]
     r = resolve(x)
+    if far_thunks and r != None and x in exporters:
+        r = far_address(exporters[x], x, r, call)
     if final_pass and r == None:
         error(f"undefined symbol '{x}'", dedup=True)
     return Unk(0xDEAD) if r == None else r
@@ -766,6 +1054,14 @@ def label(sym, val=None, hop=None):
        defining the label. Argument 'hop' then indicates
        how many instruction bytes after the label should
        be available in the new page. '''
+    global peephole_state, zpage_pending
+    peephole_state = zpage_pending = None
+    if the_pass == 0 and the_fragment:
+        the_module.labelfrags[sym] = the_fragment
+        if not sym.startswith('.'):
+            the_fragment.entries[sym] = the_pc
+        if icf_labels != None:
+            icf_labels.append(sym)
     if the_pass > 0:
         referenced = False
         if sym in the_module.symrefs:
@@ -791,7 +1087,11 @@ def LDI(d, hop=True):
     emit_op("LDI", check_im8s(d))
 @vasm
 def LDWI(d):
-    d=int(v(d)); emit_op("LDWI", lo(d), hi(d))
+    (x, seg, pc) = (d, the_segment, the_pc)
+    d=v(d); emit_op("LDWI", lo(d), hi(d))   # keep Unk for the peephole optimizer
+    if args.zp_promote and isinstance(x, str) and (the_pc != pc or the_segment is not seg):
+        zpage_note(x, d)
+    stack_note_load(x, vAC)
 @vasm
 def LDW(d):
     emit_op("LDW", check_zp(d))
@@ -836,10 +1136,18 @@ def XORW(d):
     emit_op("XORW", check_zp(d))
 @vasm
 def PEEK():
-    emit_op("PEEK")
+    addr = zpage_fold('LDWI+PEEK')
+    if addr != None:
+        LD(addr)
+    else:
+        emit_op("PEEK")
 @vasm
 def DEEK():
-    emit_op("DEEK")
+    addr = zpage_fold('LDWI+DEEK')
+    if addr != None:
+        LDW(addr)
+    else:
+        emit_op("DEEK")
 @vasm
 def POKE(d):
     emit_op("POKE", check_zp(d))
@@ -873,18 +1181,21 @@ def BGE(d):
     emit_op("BCC", "GE", check_br(d))
 @vasm
 def CALL(d):
+    stack_note_call(d)
     emit_op("CALL", check_zp(d))
 @vasm
 def RET():
     emit_op("RET"); tryhop(jump=False)
 @vasm
 def PUSH():
+    stack_note(pushes=2)
     emit_op("PUSH")
 @vasm
 def POP():
     emit_op("POP")
 @vasm
 def ALLOC(d):
+    stack_note(-int(v(d)))
     emit_op("ALLOC", check_im8s(d))
 @vasm
 def SYS(op):
@@ -909,7 +1220,7 @@ def DEF(d):
 # cpu 5 opcodes
 @vasm
 def CALLI(d):
-    d=int(v(d)); emit_op("CALLI_v5", lo(d), hi(d))
+    d=int(v(d, call=True)); emit_op("CALLI_v5", lo(d), hi(d))
 @vasm
 def CMPHS(d):
     if args.cpu == 6:
@@ -1237,6 +1548,7 @@ def LDSB(d):
 def _SP(n):
     '''Pseudo-instruction to compute SP relative addresses'''
     n = v(n)
+    stack_note(-n)
     if is_zero(n):
         LDW(SP);
     elif args.cpu < 6 and is_zeropage(-n):
@@ -1515,7 +1827,7 @@ def _MODIU(d):
     _CALLI('_@_modu')           # T3 % vAC --> vAC
 @vasm
 def _BRA(d):
-    emitjump(v(d))
+    emitjump(d)
 @vasm
 def _BEQ(d):
     if args.cpu >= 6:
@@ -1971,7 +2283,8 @@ def _CALLI(d):
         CALLI(d)
     else:
         # no hops because cpu4 long jumps also use -2(vSP)
-        tryhop(11);STLW(-2);LDWI(d);STW('sysArgs6');LDLW(-2);CALL('sysArgs6')
+        tryhop(11);STLW(-2);LDWI(d);STW('sysArgs6');LDLW(-2)
+        stack_note_load(d, 'sysArgs6');CALL('sysArgs6')
 @vasm
 def _CALLJ(d):
     '''Call subroutine at far location d.
@@ -1984,6 +2297,7 @@ def _CALLJ(d):
 @vasm
 def _PROLOGUE(framesize,maxargoffset,mask):
     '''Function prologue'''
+    stack_note(framesize)
     tryhop(2);LDW(vLR);STW(B0)
     if args.cpu >= 7:
         _ALLOC(-framesize)
@@ -2033,16 +2347,38 @@ module_dict['_BMOV'] = _MOVM
 
 # ------------- reading .s/.o/.a files
 
-def read_file(f):
-    '''Reads a .s/.o/.a file in a pristine environment'''
-    global the_module, the_fragment, new_modules, module_list
-    debug(f"reading '{f}'")
+compiled_files = {}
+
+def compile_file(f):
+    '''Compile a python file or return the cached code object
+       when the file did not change (see option --server).'''
+    st = os.stat(f)
+    key = (st.st_mtime_ns, st.st_size)
+    if f in compiled_files and compiled_files[f][0] == key:
+        return compiled_files[f][1]
     with open(f, 'r') as fd:
         s = fd.read()
         try:
             c = compile(s, f, 'exec')
         except SyntaxError as err:
             fatal(str(err))
+    compiled_files[f] = (key, c)
+    return c
+
+def read_json(f):
+    '''Read a json file, caching its contents like compile_file().'''
+    st = os.stat(f)
+    key = (st.st_mtime_ns, st.st_size)
+    if f not in compiled_files or compiled_files[f][0] != key:
+        with open(f, 'r') as fd:
+            compiled_files[f] = (key, json.load(fd))
+    return copy.deepcopy(compiled_files[f][1])
+
+def read_file(f):
+    '''Reads a .s/.o/.a file in a pristine environment'''
+    global the_module, the_fragment, new_modules, module_list
+    debug(f"reading '{f}'")
+    c = compile_file(f)
     the_module = None
     the_fragment = None
     new_modules = []
@@ -2078,8 +2414,7 @@ def read_map(mn, overlays = None):
     fn = search_file(f"map{mn}/map.py", args.mapdir)
     if not fn:
         fatal(f"cannot find linker map '{mn}'")
-    with open(fn, 'r') as fd:
-        exec(compile(fd.read(), fn, 'exec'), globals())
+    exec(compile_file(fn), globals())
     if not map_segments:
         fatal(f"map '{mn}' does not define 'map_segments'")
     if not map_modules:
@@ -2090,17 +2425,13 @@ def read_map(mn, overlays = None):
         fn = ov if '/' in ov else os.path.join(md, f"x-{ov}.py")
         if not os.access(fn, os.R_OK):
             fatal(f"cannot load map overlay '{ov}'")
-        with open(fn, 'r') as fd:
-            exec(compile(fd.read(), fn, 'exec'), globals())
+        exec(compile_file(fn), globals())
 
 def read_interface():
     '''Read `interface.json' as known symbols.'''
     global symdefs
-    with open(os.path.join(lccdir,'interface.json')) as file:
-        for (name, value) in json.load(file).items():
-            symdefs[name] = value if isinstance(value, int) else int(value, base=0)
-    with open(os.path.join(lccdir,'interface-dev.json')) as file:
-        for (name, value) in json.load(file).items():
+    for fn in ('interface.json', 'interface-dev.json'):
+        for (name, value) in read_json(os.path.join(lccdir, fn)).items():
             symdefs[name] = value if isinstance(value, int) else int(value, base=0)
 
 def get_rominfo(roms, rom):
@@ -2121,8 +2452,7 @@ def get_rominfo(roms, rom):
 def read_rominfo(rom):
     '''Read `rom.jsom' to translate rom names into romType byte and cpu version.'''
     global rominfo, romtype, romcpu
-    with open(os.path.join(lccdir,'roms.json')) as file:
-        rominfo = get_rominfo(json.load(file), rom)
+    rominfo = get_rominfo(read_json(os.path.join(lccdir,'roms.json')), rom)
     if rominfo and 'romType' in rominfo and 'cpu' in rominfo:
         romtype = int(str(rominfo['romType']),0)
         romcpu = int(str(rominfo['cpu']),0)
@@ -2155,7 +2485,7 @@ def find_exporters(sym):
                         return [ m ]
     return elist
 
-def measure_data_fragment(m, frag):
+def measure_data_fragment(m, frag, resize=True):
     global the_module, the_fragment, the_pc
     the_module = m
     the_fragment = frag
@@ -2164,7 +2494,8 @@ def measure_data_fragment(m, frag):
         frag.func()
     except Exception as err:
         fatal(str(err), exc=True)
-    frag.size = the_pc
+    if resize:
+        frag.size = the_pc
 
 def measure_code_fragment(m, frag):
     global the_module, the_fragment, the_pc
@@ -2193,6 +2524,8 @@ def measure_fragments(m):
             measure_data_fragment(m, frag)
         elif frag.segment in ('CODE'):
             measure_code_fragment(m, frag)
+        elif (args.gc_fragments or args.stack_report or args.shrink_stack) and callable(frag.func):
+            measure_data_fragment(m, frag, resize=False)  # collect labels and refs
     the_module = None
     the_fragment = None
 
@@ -2272,6 +2605,167 @@ def convert_common_symbols():
                     decl.segment = 'BSS'
                     exporters[sym] = m
 
+def collect_garbage_fragments():
+    '''Remove the code and data fragments that cannot be reached
+       from the entry point, the required symbols, the onload functions,
+       the magic symbols, and the placed fragments (option --gc-fragments).
+       This refines at the fragment level the closure computed
+       by compute_closure() at the module level.'''
+    live = set()
+    todo = []
+    def mark(m, frag):
+        if id(frag) not in live:
+            live.add(id(frag))
+            todo.append((m, frag))
+    def mark_symbol(m, sym):
+        if sym.startswith('__glink_weak_'):
+            sym = sym[13:]              # weak references are kept alive
+        for mm in (m, exporters.get(sym)):
+            if mm and sym in mm.labelfrags:
+                return mark(mm, mm.labelfrags[sym])
+            if mm:
+                for frag in mm.code:
+                    if frag.name == sym:
+                        return mark(mm, frag)
+        if sym in exporters:            # cannot tell which fragment defines sym
+            for frag in exporters[sym].code:
+                mark(exporters[sym], frag)
+    for sym in [ args.e, args.gt1exec ] + args.r + args.onload:
+        mark_symbol(None, sym)
+    for sym in exporters:
+        if sym.startswith('__glink_magic_'):
+            mark_symbol(None, sym)
+    for m in module_list:
+        for frag in m.code:
+            if frag.amin != None or frag.name.startswith('__glink_magic_'):
+                mark(m, frag)
+    while todo:
+        (m, frag) = todo.pop()
+        for sym in frag.refs:
+            mark_symbol(m, sym)
+    nfrags = nbytes = 0
+    for m in module_list:
+        code = []
+        for frag in m.code:
+            if id(frag) in live or frag.segment == 'COMMON':
+                code.append(frag)
+            else:
+                debug(f"removing unreferenced {frag.segment} fragment '{frag.name}' from '{m.fname}'")
+                nfrags += 1
+                nbytes += frag.size or 0
+        m.code = code
+    debug(f"removed {nfrags} unreferenced fragments ({nbytes} bytes)")
+
+# ------------- identical fragment folding
+
+icf_trace = None
+icf_labels = None
+icf_folds = {}
+
+def trace_fragment(m, frag):
+    '''Measure fragment `frag' again while recording the bytes it
+       emits and the symbols it references in pass 0. Return this trace
+       and the list of labels defined by the fragment.'''
+    global icf_trace, icf_labels, the_module, the_fragment
+    icf_trace = []
+    icf_labels = []
+    try:
+        if frag.segment == 'CODE':
+            measure_code_fragment(m, frag)
+        else:
+            measure_data_fragment(m, frag, resize=False)
+        return (icf_trace, icf_labels)
+    finally:
+        icf_trace = icf_labels = None
+        the_module = the_fragment = None
+
+def fold_identical_fragments():
+    '''Merge the read-only data fragments and the code fragments that
+       emit the same bytes and reference the same targets (option --icf).
+       Local labels are identified by their rank in the fragment, other
+       labels by the fragment that defines them and their rank in this
+       fragment. Folding repeats until no new fragments can be merged
+       because merging fragments can make their callers identical.
+       The labels of a folded fragment are aliases for the labels
+       of the kept fragment (see define_folded_labels).'''
+    global icf_folds
+    traces = {}
+    deflabels = {}
+    cands = []
+    for m in module_list:
+        defs = deflabels[id(m)] = {}
+        for frag in m.code:
+            if frag.segment == 'COMMON' or not callable(frag.func):
+                continue
+            (trace, labels) = traces[id(frag)] = trace_fragment(m, frag)
+            for (i, sym) in enumerate(labels):
+                defs[sym] = (frag, i)
+            if frag.amin != None or frag.name.startswith('__glink_') or not frag.size:
+                continue
+            if frag.readonly or frag.segment == 'CODE' and not overlay_banks:
+                cands.append((m, frag))
+    canon = {}
+    def kept(m, frag):
+        while id(frag) in canon:
+            (m, frag) = canon[id(frag)]
+        return (m, frag)
+    def target(m, sym):
+        for mm in (m, exporters.get(sym)):
+            if mm and sym in deflabels[id(mm)]:
+                (frag, i) = deflabels[id(mm)][sym]
+                return (id(kept(mm, frag)[1]), i)
+        return (id(m), sym) if sym in m.symdefs else sym
+    def signature(m, frag):
+        (trace, labels) = traces[id(frag)]
+        local = { sym: i for (i, sym) in enumerate(labels) }
+        sig = [ frag.segment, m.cpu, frag.align, frag.nohop ]
+        for x in trace:
+            if isinstance(x, str):
+                sig.append(('L', local[x]) if x in local else target(m, x))
+            else:
+                sig.append(int(x))
+        return tuple(sig)
+    nbytes = 0
+    while True:
+        groups = {}
+        for (m, frag) in cands:
+            if id(frag) not in canon:
+                groups.setdefault(signature(m, frag), []).append((m, frag))
+        folded = 0
+        for group in groups.values():
+            (km, kfrag) = group[0]
+            for (m, frag) in group[1:]:
+                debug(f"folding {frag.segment} fragment '{frag.name}' from '{m.fname}' "
+                      f"into '{kfrag.name}' from '{km.fname}'")
+                canon[id(frag)] = (km, kfrag)
+                folded += 1
+                nbytes += frag.size
+        if not folded:
+            break
+    icf_folds = {}
+    for m in module_list:
+        code = []
+        for frag in m.code:
+            if id(frag) not in canon:
+                code.append(frag)
+                continue
+            (km, kfrag) = kept(m, frag)
+            aliases = list(zip(traces[id(frag)][1], traces[id(kfrag)][1]))
+            for (sym, ksym) in aliases:
+                m.labelfrags[sym] = kfrag
+            icf_folds[id(frag)] = (m, km, aliases)
+        m.code = code
+    debug(f"folded {len(canon)} identical fragments ({nbytes} bytes)")
+
+def define_folded_labels():
+    '''Define the labels of the folded fragments
+       as aliases for the labels of the kept fragments.'''
+    for (m, km, aliases) in icf_folds.values():
+        for (sym, ksym) in aliases:
+            if ksym in km.symdefs:
+                m.label(sym, km.symdefs[ksym])
+
+
 def check_undefined_symbols():
     und = {}
     comma = ", "
@@ -2292,6 +2786,539 @@ def check_undefined_symbols():
 
 
 
+# ------------- profile
+
+hot_fragments = {}
+hot_clusters = []
+
+def read_profile(pfile, ffile):
+    '''Read a profile file produced by gtsim option -prof and the
+       fragment map produced by glink option --frags when linking
+       the profiled program. Return a dictionary mapping pairs
+       (fragment name, module name) to the number of cycles spent
+       in the corresponding code. This is what gtprof does.'''
+    g = {}
+    with open(pfile, 'r') as fd:
+        exec(fd.read(), g)
+    prof = g['prof']
+    keys = sorted(prof.keys())
+    fspec = re.compile(r"^\s*([0-9a-f]+)-([0-9a-f]+).*CODE\s+(\S+)\s+(?:[0-9/()]*)\s*(\S*)")
+    cycles = {}
+    with open(ffile, 'r') as fd:
+        for line in fd:
+            match = fspec.match(line)
+            if match and keys:
+                saddr = int(match.group(1),16)
+                eaddr = int(match.group(2),16)
+                sk = bisect.bisect_left(keys, saddr)
+                stime = prof[keys[sk-1]] if sk else 0
+                ek = bisect.bisect_right(keys, eaddr)
+                etime = prof[keys[ek-1]] if ek else 0
+                if etime > stime:
+                    key = (match.group(3), match.group(4))
+                    cycles[key] = cycles.get(key, 0) + etime - stime
+    return cycles
+
+def find_code_fragment(m, sym):
+    '''Return the module and the code fragment named `sym'
+       as seen from module `m', or None.'''
+    for mm in (m, exporters.get(sym)):
+        if mm and mm.used:
+            for frag in mm.code:
+                if frag.segment == 'CODE' and frag.name == sym:
+                    return (mm, frag)
+    return None
+
+def compute_hot_clusters():
+    '''Select the hot code fragments according to the profile
+       specified with option --profile, then group them into clusters
+       made of a hot function and its hot callees that fit in a page.'''
+    global hot_fragments, hot_clusters
+    cycles = read_profile(args.profile, args.profile_frags)
+    byname = {}
+    for (name, mname) in cycles:
+        byname[name] = (mname,) if name not in byname else ()
+    frags = []
+    for m in module_list:
+        for frag in m.code:
+            if frag.segment == 'CODE' and not frag.amin:
+                c = cycles.get((frag.name, m.fname))
+                if c == None and byname.get(frag.name):
+                    c = cycles.get((frag.name, byname[frag.name][0]))
+                if c:
+                    frags.append((c, m, frag))
+    if not frags:
+        return warning(f"profile '{args.profile}' does not match any code fragment")
+    frags.sort(key = lambda x : -x[0])
+    total = sum(x[0] for x in frags)
+    hot_fragments = {}
+    acc = 0
+    for (c, m, frag) in frags:
+        if acc >= 0.9 * total:
+            break                   # hot fragments cover 90% of the cycles
+        acc += c
+        hot_fragments[id(frag)] = c
+        debug(f"hot code fragment '{frag.name}' ({c} cycles, {frag.size} bytes)")
+    hot_clusters = []
+    clustered = set()
+    for (c, m, frag) in frags:
+        if id(frag) in hot_fragments and id(frag) not in clustered:
+            clustered.add(id(frag))
+            cluster = [ (m, frag) ]
+            size = frag.size
+            callees = []
+            for sym in frag.refs:
+                mf = find_code_fragment(m, sym)
+                if mf and id(mf[1]) in hot_fragments and id(mf[1]) not in clustered:
+                    callees.append(mf)
+            callees.sort(key = lambda x : -hot_fragments[id(x[1])])
+            for (mm, ff) in callees:
+                if size + ff.size <= 256 and id(ff) not in clustered:
+                    clustered.add(id(ff))
+                    cluster.append((mm, ff))
+                    size += ff.size
+            hot_clusters.append(cluster)
+            if len(cluster) > 1:
+                debug(f"clustering hot code fragments {[f.name for (_,f) in cluster]} ({size} bytes)")
+
+
+# ------------- stack usage (options --stack-report and --shrink-stack)
+
+stack_direct = None
+stack_depths = {}
+stack_recursion = []
+stack_margin = 32               # headroom for _start and unexpected cases
+
+def stack_note(nbytes=0, pushes=0):
+    '''Called in pass 0 by the instructions that allocate `nbytes'
+       on the stack or push `pushes' bytes on the hardware stack.
+       Pushes only count when the hardware stack is the C stack.'''
+    if the_pass == 0 and the_fragment and icf_trace == None:
+        if isinstance(nbytes, int) and not isinstance(nbytes, Unk):
+            the_fragment.stack = max(the_fragment.stack, nbytes)
+        if SP == vSP:
+            the_fragment.pushes += pushes
+
+def stack_note_load(x, d):
+    '''Called in pass 0 when the address of symbol `x' has been
+       loaded for a call through register `d'.'''
+    global stack_direct
+    if the_pass == 0 and isinstance(x, str):
+        stack_direct = (the_fragment, the_pc, x, d)
+
+def stack_note_call(d):
+    '''Called in pass 0 by CALL(d). This is a direct call when the
+       instruction immediately follows the matching stack_note_load().
+       Otherwise the fragment is assumed to call any function whose
+       address is taken.'''
+    if the_pass == 0 and the_fragment:
+        st = stack_direct
+        if st and st[0] is the_fragment and st[1] == the_pc and st[3] == d:
+            the_fragment.calls.add((st[2], the_pc))
+        else:
+            the_fragment.indirect = True
+
+def stack_node(m, sym):
+    '''Return the call graph node (module, fragment, offset) for a call
+       to label `sym' as seen from module `m', or None.'''
+    mf = label_fragment(m, sym)
+    if mf and mf[1].segment == 'CODE':
+        return (mf[0], mf[1], mf[1].entries.get(sym, 0))
+    return None
+
+def compute_stack_depth():
+    '''Compute the maximal stack depth reached from each code fragment
+       using the frame sizes declared by _PROLOGUE and the call graph.
+       A call to a label inside a fragment only follows the calls located
+       after this label. Indirect calls are assumed to reach all the
+       functions whose address is taken. Each strongly connected component
+       of the call graph counts the frames of all its fragments once.
+       The components that contain a cycle of direct calls are recursive
+       and make the depths of their callers unbounded.'''
+    global stack_depths, stack_recursion
+    entries = [ stack_node(None, sym) for sym in (args.e, args.gt1exec) ]
+    taken = []
+    for m in module_list:
+        for frag in m.code:
+            for sym in frag.refs - set(c[0] for c in frag.calls):
+                node = stack_node(m, sym)
+                if node and node[1] is not frag and node not in entries and node not in taken:
+                    taken.append(node)
+    def successors(node, direct_only=False):
+        (m, frag, pc) = node
+        succ = []
+        for (sym, cpc) in sorted(frag.calls, key=str):
+            n = stack_node(m, sym)
+            if n and cpc >= pc and (n[1] is not frag or sym == frag.name):
+                succ.append(n)
+        if frag.indirect and not direct_only:
+            succ += taken
+        return succ
+    def components(roots, direct_only=False):
+        # Tarjan's algorithm: the components come out callees first
+        index = {}
+        low = {}
+        stack = []
+        comps = []
+        def visit(node):
+            key = (id(node[1]), node[2])
+            index[key] = low[key] = len(index)
+            stack.append(node)
+            for n in successors(node, direct_only):
+                nkey = (id(n[1]), n[2])
+                if nkey not in index:
+                    visit(n)
+                    low[key] = min(low[key], low[nkey])
+                elif n in stack:
+                    low[key] = min(low[key], index[nkey])
+            if low[key] == index[key]:
+                i = len(stack) - 1
+                while stack[i] is not node:
+                    i -= 1
+                comps.append(stack[i:])
+                del stack[i:]
+        for node in roots:
+            if (id(node[1]), node[2]) not in index:
+                visit(node)
+        return comps
+    roots = []
+    for m in module_list:
+        for frag in m.code:
+            if frag.segment == 'CODE':
+                roots.append((m, frag, 0))
+                roots += [ (m, frag, pc) for pc in sorted(set(frag.entries.values())) ]
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(max(limit, 4 * len(roots) + 100))
+    try:
+        comps = components(roots)
+        recursive = set()
+        stack_recursion = []
+        for comp in components(roots, direct_only=True):
+            (m, frag, pc) = comp[0]
+            if len(comp) > 1 or comp[0] in successors(comp[0], direct_only=True):
+                recursive.update((id(f), p) for (_, f, p) in comp)
+                stack_recursion.append((sorted(set(f.name for (_, f, _) in comp)), True))
+    finally:
+        sys.setrecursionlimit(limit)
+    stack_depths = {}
+    for comp in comps:
+        keys = [ (id(f), p) for (_, f, p) in comp ]
+        frags = { id(f): f for (_, f, _) in comp }
+        (depth, bounded) = (0, True)
+        for node in comp:
+            for n in successors(node):
+                nkey = (id(n[1]), n[2])
+                if nkey not in keys:
+                    (d, b) = stack_depths[nkey]
+                    (depth, bounded) = (max(depth, d), bounded and b)
+        bounded = bounded and not any(k in recursive for k in keys)
+        if len(comp) > 1 and not any(k in recursive for k in keys):
+            stack_recursion.append((sorted(frags[i].name for i in frags), False))
+        depth += sum(f.stack + f.pushes for f in frags.values())
+        for k in keys:
+            stack_depths[k] = (depth, bounded)
+
+def stack_entry_points():
+    '''Return the entry points as call graph nodes:
+       the program entry point, then the interrupt handler.'''
+    return [ n for n in (stack_node(None, args.e), stack_node(None, '_vIrqHandler')) if n ]
+
+def shrink_stack():
+    '''Give the heap the part of the stack area located below
+       `initsp' that the stack cannot reach (option --shrink-stack).
+       Return the reclaimed segment or None.'''
+    (depth, bounded) = (0, True)
+    for (m, frag, pc) in stack_entry_points():
+        (d, b) = stack_depths[(id(frag), pc)]
+        (depth, bounded) = (depth + d, bounded and b)
+    if not bounded:
+        return warning(f"cannot shrink the stack of a recursive program")
+    lo = 0
+    for s in segment_list:
+        if s.bank == None and s.saddr >= 0x100 and s.saddr < initsp:
+            lo = max(lo, s.eaddr)
+    hi = (initsp - depth - stack_margin) & ~0x3
+    if lo >= initsp or hi - lo < max(24, args.mhss or 24):
+        return None
+    debug(f"reclaiming stack area {hex(lo)}-{hex(hi)} for the heap")
+    s = Segment(lo, hi, 0x3)
+    segment_list.append(s)
+    return s
+
+def print_stack(reclaimed):
+    print("\nStack usage")
+    for (m, frag, pc) in stack_entry_points():
+        (d, b) = stack_depths[(id(frag), pc)]
+        print(f"\t{d:>6d}{' ' if b else '+'} bytes  {frag.name:<28s} {m.fname}")
+    for (names, direct) in stack_recursion:
+        kind = 'recursion' if direct else 'recursion through function pointers'
+        print(f"\t{kind}: {' '.join(names)}")
+    if reclaimed:
+        print(f"\t{reclaimed.eaddr - reclaimed.saddr:>6d}  bytes  reclaimed for the heap at {hex(reclaimed.saddr)}")
+
+
+# ------------- overlays
+
+far_thunks = {}
+overlay_runs = 8
+overlay_images = []
+
+def far_address(m, x, r, call):
+    '''Return the address that the current fragment must use to
+       reach label `x' of module `m' whose value is `r'. Labels of
+       banked code fragments are reached through a resident thunk
+       unless the reference comes from the same fragment or is a
+       direct call from a fragment of the same bank.'''
+    frag = m.labelfrags.get(x)
+    if not frag or frag.bank == None or frag is the_fragment:
+        return r
+    if call and the_fragment and the_fragment.bank == frag.bank:
+        return r
+    t = far_thunks.get((id(frag), x))
+    if not t:
+        return r
+    a = resolve(t)
+    return Unk(0xDEAD) if a == None else a
+
+def create_overlay_runtime():
+    '''Synthesize the resident module that switches banks for the far
+       calls and the onload function that copies the bank images.'''
+    if args.far_depth < 1:
+        fatal(f"option --far-call-depth must be positive")
+    fsp = zpage_alloc(2, "OVL:FARSP", 0x80)
+    if fsp == None:
+        fatal(f"cannot allocate the far call stack pointer in page zero")
+    def code_farcall():
+        # Called by the thunks with the caller return address in T2,
+        # the target address in T3, and the target bank bits in vAC.
+        # The return address and the caller control bits are saved
+        # on a dedicated stack because SP may be the vCPU stack.
+        # Overflowing this stack exits the program.
+        nohop()
+        label('_@_farcall')
+        STW(B0)
+        LDWI('.farlimit');STW(vLR)
+        LDW(fsp);SUBI(4);STW(fsp);SUBW(vLR);_BLT('.farovf')
+        LDW(T2);DOKE(fsp)
+        LDI(2);ADDW(fsp);STW(vLR)
+        LDWI('ctrlBits_v5');PEEK();DOKE(vLR)
+        ANDI(0x3c);ORW(B0);STW(B0)
+        LDWI('SYS_ExpanderControl_v4_40');STW('sysFn')
+        LDW(B0);SYS(40)
+        LDW(T3);CALL(vAC)
+        STW(T3)
+        LDWI('SYS_ExpanderControl_v4_40');STW('sysFn')
+        LDWI('ctrlBits_v5');PEEK();ANDI(0x3c);STW(T2)
+        LDI(2);ADDW(fsp);DEEK();ANDI(0xc0);ORW(T2);SYS(40)
+        LDW(fsp);DEEK();STW(vLR)
+        LDI(4);ADDW(fsp);STW(fsp)
+        LDW(T3);RET()
+        label('.farovf')
+        LDI(10);STW(R8);LDWI('.farmsg');STW(R9)
+        _CALLJ('_exitm')
+    def code_setup():
+        # Copy the bank images staged by the loader according
+        # to the records of table '_@_ovltable' patched by glink.
+        # Each record contains the number of pages, the destination
+        # bank bits, the destination page, and the source page.
+        nohop()
+        label('_@_ovlsetup')
+        PUSH()
+        LDWI('_@_farstack');STW(fsp)
+        LDWI('SYS_LSRW2_52');STW('sysFn')
+        LDWI('ctrlBits_v5');PEEK();SYS(52);ANDI(0x30);STW(R13)
+        LDWI('SYS_CopyMemoryExt_v6_100');STW('sysFn')
+        LDWI('_@_ovltable');STW(R9)
+        label('.ovlrun')
+        LDW(R9);PEEK();BEQ('.ovldone');STW(R10)
+        LDW(R9);ADDI(1);PEEK();ORW(R13);ST(R8+1);LDI(0);ST(R8)
+        LDW(R9);ADDI(2);PEEK();STW(R11)
+        LDW(R9);ADDI(3);PEEK();STW(R12)
+        LDI(4);ADDW(R9);STW(R9)
+        label('.ovlpage')
+        LDI(0);ST('sysArgs0');ST('sysArgs2')
+        LD(R11);ST('sysArgs1');ADDI(1);ST(R11)
+        LD(R12);ST('sysArgs3');ADDI(1);ST(R12)
+        LDW(R8);SYS(100)
+        LDW(R10);SUBI(1);STW(R10);BNE('.ovlpage')
+        BRA('.ovlrun')
+        label('.ovldone')
+        POP();RET()
+    def code_table():
+        label('_@_ovltable')
+        space(4 * overlay_runs + 1)
+    def code_stack():
+        label('.farlimit')
+        space(4 * args.far_depth)
+        label('_@_farstack')
+    def code_farmsg():
+        label('.farmsg') # "Far call overflow"
+        bytes(b'Far call overflow', 0)
+    m = Module(name='_overlays.s',
+               code=[ ('IMPORT', '_exitm'),
+                      ('EXPORT', '_@_farcall'),
+                      ('EXPORT', '_@_ovlsetup'),
+                      ('EXPORT', '_@_ovltable'),
+                      ('CODE', '_@_farcall', code_farcall),
+                      ('CODE', '_@_ovlsetup', code_setup),
+                      ('DATA', '_@_ovltable', code_table, 4 * overlay_runs + 1, 1),
+                      ('DATA', '.farmsg', code_farmsg, 0, 1, 'CONST'),
+                      ('BSS', '_@_farstack', code_stack, 4 * args.far_depth, 2) ] )
+    m.library = True                    # runtime code remains resident
+    debug(f"synthetizing module '_overlays.s' for banks {overlay_banks}")
+    args.onload.insert(0, '_@_ovlsetup')
+    args.r.append('_@_ovlsetup')
+    return m
+
+def label_fragment(m, sym):
+    '''Return the module and the fragment defining label `sym'
+       as seen from module `m', or None.'''
+    for mm in (m, exporters.get(sym)):
+        if mm and sym in mm.labelfrags:
+            return (mm, mm.labelfrags[sym])
+    return None
+
+def assign_overlay_banks():
+    '''Assign the code fragments of the non-library modules to the
+       overlay banks defined by the map. Fragments that call each other
+       are first clustered, heaviest call graph edges first, as long as
+       the clusters fit in a bank. Clusters are then packed into the banks
+       by decreasing sizes. Hot fragments (option --profile), placed
+       fragments, and the fragments defining the entry points
+       remain resident.'''
+    capacity = 0x7800                   # leave room for page fragmentation
+    roots = set([ args.e, args.gt1exec ] + args.r + args.onload)
+    frags = {}
+    for m in module_list:
+        if m.library:
+            continue
+        pinned = set(id(f) for (s, f) in m.labelfrags.items()
+                     if s in roots or s.startswith('__glink_magic_'))
+        for frag in m.code:
+            if frag.segment == 'CODE' and frag.amin == None and frag.size < capacity \
+               and id(frag) not in hot_fragments and id(frag) not in pinned:
+                frags[id(frag)] = (m, frag)
+    if not frags:
+        return warning(f"no code fragment can be assigned to overlay banks")
+    # call graph
+    edges = {}
+    for (m, frag) in frags.values():
+        for sym in frag.refs:
+            mf = label_fragment(m, sym)
+            if mf and id(mf[1]) in frags and mf[1] is not frag:
+                key = tuple(sorted((id(frag), id(mf[1]))))
+                edges[key] = edges.get(key, 0) + 1
+    # clustering
+    cluster = { i : [i] for i in frags }
+    csize = { i : frags[i][1].size for i in frags }
+    for (a, b) in sorted(edges, key = lambda k : (-edges[k], csize[k[0]] + csize[k[1]])):
+        ca = cluster[a]
+        cb = cluster[b]
+        sa = csize[ca[0]]
+        sb = csize[cb[0]]
+        if ca is not cb and sa + sb <= capacity:
+            ca.extend(cb)
+            csize[ca[0]] = sa + sb
+            for i in cb:
+                cluster[i] = ca
+    # packing
+    clusters = { id(c) : c for c in cluster.values() }.values()
+    room = { b : capacity for b in overlay_banks }
+    for c in sorted(clusters, key = lambda c : -csize[c[0]]):
+        for b in overlay_banks:
+            if csize[c[0]] <= room[b]:
+                room[b] -= csize[c[0]]
+                for i in c:
+                    frags[i][1].bank = b
+                break
+    for b in overlay_banks:
+        debug(f"overlay bank {b}: {capacity - room[b]} bytes of code")
+    ncross = sum(1 for (a, b) in edges if frags[a][1].bank != frags[b][1].bank)
+    debug(f"overlay assignment: {ncross} of {len(edges)} call graph edges cross banks")
+
+def create_overlay_thunks():
+    '''Synthesize a resident thunk for each entry point of a banked
+       code fragment that is referenced by another fragment. Entry points
+       are the labels named after the fragment and the exported labels.
+       Other labels, such as the targets of a switch table, are only
+       reachable from the same bank.'''
+    global far_thunks
+    refs = {}
+    for m in module_list:
+        for frag in m.code:
+            for sym in frag.refs:
+                refs.setdefault(sym, []).append((m, frag))
+    code = []
+    def thunk(name, m, sym, bank):
+        def code0():
+            nohop()
+            label(name)
+            LDW(vLR);STW(T2)
+            LDWI(m.symdefs.get(sym, Unk(0xDEAD)));STW(T3)
+            LDI(bank << 6);_CALLI('_@_farcall')
+        return code0
+    for m in module_list:
+        for (sym, frag) in m.labelfrags.items():
+            if frag.bank == None or sym != frag.name and sym not in m.exports:
+                continue
+            for (mm, ff) in refs.get(sym, []):
+                if ff is not frag and (mm is m or sym in m.exports):
+                    name = f"_@_far{len(far_thunks)}"
+                    far_thunks[(id(frag), sym)] = name
+                    code += [ ('EXPORT', name), ('CODE', name, thunk(name, m, sym, frag.bank)) ]
+                    break
+    if far_thunks:
+        m = Module(name='_thunks.s', code=[ ('IMPORT', '_@_farcall') ] + code)
+        debug(f"synthetizing module '_thunks.s' with {len(far_thunks)} far call thunks")
+        m.used = True
+        for sym in m.exports:
+            exporters[sym] = m
+        measure_fragments(m)
+        module_list.append(m)
+
+def stage_overlays():
+    '''Stage the bank images in the pages listed by the map and in the
+       free pages of the resident memory, then patch table '_@_ovltable'
+       with the runs of pages that '_@_ovlsetup' copies into the banks.'''
+    guard = (initsp & ~0xff) - 0x100    # stay away from the stack
+    spages = []
+    for (s, e) in overlay_staging or []:
+        spages += list(range(s >> 8, e >> 8))
+    for s in segment_list:
+        if s.bank == None and s.saddr >= 0x100 and not s.flags:
+            for p in range((s.pc + 0xff) >> 8, min(s.eaddr, guard) >> 8):
+                if p not in spages:
+                    spages.append(p)
+    runs = []
+    npages = 0
+    for b in overlay_banks:
+        image = bytearray(0x8000)
+        pages = set()
+        for s in segment_list:
+            if s.bank == b and s.buffer:
+                image[s.saddr - 0x8000 : s.saddr - 0x8000 + len(s.buffer)] = s.buffer
+                pages.update(range(s.saddr >> 8, (s.saddr + len(s.buffer) + 0xff) >> 8))
+        for p in sorted(pages):
+            if npages >= len(spages):
+                fatal(f"not enough free memory to stage the overlay banks")
+            sp = spages[npages]
+            npages += 1
+            overlay_images.append((sp << 8, image[(p - 0x80) << 8 : (p - 0x7f) << 8]))
+            r = runs[-1] if runs else None
+            if r and r[1] == b and r[2] + r[0] == p and r[3] + r[0] == sp:
+                r[0] += 1
+            else:
+                runs.append([1, b, p, sp])
+    if len(runs) > overlay_runs:
+        fatal(f"overlay bank images are too fragmented ({len(runs)} runs)")
+    addr = resolve('_@_ovltable')
+    for (n, b, p, sp) in runs:
+        doke_gt1(addr, n | (b << 14))
+        doke_gt1(addr + 2, p | (sp << 8))
+        addr += 4
+    debug(f"staging {npages} overlay pages in {len(runs)} runs")
+
+
 # ------------- passes
 
 class Stop(Exception):
@@ -2305,7 +3332,7 @@ def round_used_segments():
     for (i,s) in enumerate(segment_list):
         epage = (s.pc + 0xff) & ~0xff
         if s.pc > s.saddr and s.eaddr > epage:
-            segment_list.insert(i+1, Segment(epage, s.eaddr, s.flags))
+            segment_list.insert(i+1, Segment(epage, s.eaddr, s.flags, s.bank))
             s.eaddr = epage
             if args.d >= 2:
                 debug(f"rounding {segment_list[i:i+2]}")
@@ -2323,6 +3350,8 @@ def find_data_segment(size, align=None):
     for (i,s) in enumerate(segment_list):
         if amin == None and (s.flags & 0x2):  # not a data segment
             continue
+        if s.bank != None:                    # data is always resident
+            continue
         addr = aligned(s.pc, align)
         if amin != None and amin > addr:
             addr = aligned(amin, align)
@@ -2347,20 +3376,31 @@ def find_data_segment(size, align=None):
                 s.pc += 1
             s.pc = addr
         if addr > s.pc:                         # split the segment
-            ns = Segment(addr, s.eaddr, s.flags)
+            ns = Segment(addr, s.eaddr, s.flags, s.bank)
             s.eaddr = addr
             segment_list.insert(i+1, ns)
             s = ns
             i = i+1
         return s
 
-def find_code_segment(size):
+def find_code_segment(size, spread=False, page=None):
+    '''Find a segment for `size' bytes of code in a single page.
+       Segments are tried in order (first fit) unless option
+       --placement=best-fit is selected or the fragment is hot, and
+       the fragment has no placement constraints. Short code then goes
+       into the smallest page hole that fits. Long code (spread=True)
+       goes into the largest hole in order to reduce the number of hops.
+       A hole located in the preferred page `page' is always selected.'''
     size = min(256, size)
     amin = the_fragment.amin
     amax = the_fragment.amax
+    bestfit = amin == None and (args.placement == 'best-fit' or id(the_fragment) in hot_fragments)
+    best = None
     for (i,s) in enumerate(segment_list):
         if amin == None and s.flags & 0x1:  # not a code segment
             continue
+        if s.bank != the_fragment.bank:     # not in the fragment bank
+            continue
         if amin and amax and amin < 0x100 and amax >= 0x100:
             amin = 0x100                    # do not place code in page zero
         addr = s.pc
@@ -2381,66 +3421,102 @@ def find_code_segment(size):
             continue
         if amax != None and addr + size > amax + 1:
             continue
-        # possibly carve segment before address addr
-        if addr > s.pc:
-            ns = Segment(addr, s.eaddr, s.flags)
-            s.eaddr = addr
-            segment_list.insert(i+1, ns)
-            s = ns
-            i = i+1
-        # since code segments cannot cross page boundaries
-        # it is sometimes necessary to carve a code segment from a larger one
-        if s.eaddr > epage:
-            ns = Segment(epage, s.eaddr, s.flags)
-            s.eaddr = epage
-            segment_list.insert(i+1, ns)
-        return s
-    # not found
-    return None
+        room = min(epage, s.eaddr) - addr
+        if page != None and addr >> 8 == page:
+            best = (i, s, addr, epage, room)
+            break
+        if not best or bestfit and (room > best[4] if spread else room < best[4]):
+            best = (i, s, addr, epage, room)
+        if not bestfit and page == None:
+            break
+    if not best:
+        return None         # not found
+    (i, s, addr, epage, room) = best
+    # possibly carve segment before address addr
+    if addr > s.pc:
+        ns = Segment(addr, s.eaddr, s.flags, s.bank)
+        s.eaddr = addr
+        segment_list.insert(i+1, ns)
+        s = ns
+        i = i+1
+    # since code segments cannot cross page boundaries
+    # it is sometimes necessary to carve a code segment from a larger one
+    if s.eaddr > epage:
+        ns = Segment(epage, s.eaddr, s.flags, s.bank)
+        s.eaddr = epage
+        segment_list.insert(i+1, ns)
+    return s
 
 def assemble_code_fragments(m, placed=False, absolute=False):
-    global the_module, the_fragment, the_segment, the_pc
-    global hops_enabled, short_function
-    the_module = m
     for frag in m.code:
-        the_fragment = frag
         if frag.segment == 'CODE':
             if bool(frag.amin) != bool(placed):
                 continue
             if placed and bool(frag.amax) == absolute:
                 continue
-            funcsize = frag.size
-            the_segment = None
-            sfst = min(256, args.sfst or 96)
-            if frag.nohop or funcsize <= sfst:
-                short_function = True
-                hops_enabled = False
-                the_segment = find_code_segment(funcsize)
-                if frag.nohop and not the_segment:
-                    error(f"cannot find a segment for short code fragment '{frag.name}' of length {funcsize}")
-                if the_segment and (args.d >= 2 or final_pass):
-                    debug(f"assembling code fragment '{frag.name}' at {hex(the_segment.pc)} in {the_segment}")
-            if not the_segment:
-                short_function = False
-                hops_enabled = True
-                lfss = args.lfss or 32
-                the_segment = find_code_segment(min(lfss, 256))
-                if not the_segment:
-                    raise Stop(f"cannot fit code fragment '{frag.name}'")
-                if the_segment and (args.d >= 2 or final_pass):
-                    debug(f"assembling code fragment '{frag.name}' at {hex(the_segment.pc)} in {the_segment}")
-            the_pc = the_segment.pc
-            if args.fragments and final_pass:
-                record_fragment_address(the_pc)
-            try:
-                frag.func()
-            except Exception as err:
-                fatal(str(err), exc=True)
-            the_segment.pc = the_pc
-            if args.fragments and final_pass:
-                record_fragment_address(the_pc)
-            if args.rpth and labelchange_counter > args.rpth and not final_pass:
-                raise Stop(f"{labelchange_counter} changed labels already: restarting a new pass.")
+            assemble_code_fragment(m, frag)
+
+def unplaced_code_fragments():
+    '''Return the code fragments without placement constraints
+       in the order in which they should be placed. This is the module
+       order for the default first-fit placement, and the order of
+       decreasing sizes for the best-fit placement.'''
+    frags = []
+    for m in module_list:
+        for frag in m.code:
+            if frag.segment == 'CODE' and not frag.amin and id(frag) not in hot_fragments:
+                frags.append((m, frag))
+    if args.placement == 'best-fit':
+        frags.sort(key = lambda x : -x[1].size)
+    return frags
+
+def assemble_code_fragment(m, frag, page=None, reserve=0):
+    '''Assemble a code fragment and return its start address.
+       When the fragment fits in a page, it is placed in page `page'
+       if possible, in a hole of at least `reserve' bytes otherwise.'''
+    global the_module, the_fragment, the_segment, the_pc
+    global hops_enabled, short_function, peephole_state, peephole_jumpno
+    peephole_state = None
+    peephole_jumpno = 0
+    the_module = m
+    the_fragment = frag
+    funcsize = frag.size
+    the_segment = None
+    sfst = min(256, args.sfst or 96)
+    if args.placement == 'best-fit' and not args.sfst:
+        sfst = 256                      # try fitting all functions in a page
+    if id(frag) in hot_fragments:
+        sfst = 256                      # hot functions should not hop
+    if frag.nohop or funcsize <= sfst:
+        short_function = True
+        hops_enabled = False
+        the_segment = find_code_segment(max(funcsize, reserve), page=page)
+        if frag.nohop and not the_segment:
+            error(f"cannot find a segment for short code fragment '{frag.name}' of length {funcsize}")
+        if the_segment and (args.d >= 2 or final_pass):
+            debug(f"assembling code fragment '{frag.name}' at {hex(the_segment.pc)} in {the_segment}")
+    if not the_segment:
+        short_function = False
+        hops_enabled = True
+        lfss = args.lfss or 32
+        the_segment = find_code_segment(min(lfss, 256), spread=True)
+        if not the_segment:
+            raise Stop(f"cannot fit code fragment '{frag.name}'")
+        if the_segment and (args.d >= 2 or final_pass):
+            debug(f"assembling code fragment '{frag.name}' at {hex(the_segment.pc)} in {the_segment}")
+    the_pc = start = the_segment.pc
+    if args.fragments and final_pass:
+        record_fragment_address(the_pc)
+    try:
+        frag.func()
+    except Exception as err:
+        fatal(str(err), exc=True)
+    the_segment.pc = the_pc
+    if args.fragments and final_pass:
+        record_fragment_address(the_pc)
+    if args.rpth and labelchange_counter > args.rpth and not final_pass:
+        raise Stop(f"{labelchange_counter} changed labels already: restarting a new pass.")
+    return start
 
 def assemble_data_fragments(m, cseg, placed=False):
     global the_module, the_fragment, the_segment, hops_enabled, the_pc
@@ -2482,6 +3558,8 @@ def run_pass():
     segment_list = create_zpage_segments()
     for (s,e,d) in map_segments():
         segment_list.append(Segment(s,e,d))
+    for b in overlay_banks or []:
+        segment_list.append(Segment(0x8000, 0x10000, 0x6, b))
     debug(f"pass {the_pass}")
     try:
         # code segments with explicit address or placement constraints
@@ -2493,9 +3571,19 @@ def run_pass():
             assemble_data_fragments(m, 'DATA', placed=True)
         for m in module_list:
             assemble_data_fragments(m, 'BSS', placed=True)
+        # hot code segments (option --profile)
+        for cluster in hot_clusters:
+            # the first member reserves room for the whole cluster,
+            # the others then go into the same page when they fit
+            page = None
+            reserve = sum(frag.size for (m, frag) in cluster)
+            for (m, frag) in cluster:
+                addr = assemble_code_fragment(m, frag, page=page, reserve=reserve)
+                if page == None:
+                    (page, reserve) = (addr >> 8, 0)
         # remaining code segments
-        for m in module_list:
-            assemble_code_fragments(m, placed=False)
+        for (m, frag) in unplaced_code_fragments():
+            assemble_code_fragment(m, frag)
         # data segments
         for m in module_list:
             assemble_data_fragments(m, 'DATA')
@@ -2503,6 +3591,7 @@ def run_pass():
         # bss segments
         for m in module_list:
             assemble_data_fragments(m, 'BSS')
+        define_folded_labels()
     except Stop as stop:
         if final_pass or not labelchange_counter:
             fatal(stop.msg)
@@ -2515,11 +3604,28 @@ def run_pass():
 def run_passes():
     global final_pass
     final_pass = False
+    peephole_jumps.clear()
     while labelchange_counter:
         run_pass()
     final_pass = True
     run_pass()
 
+def run_baseline_passes():
+    '''Link with the default first-fit placement in order
+       to provide a baseline for option --hop-report.'''
+    global hopinfo, baseline_hopinfo, fraginfo, addrinfo
+    global hop_stubs, labelchange_counter
+    placement = args.placement
+    args.placement = 'first-fit'
+    debug("computing first-fit baseline for the hop report")
+    run_passes()
+    args.placement = placement
+    baseline_hopinfo = hopinfo
+    hopinfo = {}
+    fraginfo = {}
+    addrinfo = {}
+    hop_stubs = {}
+    labelchange_counter = 1
 
 # ------------- final
 
@@ -2556,6 +3662,8 @@ def process_magic_bss(s, head_module, head_addr):
             doke_gt1(s.saddr + 2, deek_gt1(head_addr))
             doke_gt1(head_addr, s.saddr)
 
+heap_segments = []
+
 def process_magic_heap(s, head_module, head_addr):
     '''Construct a linked list of heap segments.'''
     for s in segment_list:
@@ -2572,6 +3680,7 @@ def process_magic_heap(s, head_module, head_addr):
             doke_gt1(a0, a1 - a0)
             doke_gt1(a0 + 2, deek_gt1(head_addr))
             doke_gt1(head_addr, a0)
+            heap_segments.append((a0, a1))
 
 def process_magic_list(s, head_module, head_addr):
     '''Constructs a linked list of structures defined in modules.'''
@@ -2641,7 +3750,7 @@ def process_magic_symbols():
     if egt1_addr != None:
         egt1 = 0
         for s in segment_list:
-            if s.buffer and s.saddr + len(s.buffer) > egt1:
+            if s.buffer and s.bank == None and s.saddr + len(s.buffer) > egt1:
                 egt1 = s.saddr + len(s.buffer)
         debug(f"Last GT1 segments ends at address {hex(egt1)}\n")
         doke_gt1(egt1_addr, egt1)
@@ -2670,7 +3779,7 @@ def save_gt1(fname, start):
                 s.buffer = None
         # save segments
         for s in seglist:
-            if not s.buffer:
+            if not s.buffer or s.bank != None:
                 continue
             a0 = s.saddr
             pc = s.saddr + len(s.buffer)
@@ -2680,9 +3789,30 @@ def save_gt1(fname, start):
                 fd.write(builtins.bytes((hi(a0),lo(a0),len(buffer)&0xff)))
                 fd.write(buffer)
                 a0 = a1
+        # save staged overlay pages
+        for (a0, buffer) in overlay_images:
+            fd.write(builtins.bytes((hi(a0),lo(a0),len(buffer)&0xff)))
+            fd.write(buffer)
         fd.write(builtins.bytes((0, hi(start), lo(start))))
 
-def print_symbols(allsymbols=False):
+def compress_gt1(fname):
+    try:
+        import gt1z
+    except ImportError:
+        fatal(f"option --compress needs 'gt1z.py' next to 'glink.py'")
+    if overlay_images:
+        return warning(f"cannot compress '{fname}' because it contains banked overlays")
+    with open(fname, "rb") as fd:
+        data = fd.read()
+    try:
+        (zdata, report) = gt1z.compress(data)
+    except gt1z.Gt1zError as err:
+        return warning(f"cannot compress '{fname}': {err}")
+    with open(fname, "wb") as fd:
+        fd.write(zdata)
+    print(gt1z.describe(report))
+
+def collect_symbols(allsymbols=False):
     syms = []
     for m in module_list:
         for s in m.symdefs:
@@ -2691,6 +3821,10 @@ def print_symbols(allsymbols=False):
                 syms.append((m.symdefs[s], s, exported, m.fname))
     syms.sort(key = lambda x : x[0] )
     syms.sort(key = lambda x : x[1] )
+    return syms
+
+def print_symbols(allsymbols=False):
+    syms = collect_symbols(allsymbols)
     print("\nSymbol table")
     for s in syms:
         pp="public" if s[2] else "private"
@@ -2713,6 +3847,197 @@ def print_fragments():
             blen = f"({plen} byte{'s' if plen > 1 else ''})"
             print(f"\t{rng[0]:04x}-{rng[1]-1:04x} {blen:<14s} {cseg:<5s} {name:<28s} {m.fname:<22s}")
 
+def save_map_json(fname, segments):
+    '''Save a machine readable link map for option --map-json.
+       Argument `segments' lists the map segments (saddr, eaddr, pc, flags)
+       before the heap segments were allocated.'''
+    syms = []
+    for (addr, name, exported, mname) in collect_symbols():
+        syms.append({'name': name, 'address': addr, 'public': exported, 'module': mname})
+    frags = []
+    modules = {}
+    for rng in sorted(addrinfo.keys(), key = lambda x : x[0]):
+        (part, frag, m) = addrinfo[rng]
+        size = rng[1] - rng[0]
+        if size <= 0:
+            continue
+        f = {'name': frag.name, 'module': m.fname, 'segment': frag.segment,
+             'start': rng[0], 'end': rng[1], 'size': size }
+        if frag.segment == 'CODE':
+            f['part'] = part
+            f['parts'] = fraginfo[id(frag)][0]
+        for (addr, sz) in hop_stubs.items():
+            if addr >= rng[0] and addr < rng[1]:
+                f['hop_stub'] = { 'address': addr, 'size': sz }
+        frags.append(f)
+        msizes = modules.setdefault(m.fname, {'CODE': 0, 'DATA': 0, 'BSS': 0})
+        msizes[frag.segment] = msizes.get(frag.segment, 0) + size
+    zpage = []
+    for i in range(256):
+        if zpage and zpage[-1]['label'] == zpage_map[i] and zpage[-1]['end'] == i:
+            zpage[-1]['end'] = i + 1
+        else:
+            zpage.append({'start': i, 'end': i + 1, 'label': zpage_map[i]})
+    heap = [ {'start': a0, 'end': a1, 'size': a1 - a0} for (a0, a1) in heap_segments ]
+    segs = []
+    for (saddr, eaddr, pc, flags) in sorted(segments):
+        segs.append({'start': saddr, 'end': eaddr, 'used': pc - saddr,
+                     'free': eaddr - pc, 'flags': flags or 0})
+    jmap = { 'version': glccver.ver, 'map': args.map, 'rom': args.rom, 'cpu': args.cpu,
+             'entry': args.e, 'symbols': syms, 'fragments': frags, 'modules': modules,
+             'zeropage': zpage, 'heap': heap, 'segments': segs }
+    with open(fname, 'w') as fd:
+        json.dump(jmap, fd, indent=1)
+        fd.write('\n')
+
+def print_peephole():
+    if zpage_promoted:
+        print("\nZero page promotion")
+        for (m, frag, w) in zpage_promoted:
+            print(f"\t{frag.amin:04x} {frag.size:>2d} bytes {w:>9d} weight  {frag.segment:<5s} {frag.name:<24s} {m.fname}")
+    print("\nPeephole optimizations")
+    total = [0, 0, 0]
+    for (rule, (n, b, c)) in sorted(peephole_stats.items()):
+        print(f"\t{n:>5d} x {b:>6d} bytes {c:>7d} cycles  {rule}")
+        total = [total[0] + n, total[1] + b, total[2] + c]
+    (n, b, c) = total
+    print(f"\t{n:>5d} x {b:>6d} bytes {c:>7d} cycles  (total, static count)")
+
+def print_hops():
+    print(f"\nHop report ({args.placement} placement)")
+    base = baseline_hopinfo
+    total = [0, 0, 0, 0, 0, 0]
+    if base != None:
+        print(f"\t{'hops':>4s} {'lbrs':>4s} {'bytes':>5s}   {'first-fit':>14s} {'saved':>5s}  {'function':<28s} {'module':<22s}")
+    else:
+        print(f"\t{'hops':>4s} {'lbrs':>4s} {'bytes':>5s}  {'function':<28s} {'module':<22s}")
+    for m in module_list:
+        for frag in m.code:
+            if frag.segment != 'CODE':
+                continue
+            (h, l, b) = hopinfo.get(id(frag), (0, 0, 0))
+            (bh, bl, bb) = base.get(id(frag), (0, 0, 0)) if base != None else (0, 0, 0)
+            if h + l + bh + bl == 0:
+                continue
+            for (i, n) in enumerate((h, l, b, bh, bl, bb)):
+                total[i] += n
+            if base != None:
+                bstr = f"{bh:>4d} {bl:>4d} {bb:>4d}"
+                print(f"\t{h:>4d} {l:>4d} {b:>5d}   {bstr:>14s} {bb-b:>5d}  {frag.name:<28s} {m.fname:<22s}")
+            else:
+                print(f"\t{h:>4d} {l:>4d} {b:>5d}  {frag.name:<28s} {m.fname:<22s}")
+    (h, l, b, bh, bl, bb) = total
+    if base != None:
+        bstr = f"{bh:>4d} {bl:>4d} {bb:>4d}"
+        print(f"\t{h:>4d} {l:>4d} {b:>5d}   {bstr:>14s} {bb-b:>5d}  {'(total)':<28s}")
+    else:
+        print(f"\t{h:>4d} {l:>4d} {b:>5d}  {'(total)':<28s}")
+
+
+# ------------- link server (option --server)
+
+def preload_files():
+    '''Compile the libraries and the maps found in the glcc directory.'''
+    for fn in ('interface.json', 'interface-dev.json', 'roms.json'):
+        read_json(os.path.join(lccdir, fn))
+    for d in sorted(os.listdir(lccdir)):
+        if d.startswith('cpu') or d.startswith('map'):
+            d = os.path.join(lccdir, d)
+            for fn in sorted(os.listdir(d)) if os.path.isdir(d) else []:
+                if fn.endswith('.a') or fn.endswith('.py'):
+                    compile_file(os.path.join(d, fn))
+
+def refresh_files():
+    '''Recompile the cached files that have changed since last time.'''
+    for f in list(compiled_files):
+        if not os.access(f, os.R_OK):
+            del compiled_files[f]
+        elif f.endswith('.json'):
+            read_json(f)
+        else:
+            compile_file(f)
+
+def serve_request(conn):
+    '''Run a link request in a forked server process. The request
+       carries the client's argument, directory, and environment, and
+       comes with its standard file descriptors. The exit status is
+       reported to the client, status 1 when the request fails.'''
+    import socket, array
+    status = 1
+    try:
+        fds = array.array('i')
+        (msg, anc, _, _) = conn.recvmsg(65536, socket.CMSG_SPACE(3 * fds.itemsize))
+        for (level, kind, data) in anc:
+            if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+                fds.frombytes(data[:len(data) - (len(data) % fds.itemsize)])
+        while True:
+            data = conn.recv(65536)
+            if not data:
+                break
+            msg += data
+        req = json.loads(msg.decode())
+        for (i, fd) in enumerate(fds[:3]):
+            os.dup2(fd, i)
+            os.close(fd)
+        os.chdir(req['cwd'])
+        os.environ.clear()
+        os.environ.update(req['env'])
+        try:
+            status = glink(req['argv'])
+        except SystemExit as err:
+            status = err.code
+        status = status if isinstance(status, int) else 0 if status == None else 1
+    except BaseException as err:
+        print(f"glink: fatal error: link server: {err}", file=sys.stderr)
+        status = 1
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            conn.sendall(str(status).encode())
+            conn.close()
+        except BaseException:
+            pass
+    return status
+
+def glink_server(path):
+    '''Serve link requests on Unix socket `path'. Each request runs in
+       a forked process that inherits the compiled libraries and maps
+       but starts with pristine linker state.'''
+    import socket, signal
+    if not hasattr(os, 'fork') or not hasattr(socket, 'AF_UNIX'):
+        fatal(f"option --server is not supported on this platform")
+    preload_files()
+    if os.path.exists(path):
+        os.unlink(path)
+    srv = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    srv.bind(path)
+    srv.listen(16)
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda sig, frame: sys.exit(0))
+    print(f"glink: serving link requests on '{path}'", file=sys.stderr)
+    try:
+        while True:
+            (conn, _) = srv.accept()
+            refresh_files()
+            if os.fork() == 0:
+                # the child must never reach the finally clause below,
+                # which removes the socket of the server
+                status = 1
+                try:
+                    srv.close()
+                    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+                    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                    status = serve_request(conn)
+                finally:
+                    os._exit(status)
+            conn.close()
+    except KeyboardInterrupt:
+        return 0
+    finally:
+        srv.close()
+        os.unlink(path)
+
 
 # ------------- main function
 
@@ -2783,6 +4108,9 @@ def glink(argv):
                             help='outputs a sorted list of all symbols, including generated ones')
         parser.add_argument('--fragments', '--frags', action='store_const', dest='fragments', const=2,
                             help='outputs a memory map with all the allocated fragments')
+        parser.add_argument('--map-json', dest='map_json', metavar='JSONFILE',
+                            type=str, action='store',
+                            help='writes a machine readable link map into a json file')
         parser.add_argument('--entry', '-e', dest='e', metavar='START',
                             type=str, action='store', default='_start',
                             help='select the entry point symbol (default _start)')
@@ -2799,11 +4127,51 @@ def glink(argv):
         parser.add_argument('--long-function-segment-size', dest='lfss',
                             metavar='SIZE', type=int, action='store',
                             help='minimal segment size for functions split across segments.')
+        parser.add_argument('--placement', dest='placement', type=str, action='store',
+                            choices=('first-fit', 'best-fit'), default='first-fit',
+                            help='select the code placement strategy. Best-fit places functions '
+                            'by decreasing size in the tightest page holes in order to reduce hops.')
+        parser.add_argument('--hop-report', action='store_true',
+                            help='outputs the hops and long branches of each function, '
+                            'compared with the first-fit placement when applicable.')
+        parser.add_argument('--profile', dest='profile', metavar='PROF',
+                            type=str, action='store',
+                            help='place the hot functions according to a profile file '
+                            'produced by gtsim option -prof. This requires option --profile-frags.')
+        parser.add_argument('--profile-frags', dest='profile_frags', metavar='FRAGS',
+                            type=str, action='store',
+                            help='fragment map produced by option --frags when '
+                            'linking the profiled program.')
+        parser.add_argument('-O', dest='O', action='store_true',
+                            help='remove redundant loads, stores and jumps')
+        parser.add_argument('--peephole-report', action='store_true',
+                            help='outputs the bytes and cycles saved by options -O and --zp-promote')
+        parser.add_argument('--zp-promote', action='store_true',
+                            help='move the most accessed small variables into the free zero page locations')
+        parser.add_argument('--gc-fragments', action='store_true',
+                            help='remove the code and data fragments that are not referenced')
+        parser.add_argument('--icf', action='store_true',
+                            help='merge identical code fragments and identical read-only data '
+                            'fragments (string literals, static const data, switch tables). '
+                            'Pointers to merged functions compare equal.')
+        parser.add_argument('--stack-report', action='store_true',
+                            help='outputs the maximal stack depth of the entry points '
+                            'and the recursive functions')
+        parser.add_argument('--shrink-stack', action='store_true',
+                            help='give the heap the part of the stack area '
+                            'that the stack cannot reach')
+        parser.add_argument('--compress', action='store_true',
+                            help='compress the gt1 file with a self-extracting stub '
+                            'and report the load and decompression times')
         parser.add_argument('--no-runtime-bss-initialization', action='store_true',
                             help='cause all bss segments to go as zeroes in the gt1 file')
         parser.add_argument('--minimal-heap-segment-size', dest='mhss',
                             metavar='SIZE', type=int, action='store',
                             help='minimal heap segment size for __glink_magic_heap.')
+        parser.add_argument('--far-call-depth', dest='far_depth',
+                            metavar='DEPTH', type=int, action='store', default=32,
+                            help='maximal nesting of the calls that cross overlay banks (default 32). '
+                            'Deeper far calls exit the program with code 10.')
         parser.add_argument('--labelchange-threshold', dest='rpth',
                             metavar='LBLCHG', type=int, action='store', default=200,
                             help='restart a pass whenever the label change counter reach this threshold')
@@ -2814,13 +4182,23 @@ def glink(argv):
                             help='add directories to search linker maps')
         parser.add_argument('--debug-messages', '-d', dest='d', action='count', default=0,
                             help='enable debugging output. repeat for more.')
+        parser.add_argument('--server', type=str, action='store', metavar='SOCKET',
+                            help='serve link requests on a unix socket. '
+                            'The glink command forwards its arguments to this server '
+                            'when variable GLINK_SERVER names the socket.')
 
         args = parser.parse_args(argv)
+        if args.server:
+            return glink_server(args.server)
 
         # process args
         read_rominfo(args.rom)
         args.cpu = args.cpu or romcpu or 5
         args.files = args.files or []
+        global optimize
+        optimize = args.O
+        if args.map_json and not args.fragments:
+            args.fragments = 1  # collect fragments without printing them
         read_interface()
         create_zpage_map()
         create_mulq_map()
@@ -2891,6 +4269,10 @@ def glink(argv):
             map_modules(romtype)
             module_list += new_modules
 
+        # load the overlay runtime when the map defines overlay banks
+        if overlay_banks:
+            module_list.append(create_overlay_runtime())
+
         # load libraries requested by the map
         global map_libraries
         if map_libraries:
@@ -2908,15 +4290,44 @@ def glink(argv):
         if error_counter > 0:
             print(f"glink: {error_counter} error(s) {warning_counter} warning(s)")
             return 1
+        if args.gc_fragments:
+            collect_garbage_fragments()
+        if args.icf:
+            fold_identical_fragments()
+
+        # profile guided placement
+        if args.profile and not args.profile_frags:
+            fatal(f"option --profile requires option --profile-frags")
+        if args.profile:
+            compute_hot_clusters()
+
+        # zero page promotion
+        if args.zp_promote:
+            promote_zero_page()
+
+        # overlay banks
+        if overlay_banks:
+            assign_overlay_banks()
+            create_overlay_thunks()
+
+        # stack usage
+        if args.stack_report or args.shrink_stack:
+            compute_stack_depth()
 
         # generate
+        if args.hop_report and args.placement != 'first-fit':
+            run_baseline_passes()
         run_passes()
         if error_counter > 0:
             print(f"glink: {error_counter} error(s) {warning_counter} warning(s)")
             return 1
 
         # magic happens here
+        reclaimed = shrink_stack() if args.shrink_stack else None
+        segments = [ (s.saddr, s.eaddr, s.pc, s.flags) for s in segment_list ]
         process_magic_symbols()
+        if overlay_banks:
+            stage_overlays()
 
         # verification
         for s in segment_list:
@@ -2925,10 +4336,20 @@ def glink(argv):
 
         # output
         save_gt1(args.o, args.gt1exec)
+        if args.compress:
+            compress_gt1(args.o)
         if args.symbols:
             print_symbols(allsymbols=args.symbols>1)
-        if args.fragments:
+        if args.fragments and args.fragments > 1:
             print_fragments()
+        if args.map_json:
+            save_map_json(args.map_json, segments)
+        if args.hop_report:
+            print_hops()
+        if args.peephole_report:
+            print_peephole()
+        if args.stack_report:
+            print_stack(reclaimed)
         return 0
 
     except FileNotFoundError as err:
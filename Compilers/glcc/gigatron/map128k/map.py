@@ -8,6 +8,13 @@ def map_describe():
   Because of either the hardware patch or the special ROM, the pixels are
   located in bank 1 while the vCPU sees bank 2. Program code and data can
   then use the entire 64k addressable by the Gigatron CPU.
+
+  Overlay 'ovl' keeps the data, the stack, and the library code below
+  0x8000 and assigns the code of the program modules to banks 2 and 3,
+  both mapped at 0x8000. Calls across banks go through resident thunks
+  that switch banks. Pointers to banked functions designate the thunks.
+  Far calls can nest 32 deep, or as set by linker option --far-call-depth.
+  Deeper far calls exit the program with code 10.
 ''')
 
 # Note: this map compiles a small stub in 0x200 that checks that the
@@ -0,0 +1,26 @@
+
+# Overlay 'ovl' keeps the resident code, the data, and the stack below
+# 0x8000 and lets glink assign the code of the non-library modules to
+# banks 2 and 3, mapped in turn at 0x8000-0xffff. Calls that cross
+# banks go through resident thunks that switch banks and return.
+# The bank images are staged in bank 1 (the future video memory) and
+# in the free resident pages, then copied by the onload function
+# '_@_ovlsetup' before '_map128ksetup' takes bank 1 for the screen.
+
+# ------------size----addr----step----end---- flags (1=nocode, 2=nodata, 4=noheap)
+segments = [ (0x00fa, 0x0200, 0x0100, 0x0500, 0),
+             (0x0200, 0x0500, None,   None,   0),
+             (0x7800, 0x0800, None,   None,   0) ]
+
+initsp = 0x7ffc
+
+overlay_banks = [ 2, 3 ]
+
+# Page 0x82 is not used for staging because loading it
+# overwrites the stub at 0x200 on a 32KB machine.
+overlay_staging = [ (0x8000, 0x8200), (0x8300, 0x10000) ]
+
+# Local Variables:
+# mode: python
+# indent-tabs-mode: ()
+# End:
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+
+#   Copyright (c) 2026, the glcc contributors
+#
+#    Redistribution and use in source and binary forms, with or
+#    without modification, are permitted provided that the following
+#    conditions are met:
+#
+#    1.  Redistributions of source code must retain the above copyright
+#        notice, this list of conditions and the following disclaimer.
+#
+#    2. Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials
+#       provided with the distribution.
+#
+#    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND
+#    CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES,
+#    INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+#    MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+#    DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS
+#    BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+#    EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED
+#    TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+#    DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+#    ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+#    OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+#    OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+#    POSSIBILITY OF SUCH DAMAGE.
+
+import argparse, json, os, re, subprocess, sys, time
+from concurrent.futures import ProcessPoolExecutor
+
+top = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+def load_roms():
+    '''Return a dictionary mapping rom names to their cpu.'''
+    with open(os.path.join(top, 'gigatron', 'roms.json')) as fd:
+        roms = json.load(fd)
+    cpus = {}
+    def cpu(r):
+        if 'cpu' in roms[r]:
+            return int(roms[r]['cpu'])
+        return cpu(roms[r]['inherits'])
+    for r in roms:
+        if isinstance(roms[r], dict):
+            cpus[r] = cpu(r)
+    return cpus
+
+def collect_tests(args):
+    '''Return the list of tests as tuples (suite, name, source, input, baseline).
+       Suite 'tst' runs the lcc test programs, suite 'runtime' runs the
+       runtime tests, suite 'stuff' only checks that the programs link,
+       suite 'sbk' checks the assembly code and diagnostics of the
+       lcc test programs, and suite 'glink' links the modules of each
+       directory of gigatron/tst/glink with the options listed in its
+       file 'options' and compares the output with its file 'NAME.out'.
+       Suites 'sbk', 'stuff' and 'glink' only run with rom dev7, like
+       the makefiles. Paths are relative to the glcc top.'''
+    tests = []
+    g = 'gigatron'
+    for fn in sorted(os.listdir(os.path.join(top, g, 'tst'))):
+        (name, ext) = os.path.splitext(fn)
+        src = os.path.join('tst', name + '.c')
+        if ext == '.1bk':
+            tests.append(('tst', name, src, os.path.join('tst', name + '.0'), os.path.join(g, 'tst', fn)))
+        elif ext == '.2bk':
+            tests.append(('sbk', name, src, None, os.path.join(g, 'tst', name)))
+    d = os.path.join(g, 'runtime', 'tst')
+    for fn in sorted(os.listdir(os.path.join(top, d))):
+        if fn.startswith('TST') and fn.endswith('.c'):
+            name = fn[:-2]
+            tests.append(('runtime', name, os.path.join(d, fn), None, os.path.join(d, name + '.out')))
+    d = os.path.join(g, 'tst', 'glink')
+    for name in sorted(os.listdir(os.path.join(top, d))):
+        tests.append(('glink', name, os.path.join(d, name), None, os.path.join(d, name, name + '.out')))
+    d = os.path.join('stuff', 'tst')
+    for fn in sorted(os.listdir(os.path.join(top, d))):
+        if fn.startswith('TST') and fn.endswith('.c'):
+            tests.append(('stuff', fn[:-2], os.path.join(d, fn), None, None))
+    if args.suites:
+        tests = [ t for t in tests if t[0] in args.suites ]
+    if args.tests:
+        tests = [ t for t in tests if t[1] in args.tests ]
+    return tests
+
+def run(cmd, stdin=None, timeout=None):
+    if stdin:
+        with open(os.path.join(top, stdin), 'rb') as fd:
+            return subprocess.run(cmd, cwd=top, stdin=fd, stdout=subprocess.PIPE,
+                                  stderr=subprocess.PIPE, timeout=timeout)
+    return subprocess.run(cmd, cwd=top, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                          stderr=subprocess.PIPE, timeout=timeout)
+
+def read(fn):
+    with open(os.path.join(top, fn), 'rb') as fd:
+        return fd.read()
+
+def profile_options(cmd, opts, srcs, base, gtsim, rom, timeout):
+    '''Substitute the fragment map and the profile of a first link
+       for the placeholders {frags} and {prof} in options `opts'.'''
+    if not any('{' in o for o in opts):
+        return opts
+    train = [ o for o in opts if '{' not in o ] + [ '-Wl--frags', '-o', base + '-train.gt1' ]
+    p = run(cmd + train + srcs, timeout=timeout)
+    with open(base + '.frags', 'wb') as fd:
+        fd.write(p.stdout)
+    run([ gtsim, '-rom', os.path.join(top, 'gigatron', 'roms', rom + '.rom'),
+          '-prof', base + '.prof', base + '-train.gt1' ], timeout=timeout)
+    return [ o.format(frags=base + '.frags', prof=base + '.prof') for o in opts ]
+
+def run_test(job):
+    '''Compile, link and run one test. Return a result dictionary.'''
+    ((suite, name, src, stdin, baseline), rom, cpu, mapname, build, timeout) = job
+    res = { 'suite': suite, 'test': name, 'rom': rom, 'cpu': cpu, 'map': mapname,
+            'status': 'pass', 'cycles': None, 'size': None, 'message': '' }
+    build = os.path.abspath(build)
+    glcc = os.path.join(build, 'glcc')
+    gtsim = os.path.join(build, 'gtsim')
+    tag = f"{rom}-cpu{cpu}-{mapname.replace(',', '+')}"
+    wdir = os.path.join(build, 'tstrun', tag)
+    os.makedirs(wdir, exist_ok=True)
+    base = os.path.join(wdir, f"{suite}-{name}")
+    opts = [ f"-rom={rom}", f"-cpu={cpu}" ]
+    t0 = time.time()
+    try:
+        if suite == 'sbk':
+            p = run([ glcc, '-S', f"-rom={rom}" ] + [ '-o', base + '.s', src ], timeout=timeout)
+            if p.stderr != read(baseline + '.2bk'):
+                res.update(status='fail', message='diagnostics differ from .2bk')
+            elif os.path.exists(baseline + '.sbk') and read(base + '.s') != read(baseline + '.sbk'):
+                res.update(status='fail', message='assembly differs from .sbk')
+            return res
+        if suite == 'stuff':
+            mapname = res['map'] = '32k'
+        if suite == 'runtime':
+            opts.append(f"-DROM={rom}")
+        srcs = [ src ]
+        if suite == 'glink':
+            srcs = sorted(os.path.join(src, f) for f in os.listdir(os.path.join(top, src)) if f.endswith('.c'))
+            opts += read(os.path.join(src, 'options')).decode().split()
+            opts = profile_options([ glcc, f"-map={mapname}" ], opts, srcs, base, gtsim, rom, timeout)
+        p = run([ glcc, f"-map={mapname}" ] + opts + [ '-o', base + '.gt1' ] + srcs, timeout=timeout)
+        if p.returncode != 0:
+            res.update(status='error', message=p.stderr.decode(errors='replace').strip().split('\n')[-1])
+            return res
+        res['size'] = os.path.getsize(base + '.gt1')
+        if suite == 'stuff':
+            return res
+        p = run([ gtsim, '-rom', os.path.join(top, 'gigatron', 'roms', rom + '.rom'),
+                  '-prof', base + '.prof', base + '.gt1' ], stdin=stdin, timeout=timeout)
+        out = p.stdout
+        m = re.search(rb'\ntotal ([0-9]+) cycles \(with video & overhead\)\n$', out)
+        if m:
+            res['cycles'] = int(m.group(1))
+            out = out[:m.start()]
+        if out != read(baseline):
+            res.update(status='fail', message=f"output differs from {os.path.basename(baseline)}")
+    except subprocess.TimeoutExpired:
+        res.update(status='error', message='timeout')
+    finally:
+        res['time'] = round(time.time() - t0, 3)
+    return res
+
+def compare(results, old, threshold):
+    '''Print the cycle count changes larger than threshold percent.'''
+    key = lambda r : (r['suite'], r['test'], r['rom'], r['cpu'], r['map'])
+    prev = { key(r): r for r in old['results'] }
+    changes = 0
+    for r in results:
+        o = prev.get(key(r))
+        if o and o.get('cycles') and r['cycles']:
+            d = 100.0 * (r['cycles'] - o['cycles']) / o['cycles']
+            if abs(d) > threshold:
+                changes += 1
+                print(f"\t{d:+7.2f}% {o['cycles']:>12d} {r['cycles']:>12d}  "
+                      f"{r['suite']}/{r['test']} {r['rom']} cpu{r['cpu']} {r['map']}")
+    return changes
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        usage='runtests.py [options]',
+        description='Runs the glcc test programs under gtsim in parallel '
+        'for a matrix of roms, cpus and maps.',
+        epilog='The exit status is 1 when a test fails.')
+    parser.add_argument('--build', type=str, default=os.path.join(top, 'build'),
+                        help='glcc build directory (default: build)')
+    parser.add_argument('--roms', type=str, default=None,
+                        help='comma separated roms (default: all roms in gigatron/roms)')
+    parser.add_argument('--cpus', type=str, default=None,
+                        help="comma separated cpus (default: each rom's cpu)")
+    parser.add_argument('--maps', type=str, default='sim+allout',
+                        help="comma separated maps, with '+' for map overlays (default: sim+allout)")
+    parser.add_argument('--suites', type=str, action='append',
+                        help='restrict to suites tst, sbk, runtime, stuff, or glink')
+    parser.add_argument('--tests', type=str, action='append',
+                        help='restrict to the named tests')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+                        help='number of parallel jobs (default: number of cpus)')
+    parser.add_argument('--timeout', type=int, default=600,
+                        help='timeout in seconds for each command')
+    parser.add_argument('--json', type=str, metavar='FILE',
+                        help='write a json summary with the cycle counts')
+    parser.add_argument('--compare', type=str, metavar='FILE',
+                        help='report the cycle count changes against a previous json summary')
+    parser.add_argument('--threshold', type=float, default=0.0,
+                        help='only report cycle count changes larger than this percentage')
+    args = parser.parse_args(argv)
+    roms = load_roms()
+    romlist = args.roms.split(',') if args.roms else \
+        sorted(f[:-4] for f in os.listdir(os.path.join(top, 'gigatron', 'roms')) if f.endswith('.rom'))
+    maps = [ m.replace('+', ',') for m in args.maps.split(',') ]
+    tests = collect_tests(args)
+    jobs = []
+    for rom in romlist:
+        cpus = [ int(c) for c in args.cpus.split(',') ] if args.cpus else [ roms[rom] ]
+        for cpu in cpus:
+            if cpu > roms[rom]:
+                continue
+            for t in tests:
+                if t[0] in ('sbk', 'stuff', 'glink') and (rom != 'dev7' or cpu != roms[rom]):
+                    continue
+                for (i, m) in enumerate(maps):
+                    if t[0] in ('sbk', 'stuff', 'runtime', 'glink') and i > 0:
+                        continue
+                    jobs.append((t, rom, cpu, 'sim' if t[0] in ('runtime', 'glink') else m,
+                                 args.build, args.timeout))
+    t0 = time.time()
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        results = list(pool.map(run_test, jobs))
+    elapsed = time.time() - t0
+    counts = { 'pass': 0, 'fail': 0, 'error': 0 }
+    for r in results:
+        counts[r['status']] += 1
+        if r['status'] != 'pass':
+            print(f"{r['status'].upper()}: {r['suite']}/{r['test']} rom={r['rom']} "
+                  f"cpu={r['cpu']} map={r['map']}: {r['message']}")
+    print(f"{len(results)} tests: {counts['pass']} passed, {counts['fail']} failed, "
+          f"{counts['error']} errors in {elapsed:.1f}s")
+    if args.compare:
+        with open(args.compare) as fd:
+            old = json.load(fd)
+        print("\nCycle count changes")
+        compare(results, old, args.threshold)
+    if args.json:
+        with open(args.json, 'w') as fd:
+            json.dump({ 'counts': counts, 'elapsed': round(elapsed, 1),
+                        'results': results }, fd, indent=1)
+    return 0 if counts['fail'] + counts['error'] == 0 else 1
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
+
+# Local Variables:
+# mode: python
+# indent-tabs-mode: ()
+# End:
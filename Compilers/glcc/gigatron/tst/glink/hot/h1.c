@@ -0,0 +1,23 @@
+#include <stdio.h>
+
+/* Hot function calling a hot function of another module */
+extern int g(int);
+
+int f(int n)
+{
+  int i, s = 0;
+  for (i = 0; i < n; i++)
+    s += (i ^ n) + (i << 2) + g(i);
+  return s;
+}
+
+int main()
+{
+  int i;
+  long s = 0;
+  for (i = 0; i < 200; i++)
+    s += f(20);
+  printf("%ld\n", s);
+  printf("f and g %s\n", (((unsigned)f ^ (unsigned)g) >> 8) ? "in different pages" : "in the same page");
+  return 0;
+}
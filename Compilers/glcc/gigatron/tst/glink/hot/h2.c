@@ -0,0 +1,4 @@
+int g(int i)
+{
+  return i + 1;
+}
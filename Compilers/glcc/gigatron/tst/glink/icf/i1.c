@@ -0,0 +1,12 @@
+/* Writable array, identical to buf2 in i2.c */
+char buf1[] = "hello world";
+
+void poke(void)
+{
+  buf1[0] = 'X';
+}
+
+const char *literal1(void)
+{
+  return "identical literal";
+}
@@ -0,0 +1,20 @@
+#include <stdio.h>
+
+/* Writable array, identical to buf1 in i1.c, which must not alias it */
+char buf2[] = "hello world";
+
+extern void poke(void);
+extern const char *literal1(void);
+
+const char *literal2(void)
+{
+  return "identical literal";
+}
+
+int main()
+{
+  poke();
+  printf("%s\n", buf2);
+  printf("literals %s\n", (literal1() == literal2()) ? "folded" : "not folded");
+  return 0;
+}
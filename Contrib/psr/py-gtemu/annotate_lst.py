@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""Annotate a ROM listing with execution counts
+
+Merges the counts written by Gigatron.save_rom_profile() into the .lst file
+that asm.writeRomFiles() produces. Each instruction gets its execution count
+in a column to the left, lines standing for a run of repeated instructions
+get the total for the run, and each label gets a line with the total for its
+block, which extends up to the next label.
+
+Usage: annotate_lst.py ROM.lst COUNTS [OUTPUT]
+"""
+
+import argparse
+import re
+import sys
+
+# An instruction line: label, address and encoding at fixed columns
+_INSTRUCTION = re.compile(r"^(.{13}) ([0-9a-f]{4}) [0-9a-f]{4}  \S")
+# Instructions that asm.writeRomFiles() abbreviates
+_REPETITION = re.compile(r"^ {13} \* (\d+) times$")
+# The final line, holding the end address
+_END = re.compile(r"^ {14}([0-9a-f]{4})$")
+# A label on a line of its own
+_LABEL = re.compile(r"^([^\s*][^\s:]*):(\s|$)")
+
+_COLUMN = 12
+
+
+def read_counts(path):
+    """Read a file written by Gigatron.save_rom_profile() into a dictionary"""
+    counts = {}
+    with open(path) as fp:
+        for line in fp:
+            address, count = line.split()
+            counts[int(address, 16)] = int(count)
+    return counts
+
+
+def read_labels(path):
+    """Read the labels of a listing into a dictionary mapping addresses to labels"""
+    with open(path, encoding="utf-8") as fp:
+        return {
+            addresses.start: label for _, addresses, label in _parse(fp) if label
+        }
+
+
+def _parse(lines):
+    """Return [line, addresses, label] for each line of the listing
+
+    `addresses` is the range of ROM addresses that the line stands for, if any,
+    and `label` the label that it defines, if any.
+    """
+    parsed = []
+    for line in lines:
+        line = line.rstrip("\n")
+        instruction = _INSTRUCTION.match(line)
+        label = _LABEL.match(line)
+        if instruction:
+            address = int(instruction.group(2), 16)
+            addresses = range(address, address + 1)
+        elif _END.match(line):
+            address = int(_END.match(line).group(1), 16)
+            addresses = range(address, address)
+        else:
+            addresses = None
+        parsed.append([line, addresses, label.group(1) if label else None])
+
+    # Repetitions stand for the addresses between the lines around them,
+    # and labels on their own line for the address of the next instruction
+    following = None
+    for entry in reversed(parsed):
+        line, addresses, label = entry
+        if addresses is not None:
+            following = addresses.start
+        elif _REPETITION.match(line):
+            entry[1] = following
+        elif label:
+            entry[1] = range(following, following)
+    preceding = 0
+    for entry in parsed:
+        line, addresses, label = entry
+        if isinstance(addresses, int):
+            entry[1] = range(preceding, addresses)
+        elif addresses:
+            preceding = addresses.stop
+    return parsed
+
+
+def annotate(lines, counts):
+    """Yield the lines of the listing with the counts added"""
+    parsed = _parse(lines)
+
+    # Blocks run from each label to the next one
+    starts = sorted({addresses.start for _, addresses, label in parsed if label})
+    ends = dict(zip(starts, starts[1:] + [1 << 16]))
+
+    for line, addresses, label in parsed:
+        if label and addresses.start in ends:
+            start = addresses.start
+            total = sum(counts.get(a, 0) for a in range(start, ends.pop(start)))
+            yield f"{total:>{_COLUMN}}  ;; {label} block total\n"
+        if addresses:
+            count = sum(counts.get(a, 0) for a in addresses)
+            yield f"{count:>{_COLUMN}}  {line}\n"
+        else:
+            yield f"{'':{_COLUMN}}  {line}".rstrip() + "\n"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Annotate a ROM listing with execution counts"
+    )
+    parser.add_argument("listing", help=".lst file written by asm.writeRomFiles()")
+    parser.add_argument("counts", help="file written by Gigatron.save_rom_profile()")
+    parser.add_argument("output", nargs="?", help="where to write (default: stdout)")
+    args = parser.parse_args(argv)
+    counts = read_counts(args.counts)
+    with open(args.listing, encoding="utf-8") as fp:
+        annotated = list(annotate(fp, counts))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as fp:
+            fp.writelines(annotated)
+    else:
+        sys.stdout.writelines(annotated)
+
+
+if __name__ == "__main__":
+    main()
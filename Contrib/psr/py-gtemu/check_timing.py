@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""Check the video timing of a ROM
+
+Boots the ROM, optionally loads a GT1 program, and checks the video signal
+for some frames against gtemu.VIDEO_TIMING. Each violation is printed with
+the address of the instruction that caused it and, given the .lst file that
+asm.writeRomFiles() writes next to the ROM, its label. The exit status is 1
+if there are violations, so that it can check ROM builds automatically.
+
+Usage: check_timing.py ROM [--lst ROM.lst] [--gt1 PROGRAM] [--frames N]
+"""
+
+import argparse
+import sys
+
+from annotate_lst import read_labels
+from gtemu import MEMORY_MODELS, Gigatron
+
+# Frames to let pass before checking: the boot code toggles the sync
+# signals before the video loop starts
+_BOOT_FRAMES = 2
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check the video timing of a ROM")
+    parser.add_argument("rom", help="ROM image")
+    parser.add_argument("--lst", help=".lst file written by asm.writeRomFiles()")
+    parser.add_argument("--gt1", help="GT1 program to run while checking")
+    parser.add_argument(
+        "--frames", type=int, default=600, help="frames to check (default: 600)"
+    )
+    parser.add_argument(
+        "--memory",
+        type=int,
+        choices=MEMORY_MODELS,
+        default=32,
+        help="RAM size in kilobytes (default: 32)",
+    )
+    args = parser.parse_args(argv)
+
+    gigatron = Gigatron(memory=args.memory)
+    gigatron.load_rom_file(args.rom)
+    gigatron.run_frames(_BOOT_FRAMES)
+    if args.gt1:
+        gigatron.load_gt1(args.gt1)
+    violations = gigatron.check_video_timing(
+        args.frames, labels=read_labels(args.lst) if args.lst else {}
+    )
+    for violation in violations:
+        print(violation)
+    count = gigatron.timing_violation_count
+    if count > len(violations):
+        print(f"... and {count - len(violations)} more")
+    print(f"{count} violations in {args.frames} frames", file=sys.stderr)
+    return 1 if count else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,27 +1,56 @@
 """Python wrapper for the gtemu emulator
 """
 
-import itertools
+import bisect
+import collections
+import hashlib
+import pathlib
+import struct
+import sys
+import zlib
 from contextlib import contextmanager
 
 import asm
 
 import _gtemu
 
-__all__ = ["Emulator", "RAM", "ROM"]
-
-_BLANK_RAM = bytearray([0 for _ in range(1 << 15)])
+__all__ = [
+    "Emulator",
+    "Gigatron",
+    "MEMORY_MODELS",
+    "RAM",
+    "ROM",
+    "Snapshot",
+    "TimingViolation",
+    "TraceEntry",
+    "VIDEO_TIMING",
+    "WatchpointHit",
+    "buttons",
+    "frame_to_rgb",
+    "read_input_script",
+    "write_input_script",
+    "write_png",
+]
+
+# Supported memory models, in kilobytes. See gtemu_native.h.
+MEMORY_MODELS = (32, 64, 128, 512)
+_RAM_SIZES = {memory << 10 for memory in MEMORY_MODELS}
+
+# Control code that the expansion boards start with: bank 1, no SPI device selected
+_INITIAL_CTRL = 0x7C
+
+_BLANK_CORE = bytes(_gtemu.ffi.sizeof("RunState"))
 
 
 def _make_state_field_accessor(name):
     """Return a descriptor that accesses the fields of the state"""
 
     def _getter(self):
-        state = self._state
+        state = self._core.S
         return getattr(state, name)
 
     def _setter(self, value):
-        state = self._state
+        state = self._core.S
         setattr(state, name, value)
 
     return property(
@@ -38,11 +67,11 @@ def _make_zero_page_accessor(
 
     def _getter(self):
         return int.from_bytes(
-            RAM[address : address + width], byteorder=byteorder, signed=signed
+            self.RAM[address : address + width], byteorder=byteorder, signed=signed
         )
 
     def _setter(self, value):
-        RAM[address : address + width] = value.to_bytes(
+        self.RAM[address : address + width] = value.to_bytes(
             width, byteorder=byteorder, signed=signed
         )
 
@@ -80,21 +109,211 @@ _STEP_VCPU_BREAKPOINTS = frozenset(
     ]
 )
 
+# Where vPC can be changed: after NEXT, the high byte is already in Y
+_VCPU_ENTRY_BREAKPOINTS = frozenset([0x02FF])  # ENTER
+
+
+# Events reported by the native run loop
+STOP_BREAKPOINT = _gtemu.lib.STOP_BREAKPOINT
+STOP_HSYNC = _gtemu.lib.STOP_HSYNC
+STOP_VSYNC = _gtemu.lib.STOP_VSYNC
+STOP_VSYNC_END = _gtemu.lib.STOP_VSYNC_END
+STOP_HBLANK = _gtemu.lib.STOP_HBLANK
+STOP_VBLANK = _gtemu.lib.STOP_VBLANK
+STOP_SERIAL = _gtemu.lib.STOP_SERIAL
+STOP_INPUT = _gtemu.lib.STOP_INPUT
+STOP_WATCHPOINT = _gtemu.lib.STOP_WATCHPOINT
+STOP_VCPU = _gtemu.lib.STOP_VCPU
+STOP_SYS = _gtemu.lib.STOP_SYS
+
+# Buttons of the game controller, as bits of IN. They are active low.
+BUTTON_RIGHT = 0x01
+BUTTON_LEFT = 0x02
+BUTTON_DOWN = 0x04
+BUTTON_UP = 0x08
+BUTTON_START = 0x10
+BUTTON_SELECT = 0x20
+BUTTON_B = 0x40
+BUTTON_A = 0x80
+
+# Ring buffer of serial pulses recorded by the native run loop
+_SERIAL_SIZE = _gtemu.lib.SERIAL_SIZE
+_SERIAL_IDLE = _gtemu.lib.SERIAL_IDLE
+
+# Video timing of the ROM, in cycles and lines as measured by the native
+# checker (see gtemu_native.h): VGA 640x480 at a quarter of the pixel clock
+VIDEO_TIMING = {
+    "line": 200,
+    "hsync": 24,
+    "hback": 12,
+    "hfront": 4,
+    "vsync": 8,
+    "vback": 27,
+    "vfront": 6,
+    "frame": 521,
+}
+_TIMING_CHECKS = {
+    _gtemu.lib.TIMING_LINE: ("line", "lineCycles"),
+    _gtemu.lib.TIMING_HSYNC: ("hsync", "hSyncCycles"),
+    _gtemu.lib.TIMING_HBACK: ("hback", "hBackCycles"),
+    _gtemu.lib.TIMING_HFRONT: ("hfront", "hFrontCycles"),
+    _gtemu.lib.TIMING_VSYNC: ("vsync", "vSyncLines"),
+    _gtemu.lib.TIMING_VBACK: ("vback", "vBackLines"),
+    _gtemu.lib.TIMING_VFRONT: ("vfront", "vFrontLines"),
+    _gtemu.lib.TIMING_FRAME: ("frame", "frameLines"),
+}
+
+# vCPU cycles per frame in high-level emulation. ROMv5a gives applications
+# between 20000 and 21300 in the video mode it boots in, depending on the mix
+# of instructions, as some of each time slice is lost.
+_HLE_FRAME_CYCLES = 20_600
+
+# Zero-page variable holding the address of the SYS function
+_SYS_FN = 0x22
+
+# Largest cycle count accepted by the native run loop, used when there is no limit
+_FOREVER = (1 << 64) - 1
+
+# Geometry of the blanking periods, counted as in the native run loop
+_HBLANK_X = 48 // 4 + 640 // 4
+_VBLANK_Y = 480
+
+
+# Identifies snapshot files
+_SNAPSHOT_MAGIC = b"py-gtemu snapshot 2\n"
+
+
+class Snapshot(collections.namedtuple("Snapshot", "rom_hash core ram")):
+    """Emulator state captured by Gigatron.snapshot()
+
+    `core` holds the native run loop state, including the input port,
+    and `ram` the RAM. `rom_hash` identifies the ROM that was loaded.
+    Snapshots only make sense with the build of the extension that made them.
+    """
+
+    __slots__ = ()
+
+    def save(self, path):
+        """Write the snapshot to a file"""
+        with open(path, "wb") as fp:
+            fp.write(_SNAPSHOT_MAGIC)
+            fp.write(self.rom_hash)
+            fp.write(struct.pack("<II", len(self.core), len(self.ram)))
+            fp.write(self.core)
+            fp.write(self.ram)
+
+    @classmethod
+    def load(cls, path):
+        """Read a snapshot written by save()
+
+        Raises ValueError if the file is not a snapshot for this build of the extension.
+        """
+        with open(path, "rb") as fp:
+            data = fp.read()
+        if not data.startswith(_SNAPSHOT_MAGIC):
+            raise ValueError(f"{path} is not a snapshot")
+        offset = len(_SNAPSHOT_MAGIC)
+        rom_hash = data[offset : offset + 32]
+        core_size, ram_size = struct.unpack_from("<II", data, offset + 32)
+        offset += 32 + 8
+        if core_size != len(_BLANK_CORE) or ram_size not in _RAM_SIZES:
+            raise ValueError(f"{path} was made by a different build of py-gtemu")
+        core = data[offset : offset + core_size]
+        ram = data[offset + core_size : offset + core_size + ram_size]
+        if len(ram) != ram_size:
+            raise ValueError(f"{path} is truncated")
+        return cls(rom_hash, core, ram)
+
 
 # Maximum latency between vCPU instructions if nothing goes wrong.
 # TODO: Find the right value, needs to work if we're in slow (rendering all four lines) mode.
+class TimingViolation(
+    collections.namedtuple(
+        "TimingViolation", "check measured expected pc label cycle frame line"
+    )
+):
+    """A length of the video signal that differs from VIDEO_TIMING
+
+    `check` is the key of VIDEO_TIMING and `pc` the address of the
+    instruction that ended the length, with `label` giving it relative to
+    the nearest label of the ROM, if known.
+    """
+
+    __slots__ = ()
+
+    def __str__(self):
+        where = f"${self.pc:04x}" + (f" ({self.label})" if self.label else "")
+        return (
+            f"{self.check} is {self.measured} instead of {self.expected} at {where}"
+            f", cycle {self.cycle}, frame {self.frame}, line {self.line}"
+        )
+
+
+# One cycle of the trace: the instruction executed and the registers after it
+TraceEntry = collections.namedtuple("TraceEntry", "pc ir d ac x y out")
+
+
+class WatchpointHit(Exception):
+    """Raised when the emulator stops on a watchpoint set with Gigatron.watch()
+
+    The emulator is left just after the cycle that accessed the RAM, so that
+    it can be inspected, and running it again continues from there.
+    """
+
+    def __init__(self, address, value, write, pc):
+        access = "Write" if write else "Read"
+        super().__init__(f"{access} of ${value:02x} at ${address:04x} by ${pc:04x}")
+        self.address = address
+        self.value = value
+        self.write = write
+        self.pc = pc
+
+
+def _label_for(address, labels, starts):
+    """Return address as `label` or `label+offset`, or None if no label precedes it
+
+    `labels` maps addresses to a label or to a list of labels, like asm._labels,
+    and `starts` holds its keys in order.
+    """
+    i = bisect.bisect_right(starts, address)
+    if not i:
+        return None
+    start = starts[i - 1]
+    label = labels[start]
+    if isinstance(label, list):
+        label = label[-1]
+    return label if start == address else f"{label}+{address - start}"
+
+
 _STEP_VCPU_MAX_CYCLES = 1000  # It should be possible to calculate a more precise value
 
 
-class _Emulator:
-    """Provides programatic control over the Gigatron Emulator"""
+class Gigatron:
+    """Provides programatic control over an emulated Gigatron
+
+    Each instance has its own ROM, RAM and state. The native run loop
+    releases the GIL, so that instances can run in parallel threads.
 
-    def __init__(self):
+    `memory` is the size of the RAM in kilobytes, one of MEMORY_MODELS.
+    128 and 512 emulate the banking of the expansion boards; `RAM` then
+    holds all banks, with bank b at offset b * 0x8000.
+    """
+
+    def __init__(self, memory=32):
+        if memory not in MEMORY_MODELS:
+            raise ValueError(f"memory must be one of {MEMORY_MODELS}, not {memory!r}")
+        self.ROM = _gtemu.ffi.new("uint8_t[][2]", 1 << 16)
+        self.RAM = _gtemu.ffi.new("uint8_t[]", memory << 10)
+        self._machine = _gtemu.ffi.new("Machine *")
+        self._machine.ROM = self.ROM
+        self._machine.RAM = self.RAM
+        self._machine.memory = memory
+        self._core = _gtemu.ffi.addressof(self._machine[0], "R")
         self.reset()
 
     def load_rom_file(self, path):
         with open(path, "rb") as fp:
-            fp.readinto(_gtemu.ffi.buffer(ROM))
+            fp.readinto(_gtemu.ffi.buffer(self.ROM))
 
     def load_rom_from_asm_module(self):
         """Populates the ROM from the contents of the asm module
@@ -108,19 +327,91 @@ class _Emulator:
                 yield operand
 
         rom_data = bytearray(gen_rom_data())
-        _gtemu.ffi.buffer(ROM)[0 : len(rom_data)] = rom_data
+        _gtemu.ffi.buffer(self.ROM)[0 : len(rom_data)] = rom_data
 
     def reset(self):
-        self._state = _gtemu.ffi.new("CpuState *")[0]
-        self._last_pc = None
+        _gtemu.ffi.memmove(self._core, _BLANK_CORE, len(_BLANK_CORE))
+        self._core.IN = 0xFF
+        self._core.ctrl = _INITIAL_CTRL
+        self._machine.frame = _gtemu.ffi.NULL
+        self._machine.input = _gtemu.ffi.NULL
+        self._input = None
+        self._machine.profiler = _gtemu.ffi.NULL
+        self._profiler = self._profiler_cycles = self._profiler_sys_calls = None
+        self._machine.romCounts = _gtemu.ffi.NULL
+        self._rom_counts = None
+        self._machine.timing = _gtemu.ffi.NULL
+        self._timing = self._timing_violations = None
+        self._machine.trace = _gtemu.ffi.NULL
+        self._trace = self._trace_file = None
+        self._machine.watch = _gtemu.ffi.NULL
+        self._watch = self._watch_values = None
+        self._watchpoints = set()
+        self.hle_sys = {}
+        self._hle_sys_bitmap = _gtemu.ffi.new("uint8_t[]", 1 << 16)
+        self._hle_sys_contents = frozenset()
         self._print = False
-        self._vga_x = 0
-        self._vga_y = 0
-        self._xout = 0
         self.breakpoints = set()
-        _gtemu.ffi.buffer(RAM)[:] = _BLANK_RAM
+        self._bitmap = _gtemu.ffi.new("uint8_t[]", 1 << 16)
+        self._bitmap_contents = frozenset()
+        self._frame = None
+        self.frame_callbacks = []
+        _gtemu.ffi.buffer(self.RAM)[:] = bytes(len(self.RAM))
         # Needed for bit shuffling
-        _gtemu.ffi.buffer(RAM)[0b1000_0000] = b"\x01"
+        _gtemu.ffi.buffer(self.RAM)[0b1000_0000] = b"\x01"
+
+    # Snapshots
+    def rom_hash(self):
+        """Return the SHA-256 digest of the ROM image"""
+        return hashlib.sha256(_gtemu.ffi.buffer(self.ROM)).digest()
+
+    def snapshot(self):
+        """Capture the state of the emulator
+
+        Breakpoints, frame capture and callbacks are not part of the snapshot.
+        """
+        return Snapshot(
+            self.rom_hash(),
+            _gtemu.ffi.buffer(self._core)[:],
+            _gtemu.ffi.buffer(self.RAM)[:],
+        )
+
+    def restore(self, snapshot):
+        """Return to the state captured by snapshot()
+
+        The ROM is not checked: it is up to the caller to load the right one.
+        Raises ValueError if the snapshot was taken with another memory model.
+        """
+        if len(snapshot.ram) != len(self.RAM):
+            raise ValueError("The snapshot was taken with a different memory model")
+        _gtemu.ffi.memmove(self._core, snapshot.core, len(snapshot.core))
+        _gtemu.ffi.memmove(self.RAM, snapshot.ram, len(snapshot.ram))
+
+    def cached_snapshot(self, directory, name, setup):
+        """Restore a snapshot from an on-disk cache, creating it if needed
+
+        Snapshots are stored in `directory` under `name` and a hash of the ROM.
+        When there is no usable snapshot for the current ROM,
+        `setup` is called to bring the emulator into the desired state,
+        and the resulting snapshot is saved for next time.
+
+        Returns the snapshot, so that callers can restore it again.
+        """
+        rom_hash = self.rom_hash()
+        path = pathlib.Path(directory) / f"{name}-{rom_hash.hex()[:16]}.snapshot"
+        try:
+            snapshot = Snapshot.load(path)
+        except (OSError, ValueError):
+            pass
+        else:
+            if snapshot.rom_hash == rom_hash and len(snapshot.ram) == len(self.RAM):
+                self.restore(snapshot)
+                return snapshot
+        setup()
+        snapshot = self.snapshot()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        snapshot.save(path)
+        return snapshot
 
     PC = _make_state_field_accessor("PC")
     IR = _make_state_field_accessor("IR")
@@ -136,7 +427,42 @@ class _Emulator:
 
         This is set from AC when the hsync signal is low
         """
-        return self._xout
+        return self._core.XOUT
+
+    @property
+    def cycles(self):
+        """Number of cycles executed since the last reset"""
+        return self._core.cycles
+
+    @property
+    def frames(self):
+        """Number of frames (falling vsync edges) since the last reset"""
+        return self._core.frames
+
+    @property
+    def memory(self):
+        """Size of the RAM in kilobytes"""
+        return self._machine.memory
+
+    @property
+    def ctrl(self):
+        """The last control code sent to the expansion board
+
+        Only meaningful for the 128K and 512K memory models.
+        """
+        return self._core.ctrl
+
+    def physical_address(self, address):
+        """Return the offset in RAM that the CPU reaches at address
+
+        This follows the current banking of the expansion boards.
+        """
+        return _gtemu.lib.physicalAddress(self._machine, address)
+
+    # The run loop keeps these in the native state
+    _last_pc = property(lambda self: self._core.lastPC)
+    _vga_x = property(lambda self: self._core.vgaX)
+    _vga_y = property(lambda self: self._core.vgaY)
 
     @property
     def hsync(self):
@@ -168,9 +494,9 @@ class _Emulator:
         # and set PC to address + 1.
         address = _to_address(address)
         self.PC = address + 1
-        self.IR = _gtemu.lib.ROM[address][0]
-        self.D = _gtemu.lib.ROM[address][1]
-        self._last_pc = address
+        self.IR = self.ROM[address][0]
+        self.D = self.ROM[address][1]
+        self._core.lastPC = address
 
     @property
     def state(self):
@@ -197,38 +523,100 @@ class _Emulator:
         )
         return "\n".join([heading, separator, values])
 
+    def _breakpoint_bitmap(self):
+        """Return the native breakpoint bitmap, brought up to date with self.breakpoints"""
+        if self._bitmap_contents != self.breakpoints:
+            self._bitmap_contents = frozenset(self.breakpoints)
+            _gtemu.ffi.memmove(self._bitmap, bytes(1 << 16), 1 << 16)
+            for address in self._bitmap_contents:
+                self._bitmap[address] = 1
+        return self._bitmap
+
+    def _host_sys_bitmap(self):
+        """Return the native bitmap of hle_sys, or NULL if it is empty"""
+        if self._hle_sys_contents != self.hle_sys.keys():
+            self._hle_sys_contents = frozenset(self.hle_sys)
+            _gtemu.ffi.memmove(self._hle_sys_bitmap, bytes(1 << 16), 1 << 16)
+            for sys_fn in self._hle_sys_contents:
+                self._hle_sys_bitmap[sys_fn] = 1
+        return self._hle_sys_bitmap if self._hle_sys_contents else _gtemu.ffi.NULL
+
+    def _call_host_sys(self, stop_on):
+        """Do the SYS call that stopped the native loop, returning its events"""
+        vpc = self.vPC
+        address = vpc & 0xFF00 | (vpc + 2) & 0xFF
+        sys_fn = int.from_bytes(self.RAM[_SYS_FN : _SYS_FN + 2], "little")
+        self.hle_sys[sys_fn](self)
+        return _gtemu.lib.completeSys(self._machine, address, stop_on)
+
+    def _run(self, max_cycles, stop_on=0, breakpoints=_gtemu.ffi.NULL):
+        """Run the native loop, returning the events that stopped it and the cycle count
+
+        Frame callbacks are called whenever a frame completes, and the
+        functions of hle_sys whenever the vCPU calls them.
+        """
+        start = self._core.cycles
+        end = min(start + max_cycles, _FOREVER)
+        native_stop_on = stop_on | (STOP_VSYNC if self.frame_callbacks else 0)
+        self._machine.hleSys = self._host_sys_bitmap()
+        while True:
+            event = _gtemu.lib.run(
+                self._machine,
+                max(0, end - self._core.cycles),
+                breakpoints,
+                native_stop_on,
+            )
+            if event & STOP_SYS:
+                event |= self._call_host_sys(native_stop_on)
+            if event & STOP_VSYNC:
+                for callback in list(self.frame_callbacks):
+                    callback(self._frame)
+            event &= stop_on | STOP_BREAKPOINT | STOP_WATCHPOINT
+            if event or self._core.cycles >= end:
+                break
+        if event & STOP_WATCHPOINT:
+            machine = self._machine
+            raise WatchpointHit(
+                machine.watchAddress,
+                machine.watchValue,
+                machine.watchHit == _gtemu.lib.WATCH_WRITE,
+                machine.watchPC,
+            )
+        return event, self._core.cycles - start
+
     def _step(self):
         """Run a single step of the interpreter"""
-        # Store the current PC, so that we can return it as next_instruction
-        # This is needed because of the pipeline
-        self._last_pc = self.PC
-        old_state = self._state
-        self._state = new_state = _gtemu.lib.cpuCycle(self._state)
-        # Detect changes in the vertical and horizontal sync signals
-        hsync_edge = (new_state.OUT & _HSYNC) - (old_state.OUT & _HSYNC)
-        vsync_edge = (new_state.OUT & _VSYNC) - (old_state.OUT & _VSYNC)
-        # TODO: It might be nice to detect timing errors - but it's tricky because the ROM
-        # doesn't go straight into standard timings.
-        # We keep these values in order to support run_to_vsync and run_to_hsync
-        self._vga_x += 1
-        if vsync_edge < 0:
-            self._vga_y = -36
-        if hsync_edge > 0:
-            self._vga_x = 0
-            self._vga_y += 1
-            self._xout = self.AC
+        self._run(1)
 
     def step(self):
         self._step()
         if self._print:
             print(self.state)
 
-    def _run_for(self, instructions):
-        for i in range(instructions):
-            self._step()
-            if self._last_pc in self.breakpoints:
-                return i + 1
-        return instructions
+    def run(self, max_cycles=None, *, stop_on=0):
+        """Run the emulator until one of the events in `stop_on` or a breakpoint
+
+        `stop_on` combines the STOP_... constants of this module.
+        Runs forever if `max_cycles` is None and nothing happens.
+
+        Returns the events that stopped the emulator, or 0 on timeout.
+        """
+        try:
+            event, _ = self._run(
+                _FOREVER if max_cycles is None else max_cycles,
+                stop_on,
+                self._breakpoint_bitmap(),
+            )
+            if event & STOP_BREAKPOINT and self._trace_file:
+                print(self.format_trace(), file=self._trace_file)
+            return event
+        finally:
+            if self._print:
+                print(self.state)
+
+    def _run_for(self, instructions, stop_on=0):
+        _, cycles = self._run(instructions, stop_on, self._breakpoint_bitmap())
+        return cycles
 
     def run_for(self, instructions):
         """Run the emulator for a fixed number of cycles
@@ -244,8 +632,8 @@ class _Emulator:
             if self._print:
                 print(self.state)
 
-    def _run_to_breakpoint(self, max_instructions):
-        cycles = self._run_for(max_instructions)
+    def _run_to_breakpoint(self, max_instructions, stop_on=0):
+        cycles = self._run_for(max_instructions, stop_on)
         if self._last_pc not in self.breakpoints:
             raise ValueError("timeout")
         return cycles
@@ -260,20 +648,21 @@ class _Emulator:
         but always executes at least one cycle
         """
         address = _to_address(address)
-        iterator = (
-            range(max_instructions)
-            if max_instructions is not None
-            else itertools.count()
-        )
+        bitmap = self._breakpoint_bitmap()
+        bitmap[address] = 1
         try:
-            for i, _ in enumerate(iterator):
-                self._step()
-                if self._last_pc == address or self._last_pc in self.breakpoints:
-                    return i + 1
+            event, cycles = self._run(
+                _FOREVER if max_instructions is None else max_instructions,
+                0,
+                bitmap,
+            )
+            if event & STOP_BREAKPOINT:
+                return cycles
             raise ValueError(
                 "Did not hit address in %d instructions" % (max_instructions,)
             )
         finally:
+            bitmap[address] = address in self._bitmap_contents
             if self._print:
                 print(self.state)
 
@@ -289,15 +678,346 @@ class _Emulator:
         # (48 / 4) back porch pixels
         # + (640 / 4) visible pixels
         # Before we blank
-        hblank_start = 48 / 4 + 640 / 4  # = 172
+        # = 172, see _HBLANK_X
         # Skip through current blank
-        while self._vga_x > hblank_start:
-            self._step()
-        while self._vga_x < hblank_start:
-            self._step()
+        if self._vga_x > _HBLANK_X:
+            self._run(_FOREVER, STOP_HSYNC)
+        if self._vga_x < _HBLANK_X:
+            self._run(_FOREVER, STOP_HBLANK)
         if self._print:
             print(self.state)
 
+    def run_frames(self, count=1):
+        """Run the emulator until `count` more frames have been completed
+
+        Returns the number of cycles executed.
+        """
+        cycles = 0
+        for _ in range(count):
+            cycles += self._run(_FOREVER, STOP_VSYNC)[1]
+        if self._print:
+            print(self.state)
+        return cycles
+
+    # Frame capture
+    def capture_frames(self, *, physical=False):
+        """Start capturing the pixels drawn on the screen
+
+        Returns the NumPy array that receives them. This is a 120x160 array
+        with the Gigatron pixels, or a 480x640 array with the VGA pixels
+        when `physical` is True. Each element holds the six colour bits of OUT.
+        The native run loop overwrites the array in place, so it only holds a
+        complete frame when a frame ends: use `frame_callbacks` or
+        `run_frames()` to look at it at the right time.
+        """
+        import numpy
+
+        shape = (480, 640) if physical else (120, 160)
+        self._frame = numpy.zeros(shape, dtype=numpy.uint8)
+        self._machine.frame = _gtemu.ffi.from_buffer(self._frame)
+        self._machine.physical = physical
+        return self._frame
+
+    def stop_capture(self):
+        """Stop capturing frames"""
+        self._machine.frame = _gtemu.ffi.NULL
+        self._frame = None
+
+    @property
+    def frame(self):
+        """The array receiving the captured pixels, or None"""
+        return self._frame
+
+    def frame_hash(self):
+        """Return a hex digest of the captured frame"""
+        return hashlib.sha256(self._frame.tobytes()).hexdigest()
+
+    def save_png(self, path):
+        """Write the captured frame to a PNG file"""
+        write_png(path, self._frame)
+
+    # vCPU profiling
+    def start_vcpu_profiler(self):
+        """Start counting the cycles spent on each vCPU instruction
+
+        This clears the counters. The native run loop attributes the cycles to
+        the vPC of each instruction, leaving out the time spent in the video
+        driver, and counts SYS calls by sysFn.
+        """
+        self._profiler = _gtemu.ffi.new("VcpuProfiler *")
+        self._profiler_cycles = _gtemu.ffi.new("uint64_t[]", 1 << 16)
+        self._profiler_sys_calls = _gtemu.ffi.new("uint64_t[]", 1 << 16)
+        self._profiler.cycles = self._profiler_cycles
+        self._profiler.sysCalls = self._profiler_sys_calls
+        self._machine.profiler = self._profiler
+
+    def stop_vcpu_profiler(self):
+        """Stop profiling, keeping the counters"""
+        self._machine.profiler = _gtemu.ffi.NULL
+
+    def vcpu_profile(self):
+        """Return the cycles spent at each vPC as a NumPy array of 64K counters"""
+        import numpy
+
+        return numpy.frombuffer(
+            _gtemu.ffi.buffer(self._profiler_cycles), dtype=numpy.uint64
+        ).copy()
+
+    def sys_calls(self):
+        """Return a dictionary mapping each sysFn to the number of SYS calls"""
+        counts = self._profiler_sys_calls
+        return {sys_fn: counts[sys_fn] for sys_fn in range(1 << 16) if counts[sys_fn]}
+
+    def save_vcpu_profile(self, path):
+        """Write the profile in the format of gtsim's -prof option
+
+        `gt1dump.py -p path` shows it alongside the disassembly of a GT1 file.
+        """
+        cycles = self._profiler_cycles
+        total = 0
+        with open(path, "w") as fp:
+            fp.write("prof={\n")
+            fp.write(" # pc: cycs  Number of cycles spent on vCPU\n")
+            fp.write(" #           instructions at address less than pc")
+            separator = ""
+            for address in range(1 << 16):
+                if cycles[address]:
+                    total += cycles[address]
+                    fp.write(f"{separator}\n 0x{address:04x}: {total}")
+                    separator = ","
+            fp.write("\n}\n")
+
+    # ROM profiling
+    def start_rom_profiler(self):
+        """Start counting how often each ROM address executes
+
+        This clears the counters.
+        """
+        self._rom_counts = _gtemu.ffi.new("uint64_t[]", 1 << 16)
+        self._machine.romCounts = self._rom_counts
+
+    def stop_rom_profiler(self):
+        """Stop counting, keeping the counters"""
+        self._machine.romCounts = _gtemu.ffi.NULL
+
+    def rom_profile(self):
+        """Return the execution counts as a NumPy array of 64K counters"""
+        import numpy
+
+        return numpy.frombuffer(
+            _gtemu.ffi.buffer(self._rom_counts), dtype=numpy.uint64
+        ).copy()
+
+    def save_rom_profile(self, path):
+        """Write the execution counts for annotate_lst.py
+
+        Each line holds an address in hex and its count, for the addresses
+        that executed at least once.
+        """
+        counts = self._rom_counts
+        with open(path, "w") as fp:
+            for address in range(1 << 16):
+                if counts[address]:
+                    fp.write(f"{address:04x} {counts[address]}\n")
+
+    # Video timing
+    def start_timing_checker(self, timing=None, *, capacity=1000):
+        """Start checking the video signal against the expected timing
+
+        `timing` overrides some of the lengths of VIDEO_TIMING. The native
+        run loop records up to `capacity` violations and counts the rest.
+        This clears the violations found so far.
+        """
+        expected = dict(VIDEO_TIMING, **(timing or {}))
+        unknown = expected.keys() - VIDEO_TIMING.keys()
+        if unknown:
+            raise ValueError(f"Unknown timing {sorted(unknown)}")
+        self._timing = _gtemu.ffi.new("TimingChecker *")
+        self._timing_violations = _gtemu.ffi.new("TimingViolation[]", capacity)
+        for check, field in _TIMING_CHECKS.values():
+            setattr(self._timing, field, expected[check])
+        self._timing.violations = self._timing_violations
+        self._timing.capacity = capacity
+        self._timing.pixelLine = -1
+        self._machine.timing = self._timing
+
+    def stop_timing_checker(self):
+        """Stop checking, keeping the violations"""
+        self._machine.timing = _gtemu.ffi.NULL
+
+    @property
+    def timing_violation_count(self):
+        """The number of violations found, including those beyond the capacity"""
+        return self._timing.count
+
+    def timing_violations(self, labels=None):
+        """Return the recorded violations as a list of TimingViolation
+
+        `labels` maps ROM addresses to labels, like asm._labels, which is used
+        by default. annotate_lst.read_labels() reads them from a .lst file.
+        """
+        if labels is None:
+            labels = asm._labels
+        starts = sorted(labels)
+        violations = []
+        for i in range(min(self._timing.count, self._timing.capacity)):
+            v = self._timing_violations[i]
+            violations.append(
+                TimingViolation(
+                    _TIMING_CHECKS[v.check][0],
+                    v.measured,
+                    v.expected,
+                    v.pc,
+                    _label_for(v.pc, labels, starts),
+                    v.cycle,
+                    v.frame,
+                    v.line,
+                )
+            )
+        return violations
+
+    def check_video_timing(self, frames, *, timing=None, labels=None):
+        """Run `frames` frames and return the violations of the video timing
+
+        See start_timing_checker() and timing_violations().
+        """
+        self.start_timing_checker(timing)
+        try:
+            self.run_frames(frames)
+        finally:
+            self.stop_timing_checker()
+        return self.timing_violations(labels)
+
+    # Tracing
+    def start_trace(self, size=1000):
+        """Start keeping the last `size` cycles in a native ring buffer
+
+        This clears the trace.
+        """
+        self._trace = _gtemu.ffi.new("TraceEntry[]", size)
+        self._machine.traceSize = size
+        self._machine.traceCount = 0
+        self._machine.trace = self._trace
+
+    def stop_trace(self):
+        """Stop tracing, keeping the trace"""
+        self._machine.trace = _gtemu.ffi.NULL
+
+    def trace(self):
+        """Return the traced cycles, oldest first, as a list of TraceEntry"""
+        if self._trace is None:
+            return []
+        count, size = self._machine.traceCount, self._machine.traceSize
+        entries = []
+        for i in range(max(0, count - size), count):
+            e = self._trace[i % size]
+            entries.append(TraceEntry(e.PC, e.IR, e.D, e.AC, e.X, e.Y, e.OUT))
+        return entries
+
+    def format_trace(self):
+        """Return the trace as a table like `state`, one cycle per line"""
+        registers = ["AC", "X", "Y", "OUT"]
+        heading = " ".join(
+            ["PC".rjust(5), "Executed instruction"] + [r.rjust(3) for r in registers]
+        )
+        separator = " ".join(["-" * 5, "-" * 20] + ["-" * 3 for _ in registers])
+        lines = [heading, separator]
+        for e in self.trace():
+            lines.append(
+                " ".join(
+                    [f"${e.pc:04x}", asm.disassemble(e.ir, e.d).ljust(20)]
+                    + [f"${value:02x}" for value in (e.ac, e.x, e.y, e.out)]
+                )
+            )
+        return "\n".join(lines)
+
+    @contextmanager
+    def dump_trace(self, file=None, *, size=1000):
+        """Trace the block, writing out the trace when something goes wrong
+
+        The last `size` cycles are written to `file`, standard error by
+        default, when an exception leaves the block (WatchpointHit included)
+        and when run() stops on a breakpoint.
+        """
+        self.start_trace(size)
+        self._trace_file = file or sys.stderr
+        try:
+            yield
+        except BaseException:
+            print(self.format_trace(), file=self._trace_file)
+            raise
+        finally:
+            self._trace_file = None
+            self.stop_trace()
+
+    # Watchpoints
+    def watch(self, address, *, read=False, write=True, value=None):
+        """Stop when the byte of RAM at `address` is read or written
+
+        `address` is an offset in RAM, as physical_address() returns it.
+        When `value` is given, only accesses of that value count. Running the
+        emulator then raises WatchpointHit just after the access.
+        """
+        if not 0 <= address < len(self.RAM):
+            raise ValueError(f"{address:x} is out of range for RAM")
+        if not (read or write):
+            raise ValueError("A watchpoint needs read or write")
+        if self._watch is None:
+            self._watch = _gtemu.ffi.new("uint8_t[]", len(self.RAM))
+            self._watch_values = _gtemu.ffi.new("uint8_t[]", len(self.RAM))
+            self._machine.watchValues = self._watch_values
+        self._watch[address] = (
+            (_gtemu.lib.WATCH_READ if read else 0)
+            | (_gtemu.lib.WATCH_WRITE if write else 0)
+            | (_gtemu.lib.WATCH_VALUE if value is not None else 0)
+        )
+        self._watch_values[address] = value or 0
+        self._watchpoints.add(address)
+        self._machine.watch = self._watch
+
+    def unwatch(self, address=None):
+        """Remove the watchpoint at `address`, or all watchpoints"""
+        addresses = set(self._watchpoints) if address is None else {address}
+        for a in addresses & self._watchpoints:
+            self._watch[a] = 0
+        self._watchpoints -= addresses
+        if not self._watchpoints:
+            self._machine.watch = _gtemu.ffi.NULL
+
+    # High-level emulation
+    def start_hle(self, frame_cycles=_HLE_FRAME_CYCLES):
+        """Start interpreting vCPU instructions natively instead of running the ROM
+
+        Instructions run straight from RAM, `frame_cycles` vCPU cycles making
+        a frame, while frameCount, videoY, serialRaw, buttonState and the
+        other variables that the ROM updates in vertical blank are advanced
+        synthetically (see gtemu_native.h). SYS calls to a sysFn in
+        `hle_sys`, a dictionary of functions taking the Gigatron, are done by
+        calling them, with vPC moving past the SYS unless they change it.
+        The ROM runs everything else: other SYS calls and instructions that
+        it alone knows. Emulation starts at the ROM's next visit to ENTER.
+
+        Nothing is drawn in this mode, and ROM breakpoints only apply while
+        the ROM runs. The mode is part of snapshots: restore one and call
+        start_hle() or stop_hle() to continue it in the other mode.
+        """
+        if frame_cycles <= 0:
+            raise ValueError("frame_cycles must be positive")
+        _gtemu.lib.startHle(self._machine, frame_cycles)
+
+    def stop_hle(self):
+        """Return to cycle-accurate emulation
+
+        The ROM continues from ENTER, where it was left, with the RAM as the
+        vCPU left it.
+        """
+        _gtemu.lib.stopHle(self._machine)
+
+    @property
+    def hle(self):
+        """Whether the vCPU is emulated at a high level, see start_hle()"""
+        return bool(self._core.hle.active)
+
     def run_to_vblank(self):
         """Run the emulator until we get to the next vertical blank period
 
@@ -311,10 +1031,10 @@ class _Emulator:
 
         # If we are currently in a vertical blank interval, advance through it.
         # the caller wants the next one
-        while self._vga_y > 480:
-            self._step()
-        while self._vga_y < 480:
-            self._step()
+        if self._vga_y > _VBLANK_Y:
+            self._run(_FOREVER, STOP_VSYNC)
+        if self._vga_y < _VBLANK_Y:
+            self._run(_FOREVER, STOP_VBLANK)
         if self._print:
             print(self.state)
 
@@ -365,7 +1085,7 @@ class _Emulator:
         )
         values = " ".join(
             [("${:0%dx}" % (w * 2,)).format(getattr(self, r)) for r, w in registers]
-            + [_disassemble_vcpu_next()]
+            + [_disassemble_vcpu_next(self)]
         )
         return "\n".join([heading, separator, values])
 
@@ -382,10 +1102,12 @@ class _Emulator:
         We might instead be about to return to the display loop,
         or the next instruction might be a SYS function which doesn't have time to execute.
         It might therefore take several call to see a change in vPC.
+        In high-level emulation this runs a single instruction, unless the ROM
+        is running one.
         """
         try:
             with self.additional_breakpoints(_STEP_VCPU_BREAKPOINTS):
-                return self._run_to_breakpoint(_STEP_VCPU_MAX_CYCLES)
+                return self._run_to_breakpoint(_STEP_VCPU_MAX_CYCLES, STOP_VCPU)
         finally:
             if self._print:
                 print(self.vcpu_state)
@@ -409,11 +1131,11 @@ class _Emulator:
         try:
             with self.additional_breakpoints(_STEP_VCPU_BREAKPOINTS):
                 while always_run_some_code and self.vPC == target_vpc:
-                    cycles += self._run_to_breakpoint(_STEP_VCPU_MAX_CYCLES)
+                    cycles += self._run_to_breakpoint(_STEP_VCPU_MAX_CYCLES, STOP_VCPU)
                     if self._last_pc not in _STEP_VCPU_BREAKPOINTS:
                         return cycles
                 while self.vPC != target_vpc:
-                    cycles += self._run_to_breakpoint(_STEP_VCPU_MAX_CYCLES)
+                    cycles += self._run_to_breakpoint(_STEP_VCPU_MAX_CYCLES, STOP_VCPU)
                     if self._last_pc not in _STEP_VCPU_BREAKPOINTS:
                         return cycles
                 return cycles
@@ -423,26 +1145,64 @@ class _Emulator:
 
     def send_byte(self, value):
         """Send a byte through the input port"""
+        self.send_bytes([value])
+
+    def send_bytes(self, buffer):
+        """Send bytes through the input port, one per frame"""
         # While communication to the Gigatron is serial,
         # it's captured by a shift register, and is presented as a byte
         # so for our purposes we can just write the byte.
         #
-        # The shift register is read once per vertical refresh
-        # so wait until vsync goes low, write the value and hold it
-        # through the rising edge round to the next falling edge
-        while self.OUT & _VSYNC:
-            self._step()
-        _IN[0] = value
-        while not (self.OUT & _VSYNC):
-            self._step()
-        while self.OUT & _VSYNC:
-            self._step()
-        _IN[0] = 0xFF  # Restore to the initial value
+        # The shift register is read once per vertical refresh,
+        # so the native loop loads the next byte on each falling edge of vsync,
+        # and restores the initial value on the edge after the last byte.
+        # If vsync is already low, the first byte goes out straight away.
+        if not buffer:
+            return
+        buffer = bytes(buffer)
+        if not (self.OUT & _VSYNC):
+            self._core.IN = buffer[0]
+            buffer = buffer[1:]
+        self.play_input(enumerate(buffer + b"\xff", start=1))
+        try:
+            self._run(_FOREVER, STOP_INPUT)
+        finally:
+            self.stop_input()
+
+    def play_input(self, events):
+        """Play back a sequence of (frame, value) pairs through the input port
+
+        Frames count falling vSync edges from now, in order: the native loop
+        loads `value` into IN at the start of frame 1, the next vertical
+        pulse, and so on, holding it until the next event. Use BUTTON_...
+        or buttons() for the game controller, or read_input_script() for a
+        recorded session. This returns straight away: the events are applied
+        as the emulator runs, without returning to Python, and STOP_INPUT
+        reports the last one. It replaces any playback in progress.
+        """
+        now = self.frames
+        events = [(now + frame, value) for frame, value in events]
+        if any(a[0] > b[0] for a, b in zip(events, events[1:])):
+            raise ValueError("Input events must be in frame order")
+        self._input = _gtemu.ffi.new("InputEvent[]", events)
+        self._machine.inputLength = len(events)
+        self._machine.inputNext = 0
+        self._machine.input = self._input if events else _gtemu.ffi.NULL
+
+    def stop_input(self):
+        """Stop playing back input, leaving IN as it is"""
+        self._machine.input = _gtemu.ffi.NULL
+        self._input = None
+
+    @property
+    def playing_input(self):
+        """Whether input events remain to be played back"""
+        return self._machine.input != _gtemu.ffi.NULL
 
     def read_serial(self, *, bits):
         """Read a single serial value through the output port
 
-        Returns the value read and the number of bits that were read
+        Returns the value read.
         """
         # Conversely, from an architectural point of view, the Gigatron has a single 8-bit
         # output port, which is written as a byte. However this drives multiple output devices.
@@ -453,121 +1213,177 @@ class _Emulator:
         # /VSYNC pulse, which can be counted in terms of /HSYNC pulses.
         # 8 is the default length and so can be interpretted as no data transmission,
         # but it is shortened to 7 for a zero bit, and stretched to 9 for a 1.
-        # This code is kinda complicated
-        def generate_outputs():
-            """Step the emulator yielding OUT"""
-            while True:
-                yield self.OUT
-                self._step()
-
-        # create two generators yielding just the vsync and hsync bits.
-        # The place value doesn't matter because we're going to edge-detect
-        # and only look at sign.
-        _outs1, _outs2 = itertools.tee(generate_outputs())
-        vsyncs, hsyncs = (o & _VSYNC for o in _outs1), (o & _HSYNC for o in _outs2)
-
-        def detect_edges(gen):
-            """Yield positive numbers for rising edges, and negative for falling"""
-            # Pairwise iteration
-            a, b = itertools.tee(gen)
-            next(b, None)
-            for prev, curr in zip(a, b):
-                yield curr - prev
-
-        def debug_detect_edges_short(edges):
-            """Useful routine to use when debugging the code below"""
-            for value in edges:
-                if value < 0:
-                    print("v", end="")
-                elif value > 0:
-                    print("^", end="")
-                yield value
-
-        def debug_detect_edges(edges):
-            """Useful routine to use when debugging the code below"""
-            state = "X"
-            for i, value in enumerate(edges):
-                if i % 6400 == 0:
-                    print("\n", self.state)
-                    print("\n", self.vcpu_state)
-                elif i % 80 == 0:
-                    print()
-                if value == 0:
-                    print(state, end="")
-                elif value < 0:
-                    state = "_"
-                    print("\\", end="")
-                else:
-                    state = "‾"
-                    print("/", end="")
-                yield value
-
-        # vsync_edges, hsync_edges = (
-        #     debug_detect_edges_short(detect_edges(vsyncs)),
-        #     debug_detect_edges(detect_edges(hsyncs)),
-        # )
-        vsync_edges, hsync_edges = detect_edges(vsyncs), detect_edges(hsyncs)
-
-        def do_line_counting(vsync_edges, hsync_edges):
-            """Yield count of lines in each negative vsync pulse"""
-            pairs = zip(vsync_edges, hsync_edges)
-            while True:
-                # Advance to falling edge
-                i = itertools.dropwhile(lambda pair: pair[0] >= 0, pairs)
-                # .. and continue until we see a rising edge
-                i = itertools.takewhile(lambda pair: pair[0] <= 0, i)
-                # count falling HSYNC edges within this window
-                yield sum(1 for _, h_edge in i if h_edge < 0)
-
-        lines_per_vsync = do_line_counting(vsync_edges, hsync_edges)
-
-        def debug_counting(lines_per_vsync):
-            """useful routine when debugging the code below"""
-            for frame, hsync_edges in enumerate(lines_per_vsync):
-                print(f"Frame {frame} has {hsync_edges} line vsync pulse")
-                yield hsync_edges
-
-        # lines_per_vsync = debug_counting(lines_per_vsync)
-        # Skip frames with 8 line VSYNC signals
-        lines_per_vsync = itertools.dropwhile(lambda count: count == 8, lines_per_vsync)
-        # and continue until we return to 8
-        lines_per_vsync = itertools.takewhile(lambda count: count != 8, lines_per_vsync)
+        # The native loop counts the lines and records the bits as they arrive,
+        # so that output sent while we were busy elsewhere is not lost.
         # Data is sent in little-endian order.
         # So a 1 in the first frame represents 1
         # and a 1 in the second frame represents 2
         result = 0
-        for bit_number, lines in enumerate(lines_per_vsync):
-            assert lines in (7, 9), f"Unexpected VSYNC length {lines}"
-            if lines == 7:
-                value = 0
-            if lines == 9:
-                value = 1 << bit_number
-            result |= value
-            if bit_number == bits - 1:
-                break
-        else:
-            # We did not see the expected number of bits in the transmission
-            raise AssertionError(f"Only saw {bit_number} bits in the transmission")
+        bit_number = 0
+        while bit_number < bits:
+            pulse = self._next_serial_pulse()
+            if pulse == _SERIAL_IDLE:
+                if bit_number:
+                    # We did not see the expected number of bits in the transmission
+                    raise AssertionError(
+                        f"Only saw {bit_number} bits in the transmission"
+                    )
+                continue
+            result |= pulse << bit_number
+            bit_number += 1
         return result
 
+    def _next_serial_pulse(self):
+        """Return the next recorded serial pulse, running until there is one"""
+        core = self._core
+        while core.serialRead == core.serialCount:
+            self._run(_FOREVER, STOP_SERIAL)
+        # Skip what has been overwritten if we have fallen behind
+        core.serialRead = max(core.serialRead, core.serialCount - _SERIAL_SIZE)
+        pulse = core.serial[core.serialRead % _SERIAL_SIZE]
+        core.serialRead += 1
+        return pulse
+
+    def read_serial_bytes(self, n):
+        """Read n bytes sent through the output port"""
+        return bytes(self.read_serial(bits=8) for _ in range(n))
+
+    def load_gt1(self, path_or_bytes, run=True):
+        """Load a GT1 program straight into RAM, bypassing the Loader
+
+        Segments are written as gtsim does, through the current banking.
+        If run is True, vPC and vLR are then set so that the vCPU continues
+        at the start address. This is meant to be used once the ROM has booted;
+        unless the vCPU is emulated at a high level, the emulator is first run
+        up to the next time the vCPU is entered.
+
+        Returns the start address.
+        """
+        if isinstance(path_or_bytes, (bytes, bytearray, memoryview)):
+            data = bytes(path_or_bytes)
+        else:
+            data = pathlib.Path(path_or_bytes).read_bytes()
+        segments, start = _parse_gt1(data)
+        for address, segment in segments:
+            for byte in segment:
+                self.RAM[self.physical_address(address)] = byte
+                address = address & 0xFF00 | (address + 1) & 0xFF
+        if run:
+            hle = self._core.hle
+            # vPC can be changed between any two instructions in high-level emulation
+            if not hle.active or hle.fallback:
+                with self.additional_breakpoints(_VCPU_ENTRY_BREAKPOINTS):
+                    self._run_to_breakpoint(_FOREVER)
+            self.vPC = start & 0xFF00 | (start - 2) & 0xFF
+            self.vLR = start
+        return start
+
+
+def buttons(*pressed):
+    """Return the value of IN with the given BUTTON_... bits pressed"""
+    value = 0xFF
+    for button in pressed:
+        value &= ~button
+    return value
+
+
+def read_input_script(path):
+    """Read (frame, value) pairs for Gigatron.play_input() from a text file
+
+    Each line holds a frame number and a value in hex, such as `120 7f` to
+    press A from the 120th frame. Text after # is a comment.
+    """
+    events = []
+    with open(path) as fp:
+        for number, line in enumerate(fp, start=1):
+            fields = line.split("#", 1)[0].split()
+            if not fields:
+                continue
+            try:
+                frame, value = int(fields[0]), int(fields[1], 16)
+                if len(fields) != 2 or not 0 <= value <= 0xFF:
+                    raise ValueError
+            except (IndexError, ValueError):
+                raise ValueError(f"{path}:{number}: expected a frame and a byte")
+            events.append((frame, value))
+    return events
+
+
+def write_input_script(path, events):
+    """Write (frame, value) pairs in the format of read_input_script()"""
+    with open(path, "w") as fp:
+        for frame, value in events:
+            fp.write(f"{frame} {value:02x}\n")
+
+
+def _parse_gt1(data):
+    """Return the segments (address, bytes) of a GT1 file, and its start address"""
+    segments = []
+    i = 0
+    while True:
+        if i >= len(data):
+            raise ValueError("Truncated GT1 file")
+        if data[i] == 0 and i > 0:
+            break
+        if i + 3 > len(data):
+            raise ValueError("Truncated GT1 file")
+        address = data[i] << 8 | data[i + 1]
+        length = data[i + 2] or 256
+        if i + 3 + length > len(data):
+            raise ValueError("Truncated GT1 file")
+        segments.append((address, data[i + 3 : i + 3 + length]))
+        i += 3 + length
+    if i + 3 != len(data):
+        raise ValueError("Missing start address or extra data in GT1 file")
+    return segments, data[i + 1] << 8 | data[i + 2]
+
 
 _VSYNC = 0b1000_0000
 _HSYNC = 0b0100_0000
 
 
-# This is effectively a pointer to the IN global variable, which can be
-# Updated through list assignment.
-_IN = _gtemu.ffi.addressof(_gtemu.lib, "IN")
-RAM = _gtemu.lib.RAM
-ROM = _gtemu.lib.ROM
-Emulator = _Emulator()
+def frame_to_rgb(frame):
+    """Convert a frame of Gigatron colours to an array of 8-bit RGB values"""
+    import numpy
+
+    # Colours are stored as 0bBBGGRR, with two bits per channel
+    channels = [(frame >> shift) & 3 for shift in (0, 2, 4)]
+    return (numpy.stack(channels, axis=-1) * 85).astype(numpy.uint8)
+
+
+def write_png(path, frame):
+    """Write a frame of Gigatron colours to a PNG file
+
+    This only needs zlib, so that screenshots don't depend on an imaging library.
+    """
+    rgb = frame_to_rgb(frame)
+    height, width, _ = rgb.shape
+    # Each row is preceded by filter type 0 (None)
+    rows = b"".join(b"\x00" + rgb[y].tobytes() for y in range(height))
+
+    def chunk(kind, data):
+        crc = zlib.crc32(kind + data) & 0xFFFFFFFF
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", crc)
+
+    with open(path, "wb") as fp:
+        fp.write(b"\x89PNG\r\n\x1a\n")
+        fp.write(chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)))
+        fp.write(chunk(b"IDAT", zlib.compress(rows)))
+        fp.write(chunk(b"IEND", b""))
+
+
+# The default instance, and its memories
+Emulator = Gigatron()
+RAM = Emulator.RAM
+ROM = Emulator.ROM
 
 
 # Little vCPU disassembler copied from gt1dump.py
-def _disassemble_vcpu_next():
+def _disassemble_vcpu_next(emulator):
     """Return the string disassembly of the next instruction"""
-    # The next vPC is not Emulator.vPC + 2 - it doesn't carry into the high byte
-    next_vpc = Emulator.vPC & 0xFF00 | ((Emulator.vPC + 2 & 0xFF))
+    RAM = emulator.RAM
+    # The next vPC is not vPC + 2 - it doesn't carry into the high byte
+    next_vpc = emulator.vPC & 0xFF00 | ((emulator.vPC + 2 & 0xFF))
     opcode = RAM[next_vpc]
     # If we don't know a mnemonic, just use hex - no operands
     mnemonic, number_of_operands = _OPCODES.get(opcode, (f"${opcode:02x}", 0))
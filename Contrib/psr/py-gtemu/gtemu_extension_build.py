@@ -8,41 +8,28 @@ import pathlib
 
 from cffi import FFI
 
-# Paths to files elsewhere in the repository
-REPO_ROOT = (pathlib.Path(__file__).parent / ".." / ".." / "..").resolve()
-GTEMU_C = REPO_ROOT / "Docs" / "gtemu.c"
+# The emulator core is derived from Docs/gtemu.c, and lives next to this file
+HERE = pathlib.Path(__file__).parent.resolve()
+GTEMU_NATIVE_C = HERE / "gtemu_native.c"
+GTEMU_NATIVE_H = HERE / "gtemu_native.h"
 
 ffibuilder = FFI()
 
 # These definitions become most of the the API of the extension.
 # They're parsed by CFFI, but are in C syntax.
-# They're copied from gtemu.c, but in a more typical usage
-# they'd be taken from a manpage or other documentation.
-ffibuilder.cdef(
-    """\
-typedef struct { // TTL state that the CPU controls
-  uint16_t PC;
-  uint8_t IR, D, AC, X, Y, OUT, undef;
-} CpuState;
-"""
-)
-ffibuilder.cdef("extern uint8_t ROM[1<<16][2], RAM[1<<15], IN;")
-ffibuilder.cdef("CpuState cpuCycle(const CpuState S);")
+# The header declares the machine state and the native run loop,
+# and is written so that CFFI can parse it directly.
+ffibuilder.cdef(GTEMU_NATIVE_H.read_text())
 
 ffibuilder.set_source(
     "_gtemu",  # name of the output C extension
-    # The same code as above, but this time for including in the generated C.
-    # More typically this would be a single line that includes a header.
+    # The same declarations, but this time for including in the generated C.
     """\
-typedef struct { // TTL state that the CPU controls
-  uint16_t PC;
-  uint8_t IR, D, AC, X, Y, OUT, undef;
-} CpuState;
-
-CpuState cpuCycle(const CpuState S);
-extern uint8_t ROM[1<<16][2], RAM[1<<15], IN;
+#include <stdint.h>
+#include "gtemu_native.h"
 """,
-    sources=[str(GTEMU_C)],
+    sources=[str(GTEMU_NATIVE_C)],
+    include_dirs=[str(HERE)],
     libraries=[],
 )
 if __name__ == "__main__":
@@ -0,0 +1,787 @@
+// Native run loop for py-gtemu
+//
+// cpuCycle() is the one from Docs/gtemu.c, changed to take the ROM, RAM
+// and input port from a Machine instead of global variables, so that
+// several machines can coexist, and to decode the memory models of the
+// expansion boards. The run loop tracks the sync signals,
+// the beam position and XOUT the same way as the main loop in gtemu.c,
+// so that Python only needs to be involved when something interesting
+// happens. runHle() replaces the ROM's vCPU interpreter with a high-level
+// one when asked to (see gtemu_native.h).
+
+#include <stddef.h>
+#include <stdint.h>
+
+#include "gtemu_native.h"
+
+#define PIXEL_X (48 / 4 + 1)        // First visible pixel
+#define HBLANK_X (48 / 4 + 640 / 4) // Back porch plus visible pixels
+#define VBLANK_Y 480                // Visible lines
+
+#define LINE_CYCLES 200             // Video timing of the ROM
+#define FRAME_LINES 521
+#define VSYNC_LINE 6                // Lines from the start of vertical blank
+#define VSYNC_END_LINE 14
+#define VBLANK_LAST_LINE 40
+
+#define VCPUSELECT_ADDRESS 0x05 // Zero page variables of the ROM
+#define ENTROPY_ADDRESS 0x06
+#define VIDEOY_ADDRESS 0x09
+#define FRAMECOUNT_ADDRESS 0x0e
+#define SERIALRAW_ADDRESS 0x0f
+#define SERIALLAST_ADDRESS 0x10
+#define BUTTONSTATE_ADDRESS 0x11
+#define RESETTIMER_ADDRESS 0x12
+#define XOUTMASK_ADDRESS 0x14
+#define vPC_ADDRESS 0x16
+#define vAC_ADDRESS 0x18
+#define vLR_ADDRESS 0x1a
+#define vSP_ADDRESS 0x1c
+#define ROMTYPE_ADDRESS 0x21
+#define SYSFN_ADDRESS 0x22
+#define SOUNDTIMER_ADDRESS 0x2c
+#define VRESET_ADDRESS 0x01f0
+#define VIRQ_ADDRESS 0x01f6
+#define VIDEOTOP_ADDRESS 0x01f9
+#define SYS_OPCODE 0xb4
+#define ENTER 0x2ff      // ROM addresses of the vCPU interpreter
+#define DISPATCH 0x307   // Fetch of the instruction at vPC
+
+#define RESUME_HLE 0x10000 // Internal event of runCycles()
+
+uint32_t physicalAddress(const Machine *M, uint16_t addr)
+{
+  const RunState *R = &M->R;
+  int bank;
+  switch (M->memory) {
+  case 64:
+    return addr;
+  case 128:
+  case 512:
+    if (!(R->ctrl & 0x20) && (addr & 0x7f80) == 0x80)
+      addr ^= 0x8000; // Zero page banking
+    if (!(addr & 0x8000))
+      return addr;
+    bank = (R->xbank & 0x08) ? R->xbank >> 4 : (R->ctrl >> 6) & 3;
+    return ((uint32_t)bank << 15) | (addr & 0x7fff);
+  default:
+    return addr & 0x7fff;
+  }
+}
+
+static void control(Machine *M, uint16_t addr)
+{
+  if (M->memory == 512 && (addr & 0xfc) == 0xf0)
+    M->R.xbank = addr >> 8; // Extended banking code
+  else
+    M->R.ctrl = addr & 0x80fd;
+}
+
+static void watch(Machine *M, uint32_t address, uint8_t value, int access)
+{
+  uint8_t flags = M->watch[address];
+  if ((flags & access) &&
+      (!(flags & WATCH_VALUE) || M->watchValues[address] == value)) {
+    M->watchHit = access;
+    M->watchAddress = address;
+    M->watchValue = value;
+  }
+}
+
+static CpuState cpuCycle(Machine *M, const CpuState S)
+{
+  CpuState T = S; // New state is old state unless something changes
+
+  T.IR = M->ROM[S.PC][0]; // Instruction Fetch
+  T.D  = M->ROM[S.PC][1];
+
+  int ins = S.IR >> 5;       // Instruction
+  int mod = (S.IR >> 2) & 7; // Addressing mode (or condition)
+  int bus = S.IR&3;          // Busmode
+  int W = (ins == 6);        // Write instruction?
+  int J = (ins == 7);        // Jump instruction?
+
+  uint8_t lo=S.D, hi=0, *to=NULL; // Mode Decoder
+  int incX=0;
+  if (!J)
+    switch (mod) {
+      #define E(p) (W?0:p) // Disable AC and OUT loading during RAM write
+      case 0: to=E(&T.AC);                          break;
+      case 1: to=E(&T.AC); lo=S.X;                  break;
+      case 2: to=E(&T.AC);         hi=S.Y;          break;
+      case 3: to=E(&T.AC); lo=S.X; hi=S.Y;          break;
+      case 4: to=  &T.X;                            break;
+      case 5: to=  &T.Y;                            break;
+      case 6: to=E(&T.OUT);                         break;
+      case 7: to=E(&T.OUT); lo=S.X; hi=S.Y; incX=1; break;
+    }
+  uint16_t addr = (hi << 8) | lo;
+
+  uint32_t phys = W || bus == 1 ? physicalAddress(M, addr) : 0;
+  int B = S.undef; // Data Bus
+  switch (bus) {
+    case 0: B=S.D;                                 break;
+    case 1: if (!W) B = M->RAM[phys];              break;
+    case 2: B=S.AC;                                break;
+    case 3: B=M->R.IN;                             break;
+  }
+  if (M->watch && bus == 1 && !W)
+    watch(M, phys, B, WATCH_READ);
+
+  if (W) {
+    if (bus == 1 && M->memory >= 128)
+      control(M, addr); // Expansion board control code
+    else {
+      M->RAM[phys] = B; // Random Access Memory
+      if (M->watch)
+        watch(M, phys, B, WATCH_WRITE);
+    }
+  }
+
+  uint8_t ALU; // Arithmetic and Logic Unit
+  switch (ins) {
+    case 0: ALU =        B; break; // LD
+    case 1: ALU = S.AC & B; break; // ANDA
+    case 2: ALU = S.AC | B; break; // ORA
+    case 3: ALU = S.AC ^ B; break; // XORA
+    case 4: ALU = S.AC + B; break; // ADDA
+    case 5: ALU = S.AC - B; break; // SUBA
+    case 6: ALU = S.AC;     break; // ST
+    case 7: ALU = -S.AC;    break; // Bcc/JMP
+  }
+
+  if (to) *to = ALU; // Load value into register
+  if (incX) T.X = S.X + 1; // Increment X
+
+  T.PC = S.PC + 1; // Next instruction
+  if (J) {
+    if (mod != 0) { // Conditional branch within page
+      int cond = (S.AC>>7) + 2*(S.AC==0);
+      if (mod & (1 << cond)) // 74153
+        T.PC = (S.PC & 0xff00) | B;
+    } else
+      T.PC = (S.Y << 8) | B; // Unconditional far jump
+  }
+  return T;
+}
+
+static void capture(Machine *M, int vgaX, int vgaY, uint8_t out)
+{
+  int x = vgaX - PIXEL_X;
+  if (x < 0 || x >= 160 || vgaY < 0 || vgaY >= VBLANK_Y)
+    return;
+  uint8_t pixel = out & 63;
+  if (M->physical) {
+    uint8_t *p = M->frame + vgaY * 640 + x * 4;
+    p[0] = p[1] = p[2] = p[3] = pixel;
+  } else if ((vgaY & 3) == 0)
+    M->frame[(vgaY >> 2) * 160 + x] = pixel;
+}
+
+static int serialPulse(RunState *R)
+{
+  uint8_t pulse, last = R->serial[(R->serialCount - 1) % SERIAL_SIZE];
+  switch (R->syncLines) {
+  case 7: pulse = 0; break;
+  case 9: pulse = 1; break;
+  default: // Idle, or not a serial pulse
+    if (!R->serialCount || last == SERIAL_IDLE)
+      return 0;
+    pulse = SERIAL_IDLE;
+  }
+  R->serial[R->serialCount++ % SERIAL_SIZE] = pulse;
+  return STOP_SERIAL;
+}
+
+static int nextInput(Machine *M, uint64_t frames)
+{
+  while (M->inputNext < M->inputLength && M->input[M->inputNext].frame <= frames)
+    M->R.IN = M->input[M->inputNext++].value;
+  if (M->inputNext < M->inputLength)
+    return 0;
+  M->input = NULL;
+  return STOP_INPUT;
+}
+
+static uint16_t registerWord(const Machine *M, uint8_t address)
+{
+  return M->RAM[address] | M->RAM[address + 1] << 8;
+}
+
+// Charge the cycles since the last dispatch, vPC being the next instruction
+static void chargeVcpu(Machine *M, uint64_t t, uint16_t vPC)
+{
+  VcpuProfiler *P = M->profiler;
+  if (P->timing) {
+    P->cycles[P->vPC] += t - P->dispatched - P->away;
+    if (P->sys && vPC != P->vPC)
+      P->sysCalls[P->sysFn]++;
+  }
+  P->timing = 0;
+}
+
+static void profileVcpu(Machine *M, CpuState S, uint64_t t)
+{
+  VcpuProfiler *P = M->profiler;
+  if (S.PC == DISPATCH) { // vPC has just been advanced to the next instruction
+    uint16_t vPC = registerWord(M, vPC_ADDRESS);
+    chargeVcpu(M, t, vPC);
+    P->timing = 1;
+    P->vPC = vPC;
+    P->sys = M->RAM[physicalAddress(M, vPC)] == SYS_OPCODE;
+    P->sysFn = registerWord(M, SYSFN_ADDRESS);
+    P->dispatched = t;
+    P->away = 0;
+  } else if (S.IR == 0xe1 && S.D == 0x1e) // jmp(Y,[vReturn])
+    P->left = t;
+  else if (S.IR == 0xe0 && S.D == (ENTER & 0xff) && S.Y == M->RAM[VCPUSELECT_ADDRESS])
+    P->away += t - 3 - P->left; // jmp(Y,'ENTER')
+}
+
+static void violation(Machine *M, int check, int measured, int expected,
+                      uint16_t pc, uint64_t t, uint64_t frames)
+{
+  TimingChecker *C = M->timing;
+  if (measured == expected)
+    return;
+  if (C->count < C->capacity) {
+    TimingViolation *V = &C->violations[C->count];
+    V->check = check;
+    V->measured = measured;
+    V->expected = expected;
+    V->pc = pc;
+    V->cycle = t;
+    V->frame = frames;
+    V->line = C->line;
+  }
+  C->count++;
+}
+
+static void checkTiming(Machine *M, CpuState S, CpuState T, uint16_t pc,
+                        uint64_t t, uint64_t frames)
+{
+  TimingChecker *C = M->timing;
+  int hSync = (T.OUT & 0x40) - (S.OUT & 0x40);
+  int vSync = (T.OUT & 0x80) - (S.OUT & 0x80);
+
+  if ((S.IR & 0x1f) == 0x1d && (S.IR >> 5) < 6) { // Pixel from [y,x++]
+    if (!C->pixels && C->hSynced) {
+      violation(M, TIMING_HBACK, t - C->rise, C->hBackCycles, pc, t, frames);
+      if (C->pixelLine < 0 && C->vSynced) {
+        C->pixelLine = C->line;
+        violation(M, TIMING_VBACK, C->line - 1 - C->vSyncLines, C->vBackLines,
+                  pc, t, frames);
+      }
+    }
+    if (!C->pixels)
+      C->firstPixel = t;
+    C->pixels = 1;
+    C->lastPixel = t;
+    C->lastPixelPC = pc;
+  }
+  if (hSync < 0) { // Falling hSync edge
+    if (C->pixels && C->hSynced)
+      violation(M, TIMING_HFRONT, t - C->lastPixel - 1, C->hFrontCycles,
+                C->lastPixelPC, t, frames);
+    C->fall = t;
+  }
+  if (hSync > 0) { // Rising hSync edge
+    if (C->hSynced) {
+      violation(M, TIMING_LINE, t - C->rise, C->lineCycles, pc, t, frames);
+      if (C->fall > C->rise)
+        violation(M, TIMING_HSYNC, t - C->fall, C->hSyncCycles, pc, t, frames);
+    }
+    C->hSynced = 1;
+    C->rise = t;
+    C->pixels = 0;
+    C->line++;
+  }
+  if (vSync > 0 && C->vSynced) { // Rising vSync edge
+    int lines = M->R.syncLines;
+    if (lines != 7 && lines != 9) // Those are serial output
+      violation(M, TIMING_VSYNC, lines, C->vSyncLines, pc, t, frames);
+  }
+  if (vSync < 0) { // Falling vSync edge
+    if (C->vSynced) {
+      violation(M, TIMING_FRAME, C->line, C->frameLines, pc, t, frames);
+      if (C->pixelLine >= 0)
+        violation(M, TIMING_VFRONT, C->line + 1 - C->pixelLine - VBLANK_Y,
+                  C->vFrontLines, pc, t, frames);
+    }
+    C->vSynced = 1;
+    C->line = 0;
+    C->pixelLine = -1;
+  }
+}
+
+// Tell runCycles() when the ROM is at ENTER after running what HLE could not
+static int checkFallback(Machine *M, CpuState S, uint16_t lastPC)
+{
+  HleState *H = &M->R.hle;
+  if (H->fallback == HLE_ROM && S.PC == DISPATCH &&
+      registerWord(M, vPC_ADDRESS) != H->fallbackPC)
+    H->fallback = HLE_RESUME;
+  return H->fallback == HLE_RESUME && lastPC == ENTER ? RESUME_HLE : 0;
+}
+
+static int runCycles(Machine *M, uint64_t maxCycles, const uint8_t *breakpoints,
+                     int stopOn)
+{
+  RunState *R = &M->R;
+  CpuState S = R->S;
+  uint16_t lastPC = R->lastPC;
+  int vgaX = R->vgaX, vgaY = R->vgaY;
+  uint8_t xout = R->XOUT;
+  uint64_t frames = R->frames;
+  int event = 0;
+  uint64_t n;
+
+  for (n = 0; n < maxCycles && !event; n++) {
+    uint16_t pc = lastPC; // The instruction executing in this cycle
+    lastPC = S.PC; // Because of the pipeline this is the instruction in IR
+    CpuState T = cpuCycle(M, S);
+    if (M->profiler)
+      profileVcpu(M, S, R->cycles + n);
+    if (M->romCounts)
+      M->romCounts[lastPC]++;
+
+    int hSync = (T.OUT & 0x40) - (S.OUT & 0x40);
+    int vSync = (T.OUT & 0x80) - (S.OUT & 0x80);
+    vgaX++;
+    if (M->frame) // Pixel on screen during this cycle
+      capture(M, vgaX, vgaY, S.OUT);
+    if (vSync < 0) { // Falling vSync edge
+      vgaY = -36;
+      frames++;
+      R->syncLines = 0;
+      event |= stopOn & STOP_VSYNC;
+      if (M->input)
+        event |= stopOn & nextInput(M, frames);
+    } else if (vSync > 0) {
+      event |= stopOn & (STOP_VSYNC_END | serialPulse(R));
+    }
+    if (hSync < 0 && !(T.OUT & 0x80)) // Line during the vSync pulse
+      R->syncLines++;
+    if (hSync > 0) { // Rising hSync edge
+      vgaX = 0;
+      vgaY++;
+      xout = T.AC;
+      event |= stopOn & STOP_HSYNC;
+      if (vgaY == VBLANK_Y)
+        event |= stopOn & STOP_VBLANK;
+    }
+    if (vgaX == HBLANK_X)
+      event |= stopOn & STOP_HBLANK;
+    if (M->timing)
+      checkTiming(M, S, T, pc, R->cycles + n, frames);
+    if (M->trace) {
+      TraceEntry *E = &M->trace[M->traceCount++ % M->traceSize];
+      E->PC = pc;
+      E->IR = S.IR;
+      E->D = S.D;
+      E->AC = T.AC;
+      E->X = T.X;
+      E->Y = T.Y;
+      E->OUT = T.OUT;
+    }
+    if (M->watchHit) {
+      M->watchPC = pc;
+      event |= STOP_WATCHPOINT;
+    }
+    if (breakpoints && breakpoints[lastPC])
+      event |= STOP_BREAKPOINT;
+    if (R->hle.fallback)
+      event |= checkFallback(M, S, lastPC);
+    S = T;
+  }
+
+  R->S = S;
+  R->lastPC = lastPC;
+  R->vgaX = vgaX;
+  R->vgaY = vgaY;
+  R->XOUT = xout;
+  R->cycles += n;
+  R->frames = frames;
+  return event;
+}
+
+// High-level emulation of the vCPU
+
+static uint16_t inPage(uint16_t address, int offset)
+{
+  return (address & 0xff00) | ((address + offset) & 0xff);
+}
+
+static uint8_t peek(Machine *M, uint16_t address)
+{
+  uint32_t phys = physicalAddress(M, address);
+  if (M->watch)
+    watch(M, phys, M->RAM[phys], WATCH_READ);
+  return M->RAM[phys];
+}
+
+static void poke(Machine *M, uint16_t address, uint8_t value)
+{
+  uint32_t phys = physicalAddress(M, address);
+  M->RAM[phys] = value;
+  if (M->watch)
+    watch(M, phys, value, WATCH_WRITE);
+}
+
+static uint16_t deek(Machine *M, uint16_t address)
+{
+  return peek(M, address) | peek(M, inPage(address, 1)) << 8;
+}
+
+static void doke(Machine *M, uint16_t address, uint16_t value)
+{
+  poke(M, address, value);
+  poke(M, inPage(address, 1), value >> 8);
+}
+
+// Do what the ROM does on this line of the frame, for the vCPU to see
+static int hleLine(Machine *M, int line, int stopOn)
+{
+  RunState *R = &M->R;
+  int v5 = M->RAM[ROMTYPE_ADDRESS] >= 0x40;
+  int event = stopOn & (STOP_HSYNC | STOP_HBLANK);
+  uint8_t a, raw, last, state;
+
+  R->vgaX = 0;
+  R->vgaY = line < VSYNC_LINE ? VBLANK_Y + line : line - VBLANK_LAST_LINE - 1;
+  if (R->vgaY == VBLANK_Y)
+    event |= stopOn & STOP_VBLANK;
+
+  if (line == 0) { // vBlankStart
+    poke(M, VIDEOY_ADDRESS, 1 - 2 * (VBLANK_LAST_LINE - 1)); // videoYline0
+    poke(M, 0x80, 1);
+    a = peek(M, FRAMECOUNT_ADDRESS) + 1;
+    poke(M, FRAMECOUNT_ADDRESS, a);
+    a = (a ^ peek(M, ENTROPY_ADDRESS + 1) ^ peek(M, SERIALRAW_ADDRESS)) +
+        peek(M, ENTROPY_ADDRESS);
+    poke(M, ENTROPY_ADDRESS, a);
+    a += peek(M, ENTROPY_ADDRESS + 2);
+    poke(M, ENTROPY_ADDRESS + 2, a);
+    a = (a ^ (a & 0x80 ? 64 + 32 + 8 + 4 : 64 + 16 + 2 + 1)) +
+        peek(M, ENTROPY_ADDRESS + 1);
+    poke(M, ENTROPY_ADDRESS + 1, a);
+    a = peek(M, SOUNDTIMER_ADDRESS);
+    poke(M, XOUTMASK_ADDRESS, (peek(M, XOUTMASK_ADDRESS) & 0x0f) | (a ? 0xf0 : 0));
+    if (a)
+      poke(M, SOUNDTIMER_ADDRESS, a - 1);
+    if (v5 && !peek(M, FRAMECOUNT_ADDRESS) && deek(M, VIRQ_ADDRESS)) {
+      uint16_t vIRQ = deek(M, VIRQ_ADDRESS);
+      doke(M, 0x30, registerWord(M, vPC_ADDRESS)); // Save vPC and vAC
+      doke(M, 0x32, registerWord(M, vAC_ADDRESS));
+      doke(M, vPC_ADDRESS, inPage(vIRQ, -2));
+      doke(M, vAC_ADDRESS, M->RAM[VCPUSELECT_ADDRESS] << 8);
+      poke(M, VCPUSELECT_ADDRESS, ENTER >> 8);
+    }
+  } else if (line < VBLANK_LAST_LINE)
+    poke(M, VIDEOY_ADDRESS, peek(M, VIDEOY_ADDRESS) + 2);
+
+  if (line == VSYNC_LINE) { // Falling vSync edge
+    R->frames++;
+    R->syncLines = 0;
+    event |= stopOn & STOP_VSYNC;
+    if (M->input)
+      event |= stopOn & nextInput(M, R->frames);
+  }
+  if (line == VSYNC_END_LINE) {
+    R->syncLines = 8;
+    event |= stopOn & (STOP_VSYNC_END | serialPulse(R));
+    poke(M, SERIALRAW_ADDRESS, R->IN);
+  }
+
+  if (line == VBLANK_LAST_LINE) { // Game controller and reset button
+    raw = peek(M, SERIALRAW_ADDRESS);
+    last = peek(M, SERIALLAST_ADDRESS);
+    state = peek(M, BUTTONSTATE_ADDRESS);
+    if ((((raw + 1) & raw) & 0xff) == 0) { // TypeC
+      if ((raw + 1) & last)
+        state &= 254 - raw;
+      state |= raw;
+    } else // TypeB
+      state = ((~last | raw) & state) | raw;
+    poke(M, BUTTONSTATE_ADDRESS, state);
+    poke(M, SERIALLAST_ADDRESS, raw);
+    if (state == (0xff ^ 0x10)) { // Just [Start]
+      a = peek(M, RESETTIMER_ADDRESS) - 1;
+      poke(M, RESETTIMER_ADDRESS, a);
+      if (!(a & 127)) {
+        doke(M, vPC_ADDRESS, inPage(VRESET_ADDRESS, -2));
+        poke(M, VCPUSELECT_ADDRESS, ENTER >> 8);
+      }
+    } else
+      poke(M, RESETTIMER_ADDRESS, 128);
+    poke(M, VIDEOY_ADDRESS, v5 ? peek(M, VIDEOTOP_ADDRESS) : 0);
+  } else if (line > VBLANK_LAST_LINE) { // Visible lines
+    int top = v5 ? M->RAM[physicalAddress(M, VIDEOTOP_ADDRESS)] : 0;
+    int videoY = top + 2 * ((line - VBLANK_LAST_LINE) / 4);
+    if (videoY > 238)
+      videoY = 238;
+    if (M->RAM[VIDEOY_ADDRESS] != videoY)
+      poke(M, VIDEOY_ADDRESS, videoY);
+  }
+  return event;
+}
+
+// Let vCPU cycles pass, crossing lines and frames
+static int advance(Machine *M, uint32_t cost, int stopOn)
+{
+  RunState *R = &M->R;
+  HleState *H = &R->hle;
+  uint64_t F = H->frameCycles, to = H->position + cost;
+  int event = 0;
+
+  R->cycles += to * FRAME_LINES * LINE_CYCLES / F -
+               (uint64_t)H->position * FRAME_LINES * LINE_CYCLES / F;
+  while (to * FRAME_LINES >= (uint64_t)(H->line + 1) * F) {
+    if (++H->line == FRAME_LINES) {
+      H->line = 0;
+      to -= F;
+    }
+    event |= hleLine(M, H->line, stopOn);
+  }
+  H->position = to;
+  return event;
+}
+
+// Switch from the ROM, which is at ENTER, to high-level emulation
+static void enterHle(Machine *M)
+{
+  RunState *R = &M->R;
+  HleState *H = &R->hle;
+  int line = R->vgaY >= VBLANK_Y ? R->vgaY - VBLANK_Y
+                                 : R->vgaY + VBLANK_LAST_LINE + 1;
+  if (line < VSYNC_LINE && R->vgaY < 0)
+    line = VSYNC_LINE; // vgaY is -36 until the first line of the pulse starts
+  if (line >= FRAME_LINES)
+    line = FRAME_LINES - 1;
+
+  H->fallback = 0;
+  H->videoY = M->RAM[VIDEOY_ADDRESS];
+  H->vgaX = R->vgaX;
+  H->vgaY = R->vgaY;
+  H->line = line;
+  H->position = ((uint64_t)line * H->frameCycles + FRAME_LINES - 1) / FRAME_LINES;
+  if (M->profiler)
+    chargeVcpu(M, R->cycles, inPage(registerWord(M, vPC_ADDRESS), 2));
+}
+
+// Let the ROM run the instruction at pc
+static void fallBack(Machine *M, uint16_t pc)
+{
+  RunState *R = &M->R;
+  HleState *H = &R->hle;
+  H->fallback = HLE_ROM;
+  H->fallbackPC = pc;
+  M->RAM[VIDEOY_ADDRESS] = H->videoY;
+  R->vgaX = H->vgaX;
+  R->vgaY = H->vgaY;
+}
+
+// Emulate one vCPU instruction, as the ROM would run it from NEXT to NEXT
+static int hleStep(Machine *M, int stopOn)
+{
+  uint16_t pc = inPage(registerWord(M, vPC_ADDRESS), 2);
+  uint16_t vPC = pc; // As NEXT leaves it
+  uint16_t vAC = registerWord(M, vAC_ADDRESS), address;
+  uint8_t vSP = M->RAM[vSP_ADDRESS];
+  uint8_t op = peek(M, pc), D = peek(M, inPage(pc, 1)), b;
+  int setAC = 1, cost, taken, event;
+
+  if (M->RAM[VCPUSELECT_ADDRESS] != ENTER >> 8)
+    goto rom; // Another interpreter was selected
+  switch (op) {
+  case 0x5e: poke(M, D, vAC); setAC = 0; cost = 16; break; // ST
+  case 0x2b: doke(M, D, vAC); setAC = 0; cost = 20; break; // STW
+  case 0xec: doke(M, (uint8_t)(vSP + D), vAC); setAC = 0; cost = 26; break; // STLW
+  case 0x1a: vAC = peek(M, D); cost = 22; break; // LD
+  case 0x59: vAC = D; cost = 16; break; // LDI
+  case 0x11: // LDWI
+    vAC = D | peek(M, inPage(pc, 2)) << 8;
+    vPC = inPage(vPC, 1);
+    cost = 20;
+    break;
+  case 0x21: vAC = deek(M, D); cost = 20; break; // LDW
+  case 0xee: vAC = deek(M, (uint8_t)(vSP + D)); cost = 26; break; // LDLW
+  case 0x99: vAC += deek(M, D); cost = 28; break; // ADDW
+  case 0xb8: vAC -= deek(M, D); cost = 28; break; // SUBW
+  case 0xe3: vAC += D; cost = 28; break; // ADDI
+  case 0xe6: vAC -= D; cost = 28; break; // SUBI
+  case 0xe9: vAC <<= 1; vPC = inPage(vPC, -1); cost = 28; break; // LSLW
+  case 0x93: poke(M, D, peek(M, D) + 1); setAC = 0; cost = 20; break; // INC
+  case 0x82: vAC &= D; cost = 22; break; // ANDI
+  case 0xf8: vAC &= deek(M, D); cost = 28; break; // ANDW
+  case 0x88: vAC |= D; cost = 14; break; // ORI
+  case 0xfa: vAC |= deek(M, D); cost = 28; break; // ORW
+  case 0x8c: vAC ^= D; cost = 14; break; // XORI
+  case 0xfc: vAC ^= deek(M, D); cost = 26; break; // XORW
+  case 0xad: vAC = peek(M, vAC); vPC = inPage(vPC, -1); cost = 26; break; // PEEK
+  case 0xf6: vAC = deek(M, vAC); vPC = inPage(vPC, -1); cost = 28; break; // DEEK
+  case 0xf0: poke(M, deek(M, D), vAC); setAC = 0; cost = 26; break; // POKE
+  case 0xf3: doke(M, deek(M, D), vAC); setAC = 0; cost = 28; break; // DOKE
+  case 0x7f: // LUP, through the trampoline at the end of the ROM page
+    address = inPage(vAC, D);
+    if (M->ROM[address][0] != 0x00 || // ld $dd
+        M->ROM[(vAC & 0xff00) | 251][0] != 0xfe || // bra ac
+        M->ROM[(vAC & 0xff00) | 252][0] != 0xfc)   // bra 253
+      goto rom;
+    vAC = M->ROM[address][1];
+    cost = 26;
+    break;
+  case 0x90: vPC = (pc & 0xff00) | D; setAC = 0; cost = 14; break; // BRA
+  case 0x35: // BCC
+    switch (D) {
+    case 0x3f: taken = vAC == 0; break; // EQ
+    case 0x72: taken = vAC != 0; break; // NE
+    case 0x50: taken = (int16_t)vAC < 0; break; // LT
+    case 0x4d: taken = (int16_t)vAC > 0; break; // GT
+    case 0x56: taken = (int16_t)vAC <= 0; break; // LE
+    case 0x53: taken = (int16_t)vAC >= 0; break; // GE
+    default: goto rom;
+    }
+    vPC = taken ? (pc & 0xff00) | peek(M, inPage(pc, 2)) : inPage(vPC, 1);
+    setAC = 0;
+    cost = 28;
+    break;
+  case 0xcf: // CALL
+    doke(M, vLR_ADDRESS, inPage(pc, 2));
+    vPC = inPage(deek(M, D), -2);
+    setAC = 0;
+    cost = 26;
+    break;
+  case 0xff: // RET
+    vPC = inPage(registerWord(M, vLR_ADDRESS), -2);
+    setAC = 0;
+    cost = 20;
+    break;
+  case 0x75: // PUSH
+    doke(M, (uint8_t)(vSP - 2), registerWord(M, vLR_ADDRESS));
+    poke(M, vSP_ADDRESS, vSP - 2);
+    vPC = inPage(vPC, -1);
+    setAC = 0;
+    cost = 26;
+    break;
+  case 0x63: // POP
+    doke(M, vLR_ADDRESS, deek(M, vSP));
+    poke(M, vSP_ADDRESS, vSP + 2);
+    vPC = inPage(vPC, -1);
+    setAC = 0;
+    cost = 26;
+    break;
+  case 0xdf: poke(M, vSP_ADDRESS, vSP + D); setAC = 0; cost = 14; break; // ALLOC
+  case 0xb4: // SYS
+    if (M->hleSys && M->hleSys[registerWord(M, SYSFN_ADDRESS)])
+      return STOP_SYS;
+    goto rom;
+  case 0xcd: vAC = inPage(pc, 2); vPC = (pc & 0xff00) | D; cost = 24; break; // DEF
+  case 0x85: // CALLI
+    doke(M, vLR_ADDRESS, inPage(pc, 3));
+    vPC = inPage(D | peek(M, inPage(pc, 2)) << 8, -2);
+    setAC = 0;
+    cost = 28;
+    break;
+  case 0x1f: // CMPHS
+  case 0x97: // CMPHU
+    b = peek(M, D);
+    if (((vAC >> 8) ^ b) & 0x80) {
+      b += (op == 0x1f) == !(vAC & 0x8000) ? 1 : -1;
+      vAC = (vAC & 0xff) | b << 8;
+      cost = 28;
+    } else {
+      setAC = 0;
+      cost = 22;
+    }
+    break;
+  default:
+  rom:
+    fallBack(M, pc);
+    return 0;
+  }
+
+  if (setAC)
+    doke(M, vAC_ADDRESS, vAC);
+  doke(M, vPC_ADDRESS, vPC); // NEXT adds 2
+  if (M->profiler)
+    M->profiler->cycles[pc] += cost;
+  event = stopOn & STOP_VCPU;
+  event |= advance(M, cost, stopOn);
+  if (M->watchHit) {
+    M->watchPC = pc;
+    event |= STOP_WATCHPOINT;
+  }
+  return event;
+}
+
+static int runHle(Machine *M, uint64_t maxCycles, const uint8_t *breakpoints,
+                  int stopOn)
+{
+  RunState *R = &M->R;
+  uint64_t start = R->cycles;
+  int event = 0;
+
+  while (!event && R->cycles - start < maxCycles) {
+    if (R->hle.fallback) {
+      event = runCycles(M, maxCycles - (R->cycles - start), breakpoints, stopOn);
+      if (event & RESUME_HLE) {
+        enterHle(M);
+        event &= ~RESUME_HLE;
+      }
+    } else
+      event = hleStep(M, stopOn);
+  }
+  return event;
+}
+
+void startHle(Machine *M, uint32_t frameCycles)
+{
+  HleState *H = &M->R.hle;
+  H->frameCycles = frameCycles;
+  if (H->active)
+    return;
+  H->active = 1;
+  H->fallback = HLE_RESUME;
+  H->fallbackPC = 0;
+  if (M->R.lastPC == ENTER)
+    enterHle(M);
+}
+
+void stopHle(Machine *M)
+{
+  HleState *H = &M->R.hle;
+  if (H->active && !H->fallback)
+    fallBack(M, 0);
+  H->active = 0;
+  H->fallback = 0;
+}
+
+int completeSys(Machine *M, uint16_t pc, int stopOn)
+{
+  uint8_t D = M->RAM[physicalAddress(M, inPage(pc, 1))];
+  int cost = 28 - 2 * ((D ^ 128) - 128), event;
+
+  M->watchHit = 0;
+  if (registerWord(M, vPC_ADDRESS) == inPage(pc, -2))
+    doke(M, vPC_ADDRESS, pc);
+  if (M->profiler) {
+    M->profiler->cycles[pc] += cost;
+    M->profiler->sysCalls[registerWord(M, SYSFN_ADDRESS)]++;
+  }
+  event = stopOn & STOP_VCPU;
+  event |= advance(M, cost, stopOn);
+  if (M->watchHit) {
+    M->watchPC = pc;
+    event |= STOP_WATCHPOINT;
+  }
+  return event;
+}
+
+int run(Machine *M, uint64_t maxCycles, const uint8_t *breakpoints, int stopOn)
+{
+  M->watchHit = 0;
+  if (M->R.hle.active)
+    return runHle(M, maxCycles, breakpoints, stopOn);
+  return runCycles(M, maxCycles, breakpoints, stopOn);
+}
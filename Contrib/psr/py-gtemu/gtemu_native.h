@@ -0,0 +1,260 @@
+// Native support code for py-gtemu
+//
+// This header is included by gtemu_native.c and by the generated extension,
+// and it is also given verbatim to ffibuilder.cdef(), so it must stay within
+// the subset of C that CFFI can parse: no #include and no conditionals.
+
+typedef struct { // TTL state that the CPU controls
+  uint16_t PC;
+  uint8_t IR, D, AC, X, Y, OUT, undef;
+} CpuState;
+
+typedef struct { // High-level vCPU emulation (see below)
+  int active;           // Whether the vCPU is emulated at a high level
+  int fallback;         // 0, HLE_ROM or HLE_RESUME while the ROM runs
+  uint16_t fallbackPC;  // Address of the instruction the ROM runs for HLE_ROM
+  uint32_t frameCycles; // vCPU cycles in a frame, set by the caller
+  uint32_t position;    // vCPU cycles since the start of the frame
+  int line;             // Scan line, counted from the start of vertical blank
+  uint8_t videoY;       // videoY, vgaX and vgaY of the ROM when it was left
+  int vgaX, vgaY;
+} HleState;
+
+typedef struct { // Everything the run loop keeps between calls
+  CpuState S;      // CPU state after the last cycle
+  uint16_t lastPC; // Address of the instruction now in IR
+  uint8_t XOUT;    // Extended output register, latched on rising hSync
+  uint8_t IN;      // Input port
+  uint16_t ctrl;   // Last control code of a banked memory model
+  uint8_t xbank;   // Last extended banking code of the 512K model
+  int vgaX, vgaY;  // Beam position, counted like gtemu.c does
+  uint64_t cycles; // Cycles executed since reset
+  uint64_t frames; // Falling vSync edges since reset
+  int syncLines;   // Falling hSync edges during the current vSync pulse
+  uint32_t serialCount; // Serial pulses recorded since reset
+  uint32_t serialRead;  // Serial pulses consumed by the caller
+  uint8_t serial[1024]; // The last SERIAL_SIZE serial pulses
+  HleState hle;         // High-level vCPU emulation
+} RunState;
+
+typedef struct { // vCPU profiler (see below)
+  uint64_t *cycles;    // 64K counters of cycles, indexed by vPC
+  uint64_t *sysCalls;  // 64K counters of completed SYS calls, indexed by sysFn
+  int timing;          // Whether an instruction is being timed
+  uint16_t vPC;        // Address of that instruction
+  int sys;             // Whether it is a SYS instruction
+  uint16_t sysFn;      // The value of sysFn when it was dispatched
+  uint64_t dispatched; // Cycle count when it was dispatched
+  uint64_t away;       // Cycles spent outside the interpreter since then
+  uint64_t left;       // Cycle count when the interpreter was last left
+} VcpuProfiler;
+
+typedef struct { // A change of the input port (see below)
+  uint64_t frame; // Value of frames from which it applies
+  uint8_t value;  // The new value of IN
+} InputEvent;
+
+typedef struct { // One cycle of the trace (see below)
+  uint16_t PC;           // Address of the instruction executed
+  uint8_t IR, D;         // The instruction
+  uint8_t AC, X, Y, OUT; // Registers after it
+} TraceEntry;
+
+typedef struct { // A departure from the expected video timing
+  int check;       // Which length is wrong, one of the TIMING_... codes
+  int measured;    // The length found, in cycles or lines
+  int expected;    // The length expected
+  uint16_t pc;     // Address of the instruction that ended the length
+  uint64_t cycle;  // Cycle count at that instruction
+  uint64_t frame;  // Frame count at that instruction
+  int line;        // Lines since the start of the last vSync pulse
+} TimingViolation;
+
+typedef struct { // Video timing checker (see below)
+  int lineCycles;   // Expected lengths, set by the caller
+  int hSyncCycles;
+  int hBackCycles;
+  int hFrontCycles;
+  int vSyncLines;
+  int vBackLines;
+  int vFrontLines;
+  int frameLines;
+  TimingViolation *violations; // Where to record violations
+  uint32_t capacity;           // Number of elements in violations
+  uint32_t count;              // Violations found, including those not recorded
+  int hSynced, vSynced;        // Whether a line or frame has started since
+  uint64_t rise, fall;         // Cycles of the last hSync edges
+  int pixels;                  // Whether the current line has pixels
+  uint64_t firstPixel, lastPixel; // Cycles of its first and last pixels
+  uint16_t lastPixelPC;        // Address of the last one
+  int line;                    // Lines since the start of the vSync pulse
+  int pixelLine;               // First line with pixels, or -1
+} TimingChecker;
+
+typedef struct { // One emulated Gigatron
+  RunState R;         // State that snapshots copy
+  uint8_t (*ROM)[2];  // 64K words of ROM
+  uint8_t *RAM;       // memory * 1024 bytes of RAM
+  int memory;         // Memory model, in kilobytes (see below)
+  uint8_t *frame;     // NULL, or where to capture pixels (see below)
+  int physical;       // Capture 480x640 VGA pixels instead of 120x160
+  const InputEvent *input; // NULL, or changes to make to the input port
+  uint32_t inputLength;    // Number of events in input
+  uint32_t inputNext;      // Index of the next event
+  VcpuProfiler *profiler; // NULL, or where to profile the vCPU
+  uint64_t *romCounts;    // NULL, or 64K counters of executions by ROM address
+  TimingChecker *timing;  // NULL, or where to check the video timing
+  TraceEntry *trace;      // NULL, or a ring buffer of traceSize cycles
+  uint32_t traceSize;
+  uint64_t traceCount;    // Cycles traced since trace was set
+  uint8_t *watch;         // NULL, or WATCH_... flags for each byte of RAM
+  uint8_t *watchValues;   // The values for WATCH_VALUE, for each byte of RAM
+  int watchHit;           // The access that stopped run(), or 0
+  uint32_t watchAddress;  // Offset in RAM of that access
+  uint8_t watchValue;     // The value read or written
+  uint16_t watchPC;       // Address of the instruction that did it
+  const uint8_t *hleSys;  // NULL, or 64K flags by sysFn for SYS calls done by the host
+} Machine;
+
+// Memory models: 32 and 64 are plain RAM. 128 decodes the control
+// codes of the 128K expansion board: bits 6-7 select the bank seen at
+// 0x8000-0xffff and clearing bit 5 swaps 0x80-0xff with the banked
+// zero page, as in Contrib/at67. 512 adds the extended banking codes of
+// the 512K board (low byte 0xf0): when bit 3 of the high byte is set,
+// its high nibble selects one of 16 banks for 0x8000-0xffff. Bank b
+// lives at RAM + b * 0x8000. Control codes do not write RAM on banked
+// models. The SPI devices and the video snooping of the 512K board are
+// not emulated.
+
+// Return the offset in RAM that the CPU reaches at addr
+uint32_t physicalAddress(const Machine *M, uint16_t addr);
+
+// When frame is not NULL, the run loop stores the colour bits of OUT
+// for every visible pixel. Logical frames are 120 rows of 160 pixels
+// taken from the first scanline of each group of four, physical frames
+// are 480 rows of 640 VGA pixels. Frames are complete on STOP_VSYNC.
+
+// Serial output from SYS_SendSerial_v3_80 modulates the width of the
+// vSync pulse: 8 lines when idle, 7 for a zero bit and 9 for a one.
+// The run loop counts the lines of each pulse and records the bits in
+// the ring buffer serial[serialCount % SERIAL_SIZE], followed by
+// SERIAL_IDLE when an idle pulse ends the transmission. It never looks
+// at serialRead, so output is not lost while the caller does other things.
+#define SERIAL_SIZE 1024
+#define SERIAL_IDLE 255
+
+// When input is not NULL, each falling vSync edge applies the events of
+// input that are due: IN takes the value of each event whose frame is not
+// after the new value of frames, as if the game controller's shift register
+// had changed. The edge that applies the last event clears input.
+
+// When profiler is not NULL, each vCPU instruction dispatch (the fetch
+// at 0x307, as in gtsim) charges the cycles since the previous dispatch
+// to the vPC of the previous instruction, leaving out the time spent in
+// the video driver between jmp(Y,[vReturn]) and the jump back to ENTER.
+// A SYS call is counted when the next instruction is dispatched, so
+// that SYS calls retried for lack of time are only counted once.
+
+// When timing is not NULL, the run loop measures the video signal and
+// records each length that differs from the expected one, up to capacity.
+// Horizontal lengths are in cycles: the line from one rising hSync edge
+// to the next, the hSync pulse, the back porch from the rising hSync edge
+// to the first pixel and the front porch from the end of the last pixel
+// to the falling hSync edge. Pixels are instructions that load OUT from
+// [y,x++], and the porches are only checked on lines that have them. Vertical
+// lengths are in lines, starting with the line after the vSync edge as
+// the ROM changes vSync late in the line: the vSync pulse (where 7 and 9
+// lines are serial output and not violations), the back porch after a
+// pulse of the expected length up to the first line with pixels, the front porch from the 480 visible lines
+// after it to the next pulse, and the frame from pulse to pulse. The
+// porches of frames without pixels are not checked. pc is the instruction
+// that ended the length, except for horizontal front porches, where it is
+// the last pixel. Each length is measured once it has started after
+// timing is set.
+#define TIMING_LINE 1
+#define TIMING_HSYNC 2
+#define TIMING_HBACK 3
+#define TIMING_HFRONT 4
+#define TIMING_VSYNC 5
+#define TIMING_VBACK 6
+#define TIMING_VFRONT 7
+#define TIMING_FRAME 8
+
+// When trace is not NULL, each cycle stores the instruction it executed
+// and the registers after it in trace[traceCount++ % traceSize].
+
+// When watch is not NULL, reading or writing a byte of RAM that has
+// WATCH_READ or WATCH_WRITE set in watch stops the run loop after that
+// cycle, with the details in watchHit and the fields after it. When the
+// byte also has WATCH_VALUE set, only accesses of the value in watchValues
+// count. Bytes are indexed by their offset in RAM, as physicalAddress()
+// returns it.
+#define WATCH_READ 1
+#define WATCH_WRITE 2
+#define WATCH_VALUE 4
+
+// When hle.active is set, run() interprets vCPU instructions straight
+// from RAM, like Contrib/hsnaves/GtForth/vcpu.py but with the vPC
+// convention and cycle counts of ROMv5a, instead of running the ROM. The
+// ROM stays frozen at ENTER, where vPC can change, and time advances by
+// the cycles of each instruction, frameCycles of them making a frame of
+// 521 scan lines. The vertical blank logic of the ROM is done
+// synthetically, on the same lines: frameCount, entropy, the sound timer
+// and vIRQ_v5 at the start of vertical blank, videoY on every line,
+// falling vSync (frames, input events) on line 6, serialRaw from IN on
+// line 14 and buttonState and the [Start] reset timer on line 40. LEDs,
+// sound, pixels and video mode switching with [Select] are not emulated.
+// Each line raises STOP_HSYNC and STOP_HBLANK, and vgaY follows the lines.
+//
+// SYS calls whose sysFn is flagged in hleSys stop the loop with STOP_SYS
+// before the instruction, for the caller to do the work and then call
+// completeSys(). Other SYS calls, unknown opcodes, unknown conditions
+// of BCC and LUP outside the ROM's lookup tables fall back to the ROM:
+// fallback becomes HLE_ROM, videoY, vgaX and vgaY get back the values of
+// the ROM and the cycle-accurate loop runs from ENTER until the ROM has
+// dispatched another instruction (HLE_RESUME) and reached ENTER again,
+// where high-level emulation resumes on the line given by vgaY. ROM
+// breakpoints, the trace and the other cycle-accurate features only see
+// what the ROM runs. Watchpoints see the memory accesses of instructions
+// and the writes of vCPU registers; watchPC is then the vCPU address of
+// the instruction. The profiler charges the cycles of each instruction
+// to its address. Setting fallback to HLE_RESUME is how high-level
+// emulation starts (see startHle()).
+#define HLE_ROM 1
+#define HLE_RESUME 2
+
+// Events that can stop run(). The breakpoint event is always enabled
+// when a breakpoint bitmap is passed, the watchpoint event when
+// watch is set and the SYS event when hleSys is set.
+#define STOP_BREAKPOINT 1 // About to execute an instruction marked in the bitmap
+#define STOP_HSYNC 2      // Rising hSync edge (start of a line)
+#define STOP_VSYNC 4      // Falling vSync edge (start of the vertical pulse)
+#define STOP_VSYNC_END 8  // Rising vSync edge
+#define STOP_HBLANK 16    // Start of the horizontal front porch
+#define STOP_VBLANK 32    // Start of the vertical front porch
+#define STOP_SERIAL 64    // A serial pulse was recorded
+#define STOP_INPUT 128    // The last input event has been applied
+#define STOP_WATCHPOINT 256 // A watched byte of RAM was accessed
+#define STOP_VCPU 512     // A vCPU instruction was emulated at a high level
+#define STOP_SYS 1024     // About to emulate a SYS call flagged in hleSys
+
+// Run at most maxCycles cycles, stopping after the first cycle that
+// raises one of the events selected by stopOn. Breakpoints is either
+// NULL or a 64K array with a non-zero byte for each breakpoint address.
+// Returns the events that stopped the loop, or 0 if maxCycles was reached.
+// Machines are independent and the extension releases the GIL while
+// this runs, so different machines can run in different threads.
+int run(Machine *M, uint64_t maxCycles, const uint8_t *breakpoints, int stopOn);
+
+// Start high-level emulation with frameCycles vCPU cycles per frame. It
+// begins straight away if the ROM is at ENTER, else when it gets there.
+void startHle(Machine *M, uint32_t frameCycles);
+
+// Return to cycle-accurate emulation, from the ROM's last visit to ENTER
+void stopHle(Machine *M);
+
+// Finish the SYS call at address pc after STOP_SYS: charge the cycles
+// that its operand declares and, unless vPC was changed, advance vPC to
+// the next instruction. Returns the events selected by stopOn that this
+// raises, like run().
+int completeSys(Machine *M, uint16_t pc, int stopOn);
@@ -12,6 +12,7 @@ setup(
     setup_requires=["cffi>=1.0.0"],
     cffi_modules=["gtemu_extension_build.py:ffibuilder"],
     install_requires=["cffi>=1.0.0"],
+    extras_require={"frames": ["numpy"]},
     python_requires=">=3.6, <4",
-    py_modules=["gtemu"],
+    py_modules=["gtemu", "annotate_lst", "check_timing"],
 )
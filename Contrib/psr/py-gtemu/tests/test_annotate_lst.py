@@ -0,0 +1,70 @@
+"""Tests for annotating ROM listings with execution counts"""
+import pathlib
+
+import pytest
+
+import annotate_lst
+from gtemu import Gigatron
+
+_ROM_FILE = pathlib.Path(__file__).parent / ".." / "roms" / "echo.rom"
+_LST_FILE = _ROM_FILE.with_suffix(".lst")
+
+# In the format of asm.writeRomFiles()
+_LISTING = """\
+* source: test.asm.py
+start:        0000 0000  ld   $00
+              0001 0200  nop
+              0002 0200  nop
+              0003 0200  nop
+              * 5 times
+a_rather_long_label:
+              0006 fc06  bra  $06
+              0007
+"""
+
+
+def _counts(line):
+    column = line[:12].strip()
+    return int(column) if column else None
+
+
+def test_annotate():
+    counts = {0x0000: 1, 0x0001: 2, 0x0004: 3, 0x0005: 4, 0x0006: 5}
+    lines = list(annotate_lst.annotate(_LISTING.splitlines(True), counts))
+    assert [line[14:] for line in lines if ";;" not in line] == _LISTING.splitlines(
+        True
+    )
+    assert [_counts(line) for line in lines] == [
+        None,
+        10,  # start block
+        1,
+        2,
+        0,
+        0,
+        7,  # Repetition of 0x0004 and 0x0005
+        5,  # a_rather_long_label block
+        None,
+        5,
+        None,
+    ]
+
+
+def test_read_counts(tmp_path):
+    gigatron = Gigatron()
+    gigatron.ROM[0] = [0xFC, 0x00]  # bra $00, with its delay slot at $01
+    gigatron.start_rom_profiler()
+    gigatron.run(100)
+    gigatron.save_rom_profile(tmp_path / "counts")
+    assert annotate_lst.read_counts(tmp_path / "counts") == {0x0000: 50, 0x0001: 50}
+
+
+@pytest.mark.skipif(not _LST_FILE.exists(), reason="echo.lst not found")
+def test_counts_add_up(tmp_path):
+    gigatron = Gigatron()
+    gigatron.load_rom_file(_ROM_FILE)
+    gigatron.start_rom_profiler()
+    gigatron.run_frames(3)
+    gigatron.save_rom_profile(tmp_path / "counts")
+    annotate_lst.main([str(_LST_FILE), str(tmp_path / "counts"), str(tmp_path / "out")])
+    lines = (tmp_path / "out").read_text().splitlines()
+    assert sum(_counts(line) or 0 for line in lines if ";;" not in line) == gigatron.cycles
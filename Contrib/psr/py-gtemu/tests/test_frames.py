@@ -0,0 +1,75 @@
+"""Tests for frame capture"""
+import pathlib
+import zlib
+
+import pytest
+
+from gtemu import RAM, Emulator
+
+numpy = pytest.importorskip("numpy")
+
+_ROM_FILE = pathlib.Path(__file__).parent / ".." / "roms" / "echo.rom"
+
+
+def setup_module():
+    Emulator.load_rom_file(_ROM_FILE)
+
+
+def setup_function():
+    Emulator.reset()
+
+
+def _draw_test_pattern():
+    """Boot, then point the video table at a known pattern
+
+    The echo ROM doesn't set up the screen, and leaves the video table empty.
+    """
+    Emulator.run_to(0x2FF, max_instructions=10_000_000)
+    expected = numpy.zeros((120, 160), dtype=numpy.uint8)
+    for y in range(120):
+        page = 8 + y
+        RAM[0x100 + 2 * y] = page
+        RAM[0x101 + 2 * y] = 0
+        for x in range(160):
+            expected[y, x] = RAM[page << 8 | x] = (x + 3 * y) & 0x3F
+    return expected
+
+
+def test_logical_frame_matches_screen_memory():
+    frame = Emulator.capture_frames()
+    expected = _draw_test_pattern()
+    Emulator.run_frames(2)
+    assert (frame == expected).all()
+
+
+def test_physical_frame_scales_logical_frame():
+    frame = Emulator.capture_frames(physical=True)
+    expected = _draw_test_pattern()
+    Emulator.run_frames(2)
+    assert frame.shape == (480, 640)
+    assert (frame[::4, ::4] == expected).all()
+    assert (frame[:, 0::4] == frame[:, 3::4]).all()
+
+
+def test_frame_callbacks():
+    hashes = []
+    Emulator.capture_frames()
+    Emulator.frame_callbacks.append(lambda frame: hashes.append(Emulator.frame_hash()))
+    _draw_test_pattern()
+    Emulator.run_frames(3)
+    assert len(hashes) == Emulator.frames >= 3
+    assert hashes[-1] == hashes[-2]
+
+
+def test_save_png(tmp_path):
+    Emulator.capture_frames()
+    _draw_test_pattern()
+    Emulator.run_frames(2)
+    path = tmp_path / "screen.png"
+    Emulator.save_png(path)
+    data = path.read_bytes()
+    assert data[:8] == b"\x89PNG\r\n\x1a\n"
+    idat = data.index(b"IDAT")
+    length = int.from_bytes(data[idat - 4 : idat], "big")
+    rows = zlib.decompress(data[idat + 4 : idat + 4 + length])
+    assert len(rows) == 120 * (1 + 160 * 3)
@@ -0,0 +1,42 @@
+"""Tests for loading GT1 files"""
+import pathlib
+
+import pytest
+
+from gtemu import RAM, Emulator
+
+_ROM_FILE = pathlib.Path(__file__).parent / ".." / "roms" / "echo.rom"
+
+# LDI $42; ST $70; BRA $08a4, in the off-screen part of the first screen row
+_PROGRAM = bytes([0x08, 0xA0, 0x06, 0x59, 0x42, 0x5E, 0x70, 0x90, 0xA2, 0x00, 0x08, 0xA0])
+
+
+def setup_module():
+    Emulator.load_rom_file(_ROM_FILE)
+
+
+def setup_function():
+    Emulator.reset()
+
+
+def test_load_without_running():
+    assert Emulator.load_gt1(_PROGRAM, run=False) == 0x08A0
+    assert bytes(RAM[0x08A0:0x08A6]) == _PROGRAM[3:9]
+    assert Emulator.cycles == 0
+
+
+def test_load_and_run(tmp_path):
+    path = tmp_path / "program.gt1"
+    path.write_bytes(_PROGRAM)
+    Emulator.run_to(0x2FF, max_instructions=10_000_000)
+    Emulator.load_gt1(path)
+    assert Emulator.vLR == 0x08A0
+    Emulator.run_frames(2)
+    assert RAM[0x70] == 0x42
+    assert Emulator.vPC >> 8 == 0x08
+
+
+@pytest.mark.parametrize("data", [b"", _PROGRAM[:5], _PROGRAM[:-1], _PROGRAM + b"\x00"])
+def test_malformed_files(data):
+    with pytest.raises(ValueError):
+        Emulator.load_gt1(data)
@@ -0,0 +1,262 @@
+"""Tests for high-level emulation of the vCPU"""
+import pathlib
+
+import pytest
+
+from gtemu import BUTTON_A, Gigatron, buttons
+
+_ROMV5A_FILE = pathlib.Path(__file__).parent / ".." / ".." / ".." / ".." / "ROMv5a.rom"
+
+pytestmark = pytest.mark.skipif(
+    not _ROMV5A_FILE.exists(), reason="ROMv5a.rom not found"
+)
+
+_FRAME_COUNT = 0x0E
+_SERIAL_RAW = 0x0F
+_SYS_FN = 0x22
+_SYS_LSRW1_48 = 0x0600  # From interface.json
+
+_ORIGIN = 0x0200
+
+
+def _assemble(*items):
+    """Assemble vCPU code for _ORIGIN
+
+    Integers are bytes, strings define labels, (label,) stands for the low
+    byte of a label's address less two, as BRA, BCC and DEF expect it, and
+    [label] for the full address.
+    """
+    labels, address = {}, _ORIGIN
+    for item in items:
+        if isinstance(item, str):
+            labels[item] = address
+        else:
+            address += 2 if isinstance(item, list) else 1
+    code = []
+    for item in items:
+        if isinstance(item, tuple):
+            code.append(labels[item[0]] - 2 & 0xFF)
+        elif isinstance(item, list):
+            code += [labels[item[0]] & 0xFF, labels[item[0]] >> 8]
+        elif isinstance(item, int):
+            code.append(item)
+    header = [_ORIGIN >> 8, _ORIGIN & 0xFF, len(code)]
+    return bytes(header + code + [0x00, _ORIGIN >> 8, _ORIGIN & 0xFF])
+
+
+# Counts at $30 forever
+_COUNTER = _assemble(
+    "loop",
+    *(0x21, 0x30),  # LDW $30
+    *(0xE3, 0x01),  # ADDI 1
+    *(0x2B, 0x30),  # STW $30
+    *(0x90, ("loop",)),  # BRA loop
+)
+
+_INSTRUCTIONS = _assemble(
+    *(0x11, 0x34, 0x12),  # LDWI $1234
+    *(0x2B, 0x30),  # STW $30
+    *(0x59, 0x56),  # LDI $56
+    *(0x5E, 0x32),  # ST $32
+    *(0x93, 0x32),  # INC $32
+    *(0x1A, 0x32),  # LD $32
+    *(0x99, 0x30),  # ADDW $30
+    *(0xE6, 0x03),  # SUBI 3
+    *(0xE3, 0xC8),  # ADDI 200
+    0xE9,  # LSLW
+    *(0xB8, 0x30),  # SUBW $30
+    *(0x2B, 0x34),  # STW $34
+    *(0x82, 0xF0),  # ANDI $f0
+    *(0x88, 0x05),  # ORI $05
+    *(0x8C, 0x0F),  # XORI $0f
+    *(0x2B, 0x36),  # STW $36
+    *(0x21, 0x30),  # LDW $30
+    *(0xF8, 0x34),  # ANDW $34
+    *(0xFA, 0x36),  # ORW $36
+    *(0xFC, 0x30),  # XORW $30
+    *(0x2B, 0x38),  # STW $38
+    *(0x11, 0x40, 0x08),  # LDWI $0840
+    *(0x2B, 0x3A),  # STW $3a
+    *(0x11, 0x50, 0x08),  # LDWI $0850
+    *(0x2B, 0x3C),  # STW $3c
+    *(0x59, 0x77),  # LDI $77
+    *(0xF0, 0x3A),  # POKE $3a
+    *(0x11, 0xEF, 0xBE),  # LDWI $beef
+    *(0xF3, 0x3C),  # DOKE $3c
+    *(0x21, 0x3A),  # LDW $3a
+    0xAD,  # PEEK
+    *(0x5E, 0x3E),  # ST $3e
+    *(0x21, 0x3C),  # LDW $3c
+    0xF6,  # DEEK
+    *(0x2B, 0x40),  # STW $40
+    *(0x59, 0x05),  # LDI 5
+    *(0x2B, 0x42),  # STW $42
+    *(0x59, 0x00),  # LDI 0
+    *(0x2B, 0x44),  # STW $44
+    "sum",
+    *(0x21, 0x44),  # LDW $44
+    *(0x99, 0x42),  # ADDW $42
+    *(0x2B, 0x44),  # STW $44
+    *(0x21, 0x42),  # LDW $42
+    *(0xE6, 0x01),  # SUBI 1
+    *(0x2B, 0x42),  # STW $42
+    *(0x35, 0x72, ("sum",)),  # BNE sum
+    *(0xCD, ("defined",)),  # DEF defined
+    0x75,  # PUSH
+    *(0x11, 0x23, 0x01),  # LDWI $0123
+    *(0x2B, 0x46),  # STW $46
+    *(0xDF, 0xFE),  # ALLOC -2
+    *(0x11, 0x55, 0x55),  # LDWI $5555
+    *(0xEC, 0x00),  # STLW 0
+    *(0xEE, 0x00),  # LDLW 0
+    *(0xFC, 0x46),  # XORW $46
+    *(0x2B, 0x48),  # STW $48
+    *(0xDF, 0x02),  # ALLOC 2
+    0x63,  # POP
+    0xFF,  # RET
+    "defined",
+    *(0x2B, 0x4A),  # STW $4a
+    *(0xCF, 0x4A),  # CALL $4a
+    *(0x85, ["subroutine"]),  # CALLI subroutine
+    *(0x11, 0x00, 0x80),  # LDWI $8000
+    *(0x2B, 0x4C),  # STW $4c
+    *(0x11, 0xFF, 0x7F),  # LDWI $7fff
+    *(0x1F, 0x4D),  # CMPHS $4d
+    *(0x2B, 0x4E),  # STW $4e
+    *(0x11, 0xFF, 0x7F),  # LDWI $7fff
+    *(0x97, 0x4D),  # CMPHU $4d
+    *(0x2B, 0x50),  # STW $50
+    *(0x11, 0xFF, 0xFF),  # LDWI -1
+    *(0x35, 0x4D, ("greater",)),  # BGT greater
+    *(0x93, 0x52),  # INC $52
+    "greater",
+    *(0x35, 0x50, ("less",)),  # BLT less
+    *(0x93, 0x52),  # INC $52
+    "less",
+    *(0x59, 0x00),  # LDI 0
+    *(0x35, 0x3F, ("equal",)),  # BEQ equal
+    *(0x93, 0x53),  # INC $53
+    "equal",
+    *(0x35, 0x53, ("greater_or_equal",)),  # BGE greater_or_equal
+    *(0x93, 0x53),  # INC $53
+    "greater_or_equal",
+    *(0x35, 0x56, ("done",)),  # BLE done
+    *(0x93, 0x53),  # INC $53
+    "done",
+    *(0x90, ("done",)),  # BRA done
+    "subroutine",
+    *(0x11, 0x21, 0x43),  # LDWI $4321
+    *(0x2B, 0x56),  # STW $56
+    0xFF,  # RET
+)
+
+
+def _sys(sys_fn, cycles):
+    """Call sysFn, storing vAC to $30 before and after, and stop"""
+    return _assemble(
+        *(0x11, 0xCD, 0xAB),  # LDWI $abcd
+        *(0x2B, 0x30),  # STW $30
+        *(0x11, sys_fn & 0xFF, sys_fn >> 8),  # LDWI sys_fn
+        *(0x2B, _SYS_FN),  # STW sysFn
+        *(0x21, 0x30),  # LDW $30
+        *(0xB4, 270 - cycles // 2),  # SYS cycles
+        *(0x2B, 0x32),  # STW $32
+        "done",
+        *(0x90, ("done",)),  # BRA done
+    )
+
+
+@pytest.fixture
+def gigatron():
+    gigatron = Gigatron()
+    gigatron.load_rom_file(_ROMV5A_FILE)
+    gigatron.run_frames(30)
+    return gigatron
+
+
+def _counter(gigatron):
+    return int.from_bytes(gigatron.RAM[0x30:0x32], "little")
+
+
+def _results(gigatron):
+    return bytes(gigatron.RAM[0x30:0x58]), bytes(gigatron.RAM[0x0840:0x0852])
+
+
+def test_instructions_match_rom(gigatron):
+    gigatron.load_gt1(_INSTRUCTIONS)
+    gigatron.RAM[0x30:0x58] = bytes(0x28)
+    snapshot = gigatron.snapshot()
+    gigatron.run_frames(3)
+    expected = _results(gigatron)
+    gigatron.restore(snapshot)
+    gigatron.start_hle()
+    gigatron.run_frames(3)
+    assert _results(gigatron) == expected
+    assert gigatron.RAM[0x44] == 15
+    assert bytes(gigatron.RAM[0x4E:0x52]) == bytes([0xFF, 0x81, 0xFF, 0x7F])
+    assert bytes(gigatron.RAM[0x52:0x58]) == bytes([1, 0, 0, 0, 0x21, 0x43])
+    assert gigatron.hle
+
+
+def test_frames_advance(gigatron):
+    gigatron.load_gt1(_COUNTER)
+    gigatron.start_hle()
+    gigatron.run_frames(1)
+    frames, frame_count = gigatron.frames, gigatron.RAM[_FRAME_COUNT]
+    count = _counter(gigatron)
+    gigatron.run_frames(10)
+    assert gigatron.frames == frames + 10
+    assert gigatron.RAM[_FRAME_COUNT] == frame_count + 10 & 0xFF
+    assert 2000 < _counter(gigatron) - count < 3000
+
+
+def test_switch_modes(gigatron):
+    gigatron.load_gt1(_COUNTER)
+    snapshot = gigatron.snapshot()
+    gigatron.run_frames(5)
+    rom_count = _counter(gigatron)
+    gigatron.restore(snapshot)
+    gigatron.start_hle()
+    gigatron.run_frames(5)
+    hle_count = _counter(gigatron)
+    assert abs(hle_count - rom_count) < rom_count // 20
+    gigatron.stop_hle()
+    assert not gigatron.hle
+    gigatron.run_frames(5)
+    assert abs(_counter(gigatron) - hle_count - rom_count) < rom_count // 10
+
+
+def test_host_sys(gigatron):
+    calls = []
+
+    def sys_double(gigatron):
+        calls.append(gigatron.vAC)
+        gigatron.vAC = gigatron.vAC * 2 & 0xFFFF
+
+    gigatron.hle_sys[0x1234] = sys_double
+    gigatron.load_gt1(_sys(0x1234, 40))
+    gigatron.start_hle()
+    gigatron.run_frames(2)
+    assert calls == [0xABCD]
+    assert bytes(gigatron.RAM[0x32:0x34]) == bytes([0x9A, 0x57])
+
+
+def test_sys_falls_back_to_rom(gigatron):
+    gigatron.load_gt1(_sys(_SYS_LSRW1_48, 48))
+    gigatron.start_hle()
+    gigatron.run_frames(2)
+    assert bytes(gigatron.RAM[0x32:0x34]) == bytes([0xE6, 0x55])
+    assert gigatron.hle
+
+
+def test_input(gigatron):
+    gigatron.load_gt1(_COUNTER)
+    gigatron.start_hle()
+    gigatron.play_input([(1, buttons(BUTTON_A))])
+    gigatron.run_frames(2)
+    assert gigatron.RAM[_SERIAL_RAW] == buttons(BUTTON_A)
+
+
+def test_frame_cycles_must_be_positive(gigatron):
+    with pytest.raises(ValueError):
+        gigatron.start_hle(frame_cycles=0)
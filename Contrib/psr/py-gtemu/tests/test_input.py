@@ -0,0 +1,86 @@
+"""Tests for playing back controller input"""
+import pathlib
+
+import pytest
+
+from gtemu import (
+    BUTTON_A,
+    BUTTON_LEFT,
+    STOP_INPUT,
+    Gigatron,
+    WatchpointHit,
+    buttons,
+    read_input_script,
+    write_input_script,
+)
+
+_ROM_FILE = pathlib.Path(__file__).parent / ".." / "roms" / "echo.rom"
+
+_SERIAL_RAW = 0x0F  # From echo.lst
+_CAPTURE_SERIAL_INPUT = 0x0194  # st in,[serialRaw] in the video loop
+
+
+@pytest.fixture
+def gigatron():
+    gigatron = Gigatron()
+    gigatron.load_rom_file(_ROM_FILE)
+    gigatron.run_frames(2)
+    return gigatron
+
+
+def test_buttons():
+    assert buttons() == 0xFF
+    assert buttons(BUTTON_A, BUTTON_LEFT) == 0x7D
+
+
+def test_play_input(gigatron):
+    gigatron.play_input([(1, 0xFE), (3, 0x7F), (4, 0xFF)])
+    values = []
+    for _ in range(4):
+        gigatron.run_frames(1)
+        values.append((gigatron._core.IN, gigatron.playing_input))
+    assert values == [(0xFE, True), (0xFE, True), (0x7F, True), (0xFF, False)]
+
+
+def test_rom_reads_input(gigatron):
+    gigatron.play_input([(1, buttons(BUTTON_A))])
+    gigatron.watch(_SERIAL_RAW, value=0x7F)
+    with pytest.raises(WatchpointHit) as hit:
+        gigatron.run_frames(2)
+    assert (gigatron.frames, hit.value.pc) == (3, _CAPTURE_SERIAL_INPUT)
+
+
+def test_stop_on_last_event(gigatron):
+    gigatron.play_input([(10, 0xFE), (10, 0xFD)])
+    assert gigatron.run(stop_on=STOP_INPUT) == STOP_INPUT
+    assert (gigatron.frames, gigatron._core.IN) == (12, 0xFD)
+
+
+def test_events_must_be_in_order(gigatron):
+    with pytest.raises(ValueError):
+        gigatron.play_input([(2, 0xFE), (1, 0xFF)])
+
+
+def test_stop_input(gigatron):
+    gigatron.play_input([(1, 0xFE), (2, 0xFF)])
+    gigatron.run_frames(1)
+    gigatron.stop_input()
+    gigatron.run_frames(1)
+    assert (gigatron._core.IN, gigatron.playing_input) == (0xFE, False)
+
+
+def test_input_script(tmp_path):
+    path = tmp_path / "session.txt"
+    events = [(1, 0xFE), (60, 0x7F), (61, 0xFF)]
+    write_input_script(path, events)
+    assert read_input_script(path) == events
+    path.write_text("# Press A\n 10 7f  # for a frame\n\n11 ff\n")
+    assert read_input_script(path) == [(10, 0x7F), (11, 0xFF)]
+
+
+@pytest.mark.parametrize("line", ["10\n", "10 7f 3\n", "x 7f\n", "10 100\n"])
+def test_input_script_errors(tmp_path, line):
+    path = tmp_path / "session.txt"
+    path.write_text(line)
+    with pytest.raises(ValueError):
+        read_input_script(path)
@@ -0,0 +1,40 @@
+"""Tests for independent emulator instances"""
+import pathlib
+from concurrent.futures import ThreadPoolExecutor
+
+from gtemu import RAM, Emulator, Gigatron
+
+_ROM_FILE = pathlib.Path(__file__).parent / ".." / "roms" / "echo.rom"
+
+
+def _booted():
+    gigatron = Gigatron()
+    gigatron.load_rom_file(_ROM_FILE)
+    gigatron.run_to(0x2FF, max_instructions=10_000_000)
+    return gigatron
+
+
+def test_instances_are_independent():
+    first, second = _booted(), _booted()
+    assert first.state == second.state
+    first.RAM[0x300] = 0x55
+    second.RAM[0x300] = 0xAA
+    first.run_frames(1)
+    assert first.cycles != second.cycles
+    assert (first.RAM[0x300], second.RAM[0x300]) == (0x55, 0xAA)
+    assert RAM is Emulator.RAM and RAM is not first.RAM
+
+
+def test_instances_run_in_threads():
+    gigatrons = [_booted() for _ in range(4)]
+    for i, gigatron in enumerate(gigatrons):
+        gigatron.run(i * 1000)
+    frames = [gigatron.frames for gigatron in gigatrons]
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        list(executor.map(lambda g: g.run_frames(10), gigatrons))
+    assert [gigatron.frames - 10 for gigatron in gigatrons] == frames
+    reference = _booted()
+    reference.run(3000)
+    reference.run_frames(10)
+    assert gigatrons[3].state == reference.state
+    assert bytes(gigatrons[3].RAM) == bytes(reference.RAM)
@@ -0,0 +1,123 @@
+"""Tests for the memory models of the expansion boards"""
+import pathlib
+
+import pytest
+
+from gtemu import MEMORY_MODELS, Gigatron
+
+_ROMV5A_FILE = pathlib.Path(__file__).parent / ".." / ".." / ".." / ".." / "ROMv5a.rom"
+
+
+def _ld_y(value):
+    return [0x14, value]
+
+
+def _ld_x(value):
+    return [0x10, value]
+
+
+def _ld(value):
+    return [0x00, value]
+
+
+def _st_y_x():
+    return [0xCE, 0x00]
+
+
+def _ctrl_y_x():
+    return [0xCD, 0x00]
+
+
+def _ctrl(code):
+    return [0xC1, code]
+
+
+def _run_program(gigatron, *instructions):
+    """Load the instructions at address 0, followed by a loop, and run them"""
+    code = [byte for instruction in instructions for byte in instruction]
+    code += [0xFC, len(code) // 2]  # bra $
+    gigatron.ROM[0 : len(code) // 2] = [code[i : i + 2] for i in range(0, len(code), 2)]
+    gigatron.run(len(code))
+
+
+def _store_to_upper_half(value):
+    return _ld_y(0x80), _ld_x(0x00), _ld(value), _st_y_x()
+
+
+def test_unknown_memory_model():
+    with pytest.raises(ValueError):
+        Gigatron(memory=48)
+
+
+@pytest.mark.parametrize("memory", MEMORY_MODELS)
+def test_ram_size(memory):
+    assert len(Gigatron(memory=memory).RAM) == memory * 1024
+
+
+def test_32k_mirrors_upper_half():
+    gigatron = Gigatron()
+    _run_program(gigatron, *_store_to_upper_half(0x11))
+    assert gigatron.RAM[0x0000] == 0x11
+
+
+def test_64k_is_linear():
+    gigatron = Gigatron(memory=64)
+    _run_program(gigatron, *_store_to_upper_half(0x11))
+    assert (gigatron.RAM[0x0000], gigatron.RAM[0x8000]) == (0x00, 0x11)
+
+
+def test_128k_bank_switching():
+    gigatron = Gigatron(memory=128)
+    assert gigatron.physical_address(0x8000) == 0x8000
+    _run_program(
+        gigatron,
+        _ctrl(0xBC),  # Bank 2
+        *_store_to_upper_half(0x22),
+        _ctrl(0xFC),  # Bank 3
+        _ld(0x33),
+        _st_y_x(),
+        _ctrl(0x3C),  # Bank 0
+        _ld(0x44),
+        _st_y_x(),
+    )
+    assert gigatron.ctrl == 0x3C
+    assert gigatron.RAM[0x10000] == 0x22
+    assert gigatron.RAM[0x18000] == 0x33
+    assert gigatron.RAM[0x0000] == 0x44
+    assert gigatron.RAM[0x8000] == 0x00
+
+
+def test_128k_zero_page_banking():
+    gigatron = Gigatron(memory=128)
+    _run_program(gigatron, _ctrl(0x5C), _ld(0x55), [0xC2, 0x90])  # st [$90]
+    assert gigatron.physical_address(0x90) == 0x8090
+    assert (gigatron.RAM[0x0090], gigatron.RAM[0x8090]) == (0x00, 0x55)
+
+
+def test_512k_extended_banks():
+    gigatron = Gigatron(memory=512)
+    _run_program(
+        gigatron,
+        _ld_y(0xE8),
+        _ld_x(0xF0),
+        _ctrl_y_x(),  # Bank 14
+        *_store_to_upper_half(0x0E),
+        _ld_y(0x00),
+        _ld_x(0xF0),
+        _ctrl_y_x(),  # Back to normal banking, bank 1
+        _ld_y(0x80),
+        _ld_x(0x00),
+        _ld(0x01),
+        _st_y_x(),
+    )
+    assert gigatron.RAM[14 * 0x8000] == 0x0E
+    assert gigatron.RAM[0x8000] == 0x01
+
+
+@pytest.mark.skipif(not _ROMV5A_FILE.exists(), reason="ROMv5a.rom not found")
+@pytest.mark.parametrize("memory, mem_size", [(32, 0x80), (64, 0x00), (128, 0x00)])
+def test_rom_detects_memory_size(memory, mem_size):
+    gigatron = Gigatron(memory=memory)
+    gigatron.load_rom_file(_ROMV5A_FILE)
+    gigatron.run_to(0x2FF, max_instructions=10_000_000)
+    assert gigatron.RAM[0x01] == mem_size
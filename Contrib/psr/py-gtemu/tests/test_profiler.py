@@ -0,0 +1,57 @@
+"""Tests for the vCPU profiler"""
+import pathlib
+
+import pytest
+
+from gtemu import Emulator
+
+numpy = pytest.importorskip("numpy")
+
+_ROM_FILE = pathlib.Path(__file__).parent / ".." / "roms" / "echo.rom"
+
+# LDI $42; ST $70; BRA $08a4, in the off-screen part of the first screen row
+_PROGRAM = bytes([0x08, 0xA0, 0x06, 0x59, 0x42, 0x5E, 0x70, 0x90, 0xA2, 0x00, 0x08, 0xA0])
+
+_SYS_SEND_SERIAL1 = 0x0B06
+
+
+def setup_module():
+    Emulator.load_rom_file(_ROM_FILE)
+
+
+def setup_function():
+    Emulator.reset()
+
+
+def _profile_program(frames):
+    Emulator.run_to(0x2FF, max_instructions=10_000_000)
+    Emulator.load_gt1(_PROGRAM)
+    Emulator.start_vcpu_profiler()
+    Emulator.run_frames(frames)
+    return Emulator.vcpu_profile()
+
+
+def test_cycles_go_to_the_program():
+    profile = _profile_program(2)
+    assert list(profile.nonzero()[0]) == [0x08A0, 0x08A2, 0x08A4]
+    # LDI and ST take 16 cycles, and the loop runs for the rest of the time
+    assert list(profile[[0x08A0, 0x08A2]]) == [16, 16]
+    assert profile[0x08A4] > 40_000
+    assert Emulator.sys_calls() == {}
+
+
+def test_sys_calls_are_counted_once():
+    Emulator.start_vcpu_profiler()
+    assert Emulator.read_serial_bytes(5) == b"READY"
+    assert Emulator.sys_calls()[_SYS_SEND_SERIAL1] == 5
+
+
+def test_save_in_gtsim_format(tmp_path):
+    profile = _profile_program(1)
+    path = tmp_path / "prof.txt"
+    Emulator.save_vcpu_profile(path)
+    namespace = {}
+    exec(path.read_text(), namespace)
+    addresses = list(profile.nonzero()[0])
+    assert list(namespace["prof"]) == addresses
+    assert list(namespace["prof"].values()) == list(numpy.cumsum(profile[addresses]))
@@ -0,0 +1,53 @@
+"""Tests for the native run loop"""
+import pathlib
+
+import pytest
+
+import gtemu
+from gtemu import Emulator
+
+_ROM_FILE = pathlib.Path(__file__).parent / ".." / "roms" / "echo.rom"
+
+
+def setup_module():
+    Emulator.load_rom_file(_ROM_FILE)
+
+
+def setup_function():
+    Emulator.reset()
+
+
+def test_run_to_counts_cycles():
+    cycles = Emulator.run_to(0x2FF, max_instructions=10_000_000)  # Entry of vCPU
+    assert Emulator.next_instruction == 0x2FF
+    assert Emulator.cycles == cycles
+
+
+def test_run_to_timeout():
+    with pytest.raises(ValueError):
+        Emulator.run_to(0x2FF, max_instructions=100)
+    assert Emulator.cycles == 100
+
+
+def test_breakpoints_stop_run():
+    Emulator.breakpoints.add(0x2FF)
+    assert Emulator.run(10_000_000) == gtemu.STOP_BREAKPOINT
+    assert Emulator.next_instruction == 0x2FF
+
+
+def test_lines_are_200_cycles():
+    Emulator.run_to(0x2FF, max_instructions=10_000_000)
+    Emulator.run(stop_on=gtemu.STOP_HSYNC)
+    for _ in range(600):
+        start = Emulator.cycles
+        assert Emulator.run(stop_on=gtemu.STOP_HSYNC) == gtemu.STOP_HSYNC
+        assert Emulator.cycles - start == 200
+        assert Emulator._vga_x == 0
+
+
+def test_run_to_vblank():
+    Emulator.run_to(0x2FF, max_instructions=10_000_000)
+    Emulator.run_to_vblank()
+    assert Emulator._vga_y == 480
+    Emulator.run_to_hblank()
+    assert Emulator._vga_x == 172
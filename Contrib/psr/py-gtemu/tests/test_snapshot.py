@@ -0,0 +1,70 @@
+"""Tests for snapshots"""
+import pathlib
+
+import pytest
+
+from gtemu import RAM, Emulator, Snapshot
+
+_ROM_FILE = pathlib.Path(__file__).parent / ".." / "roms" / "echo.rom"
+
+
+def setup_module():
+    Emulator.load_rom_file(_ROM_FILE)
+
+
+def setup_function():
+    Emulator.reset()
+
+
+def _boot():
+    Emulator.run_to(0x2FF, max_instructions=10_000_000)
+    Emulator.run_vcpu_to(0x200)
+
+
+def test_restore_returns_to_snapshot():
+    _boot()
+    snapshot = Emulator.snapshot()
+    state, cycles, ram = Emulator.state, Emulator.cycles, bytes(RAM)
+    Emulator.run_frames(3)
+    RAM[0x300] ^= 0xFF
+    assert Emulator.cycles != cycles
+    Emulator.restore(snapshot)
+    assert Emulator.state == state
+    assert Emulator.cycles == cycles
+    assert bytes(RAM) == ram
+
+
+def test_execution_is_repeatable_after_restore():
+    _boot()
+    snapshot = Emulator.snapshot()
+    Emulator.run_frames(5)
+    first = Emulator.state, bytes(RAM)
+    Emulator.restore(snapshot)
+    Emulator.run_frames(5)
+    assert (Emulator.state, bytes(RAM)) == first
+
+
+def test_save_and_load(tmp_path):
+    _boot()
+    snapshot = Emulator.snapshot()
+    snapshot.save(tmp_path / "booted.snapshot")
+    assert Snapshot.load(tmp_path / "booted.snapshot") == snapshot
+    (tmp_path / "bad.snapshot").write_bytes(b"not a snapshot")
+    with pytest.raises(ValueError):
+        Snapshot.load(tmp_path / "bad.snapshot")
+
+
+def test_cached_snapshot(tmp_path):
+    calls = []
+
+    def setup():
+        calls.append(None)
+        _boot()
+
+    first = Emulator.cached_snapshot(tmp_path, "booted", setup)
+    state = Emulator.state
+    Emulator.reset()
+    second = Emulator.cached_snapshot(tmp_path, "booted", setup)
+    assert len(calls) == 1
+    assert second == first
+    assert Emulator.state == state
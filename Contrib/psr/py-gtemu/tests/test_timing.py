@@ -0,0 +1,76 @@
+"""Tests for the video timing checker"""
+import pathlib
+
+import pytest
+
+import check_timing
+from annotate_lst import read_labels
+from gtemu import Gigatron, TimingViolation
+
+_ROMS = pathlib.Path(__file__).parent / ".." / "roms"
+_ROM_FILE = _ROMS / "echo.rom"
+_LST_FILE = _ROMS / "echo.lst"
+
+_LAST_PIXEL = 0x02AB  # The last ora [y,x++],out of the pixel burst
+
+
+@pytest.fixture
+def gigatron():
+    gigatron = Gigatron()
+    gigatron.load_rom_file(_ROM_FILE)
+    gigatron.run_frames(2)  # Past the boot code
+    return gigatron
+
+
+def test_echo_rom_conforms(gigatron):
+    assert gigatron.check_video_timing(60) == []
+
+
+def test_serial_output_is_not_a_violation(gigatron):
+    gigatron.send_bytes(b"Hello")
+    assert gigatron.check_video_timing(60) == []
+
+
+def test_shortened_pixel_burst(gigatron):
+    gigatron.ROM[_LAST_PIXEL] = [0x18, 0xC0]  # ld $c0,out
+    violations = gigatron.check_video_timing(1, labels=read_labels(_LST_FILE))
+    assert len(violations) == 120 * 3  # Three lines with pixels in each group
+    assert {v[:5] for v in violations} == {("hfront", 5, 4, 0x02AA, "pixels+160")}
+
+
+def test_expected_timing_can_be_changed(gigatron):
+    violations = gigatron.check_video_timing(3, timing={"frame": 520}, labels={})
+    assert len(violations) == 2  # The first frame started before checking
+    assert all(v[:3] == ("frame", 521, 520) and v.line == 521 for v in violations)
+    assert str(violations[0]).startswith("frame is 521 instead of 520 at $")
+
+
+def test_unknown_timing(gigatron):
+    with pytest.raises(ValueError):
+        gigatron.start_timing_checker({"hsinc": 24})
+
+
+def test_capacity(gigatron):
+    gigatron.start_timing_checker({"line": 199}, capacity=10)
+    gigatron.run_frames(1)
+    gigatron.stop_timing_checker()
+    assert len(gigatron.timing_violations()) == 10
+    assert gigatron.timing_violation_count == 520  # Lines after the first
+
+
+def test_violation_is_a_tuple():
+    violation = TimingViolation("line", 201, 200, 0x0100, None, 0, 0, 1)
+    assert str(violation) == (
+        "line is 201 instead of 200 at $0100, cycle 0, frame 0, line 1"
+    )
+
+
+def test_check_timing_exit_status(tmp_path, capsys):
+    assert check_timing.main([str(_ROM_FILE), "--frames", "10"]) == 0
+    rom = bytearray(_ROM_FILE.read_bytes())
+    rom[2 * _LAST_PIXEL : 2 * _LAST_PIXEL + 2] = b"\x18\xc0"
+    patched = tmp_path / "patched.rom"
+    patched.write_bytes(rom)
+    args = [str(patched), "--lst", str(_LST_FILE), "--frames", "1"]
+    assert check_timing.main(args) == 1
+    assert "(pixels+160)" in capsys.readouterr().out
@@ -0,0 +1,123 @@
+"""Tests for the trace buffer and RAM watchpoints"""
+import io
+import pathlib
+
+import pytest
+
+from gtemu import STOP_BREAKPOINT, Gigatron, TraceEntry, WatchpointHit
+
+_ROM_FILE = pathlib.Path(__file__).parent / ".." / "roms" / "echo.rom"
+
+
+def _load_program(gigatron, *instructions):
+    """Load the instructions at address 0, followed by a loop"""
+    code = [byte for instruction in instructions for byte in instruction]
+    code += [0xFC, len(code) // 2]  # bra $
+    code += [0x02, 0x00]  # nop
+    gigatron.ROM[0 : len(code) // 2] = [code[i : i + 2] for i in range(0, len(code), 2)]
+
+
+_STORES = (
+    [0x00, 0x11],  # ld $11
+    [0xC2, 0x30],  # st [$30]
+    [0x00, 0x22],  # ld $22
+    [0xC2, 0x30],  # st [$30]
+    [0x01, 0x30],  # ld [$30]
+)
+
+
+@pytest.fixture
+def gigatron():
+    gigatron = Gigatron()
+    _load_program(gigatron, *_STORES)
+    return gigatron
+
+
+def test_trace(gigatron):
+    gigatron.start_trace(3)
+    gigatron.run(6)
+    # The first cycle executes the nop that is in IR after reset
+    assert gigatron.trace() == [
+        TraceEntry(0x0002, 0x00, 0x22, 0x22, 0, 0, 0),
+        TraceEntry(0x0003, 0xC2, 0x30, 0x22, 0, 0, 0),
+        TraceEntry(0x0004, 0x01, 0x30, 0x22, 0, 0, 0),
+    ]
+    lines = gigatron.format_trace().splitlines()
+    assert lines[-1].split() == ["$0004", "ld", "[$30]", "$22", "$00", "$00", "$00"]
+
+
+def test_trace_before_start(gigatron):
+    assert gigatron.trace() == []
+
+
+def test_write_watchpoint(gigatron):
+    gigatron.watch(0x30)
+    with pytest.raises(WatchpointHit) as hit:
+        gigatron.run(100)
+    assert (hit.value.address, hit.value.value, hit.value.write, hit.value.pc) == (
+        0x30,
+        0x11,
+        True,
+        0x0001,
+    )
+    assert gigatron.RAM[0x30] == 0x11
+    with pytest.raises(WatchpointHit) as hit:
+        gigatron.run(100)
+    assert (hit.value.value, hit.value.pc) == (0x22, 0x0003)
+
+
+def test_value_condition(gigatron):
+    gigatron.watch(0x30, value=0x22)
+    with pytest.raises(WatchpointHit) as hit:
+        gigatron.run(100)
+    assert hit.value.pc == 0x0003
+
+
+def test_read_watchpoint(gigatron):
+    gigatron.watch(0x30, read=True, write=False)
+    with pytest.raises(WatchpointHit) as hit:
+        gigatron.run(100)
+    assert (hit.value.value, hit.value.write, hit.value.pc) == (0x22, False, 0x0004)
+    assert str(hit.value) == "Read of $22 at $0030 by $0004"
+
+
+def test_unwatch(gigatron):
+    gigatron.watch(0x30)
+    gigatron.watch(0x31)
+    gigatron.unwatch(0x30)
+    gigatron.run(100)  # Does not raise
+    gigatron.unwatch()
+    gigatron.reset()
+    gigatron.run(100)
+
+
+def test_watchpoint_needs_an_access(gigatron):
+    with pytest.raises(ValueError):
+        gigatron.watch(0x30, write=False)
+
+
+def test_dump_trace_on_watchpoint(gigatron):
+    gigatron.watch(0x30, value=0x22)
+    out = io.StringIO()
+    with pytest.raises(WatchpointHit):
+        with gigatron.dump_trace(out, size=2):
+            gigatron.run(100)
+    assert out.getvalue().splitlines()[-1].startswith("$0003 st   [$30]")
+
+
+def test_dump_trace_on_breakpoint(gigatron):
+    gigatron.breakpoints.add(0x0004)
+    out = io.StringIO()
+    with gigatron.dump_trace(out, size=2):
+        assert gigatron.run(100) == STOP_BREAKPOINT
+    assert out.getvalue().splitlines()[-1].startswith("$0003 st   [$30]")
+
+
+def test_watchpoint_in_rom():
+    gigatron = Gigatron()
+    gigatron.load_rom_file(_ROM_FILE)
+    gigatron.run_to(0x2FF, max_instructions=10_000_000)
+    gigatron.watch(0x16, value=(gigatron.RAM[0x16] + 2) & 0xFF)  # vPC advancing
+    with pytest.raises(WatchpointHit) as hit:
+        gigatron.run(10_000)
+    assert hit.value.pc == 0x0306  # st [vPC] in NEXT
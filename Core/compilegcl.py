@@ -19,6 +19,7 @@ from os.path import basename, splitext
 
 import asm
 import gcl0x as gcl
+import gt1z
 
 #-----------------------------------------------------------------------
 #       Command line arguments
@@ -29,6 +30,8 @@ parser.add_argument('-s', '--sym', dest='sym', default='interface.json',
                     help='Symbol file for interface bindings (default interface.json)')
 parser.add_argument('-x', dest='gt1x', default=False, action='store_true',
                     help='Create .gt1x file'),
+parser.add_argument('-z', dest='compress', default=False, action='store_true',
+                    help='Compress with a self-extracting stub')
 parser.add_argument('gclSource',
                     help='GCL file')
 parser.add_argument('outputDir', nargs='?', default='.',
@@ -84,6 +87,13 @@ print('Execute at $%04x' % address)
 data.append(address>>8)
 data.append(address&255)
 
+if args.compress:
+  try:
+    data, report = gt1z.compress(data)
+    print(gt1z.describe(report))
+  except gt1z.Gt1zError as err:
+    print('Not compressed:', err)
+
 #-----------------------------------------------------------------------
 #       Write out GT1 file
 #-----------------------------------------------------------------------
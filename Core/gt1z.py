@@ -0,0 +1,390 @@
+#!/usr/bin/env python3
+#-----------------------------------------------------------------------
+#
+#  gt1z.py -- Compress GT1 files with a self-extracting vCPU stub
+#
+#-----------------------------------------------------------------------
+#
+# Loading a GT1 file over the serial link takes one video frame per
+# Loader packet of at most 60 bytes, that is about 3.6 kB/s. This
+# module replaces the segments of a GT1 file by an LZ-compressed
+# stream and a small vCPU stub that expands the stream into the
+# original segments and then jumps to the original start address.
+#
+# The zero page segment, when present, is kept as is because it
+# must come first and cannot be produced by the stub without
+# clobbering its own variables.
+#
+# The stub and the stream are loaded into the visible part of the
+# screen rows (offsets $00-$9f of pages $08-$7f) that are not used
+# by the program. Pages $50-$5b are avoided because the Loader draws
+# its text there and echoes the incoming packets in row $59 (ROMv1
+# even keeps its buffer in page $5b). The stub cannot go at $200
+# because this is where the program being expanded normally starts.
+# The payload remains visible as noise until the program clears the
+# screen.
+#
+# Stream format (all addresses little-endian):
+#
+#       $00 LL HH       Continue at address $HHLL, or stop if $HH is 0
+#       $01 PP          Continue reading the stream at address $PP00
+#       $03..$7f LL HH  Copy n+1 bytes from address $HHLL
+#       $80..$ff        Copy 256-n literal bytes from the stream
+#
+# Tokens never straddle a row of the stream, nor a destination page,
+# nor a source page. This way the stub increments its pointers with
+# INC instead of 16-bit additions, which keeps the inner loops at
+# 168 cycles per byte. The stub only uses ROM v1 instructions. On
+# ROMv4 and later, it turns the video off with SYS_SetMode_v2_80
+# while expanding the stream, and restores the video mode afterwards.
+#
+# Usage as a library:
+#
+#       import gt1z
+#       data, report = gt1z.compress(data)
+#
+#-----------------------------------------------------------------------
+
+import argparse
+import sys
+
+class Gt1zError(Exception):
+  pass
+
+#-----------------------------------------------------------------------
+#       GT1 files
+#-----------------------------------------------------------------------
+
+def parse(data):
+  """Return the list of segments (address, bytes) and the start address"""
+  segments = []
+  i = 0
+  while True:
+    if i >= len(data):
+      raise Gt1zError('truncated GT1 file')
+    if data[i] == 0 and i > 0:
+      break
+    if i + 3 > len(data):
+      raise Gt1zError('truncated GT1 file')
+    addr = (data[i] << 8) | data[i+1]
+    n = data[i+2] or 256
+    if i + 3 + n > len(data):
+      raise Gt1zError('truncated GT1 file')
+    segments.append((addr, bytes(data[i+3:i+3+n])))
+    i += 3 + n
+  if i + 3 > len(data):
+    raise Gt1zError('missing start address')
+  return segments, (data[i+1] << 8) | data[i+2]
+
+def unparse(segments, start):
+  """Produce a GT1 file from segments that do not cross pages"""
+  data = bytearray()
+  for addr, buf in segments:
+    assert 0 < len(buf) <= 256 and (addr & 255) + len(buf) <= 256
+    data += bytes([addr >> 8, addr & 255, len(buf) & 255]) + buf
+  data += bytes([0, start >> 8, start & 255])
+  return data
+
+def frames(segments):
+  """Number of Loader packets (one per frame) to send the segments"""
+  return sum((len(buf) + 59) // 60 for addr, buf in segments)
+
+#-----------------------------------------------------------------------
+#       Decompression stub
+#-----------------------------------------------------------------------
+
+# vCPU opcodes (ROM v1) and their durations in cycles
+opcodes = {
+  'LDWI': (0x11, 20), 'LD':   (0x1a, 18), 'LDW':  (0x21, 20),
+  'STW':  (0x2b, 20), 'LDI':  (0x59, 16), 'ST':   (0x5e, 16),
+  'ANDI': (0x82, 16), 'XORI': (0x8c, 14), 'BRA':  (0x90, 14),
+  'INC':  (0x93, 16), 'PEEK': (0xad, 26), 'SYS':  (0xb4, 80),
+  'SUBI': (0xe6, 28), 'POKE': (0xf0, 28), 'DEEK': (0xf6, 28),
+  'RET':  (0xff, 16),
+  'BEQ':  (0x35, 28), 'BNE':  (0x35, 28), 'BLT':  (0x35, 28),
+}
+conditions = { 'BEQ': 0x3f, 'BNE': 0x72, 'BLT': 0x50 }
+
+# Zero page locations used by the stub
+vLR, romType, sysFn = 0x1a, 0x21, 0x22
+S, D, M, N = 0x24, 0x26, 0x28, 0x2a     # sysArgs0..7
+SYS_SetMode_v2_80 = 0x0b00
+
+def assemble(addr, code):
+  """Assemble a list of instructions and labels at address addr"""
+  labels = {}
+  for final in (False, True):
+    pc = addr
+    out = bytearray()
+    for ins in code:
+      if isinstance(ins, str):
+        labels[ins] = pc
+        continue
+      op, arg = ins[0], ins[1:]
+      opcode = opcodes[op][0]
+      if op in conditions:
+        target = labels.get(arg[0], pc) if final else pc
+        b = [opcode, conditions[op], (target - 2) & 255]
+      elif op == 'BRA':
+        target = labels.get(arg[0], pc) if final else pc
+        b = [opcode, (target - 2) & 255]
+      elif op == 'LDWI':
+        b = [opcode, arg[0] & 255, (arg[0] >> 8) & 255]
+      else:
+        b = [opcode] + [a & 255 for a in arg]
+      if final and (op in conditions or op == 'BRA'):
+        if (target ^ pc) & 0xff00:
+          raise Gt1zError('stub branch crosses a page')
+      out += bytes(b)
+      pc += len(b)
+  if (addr & 255) + len(out) > 0xa0:
+    raise Gt1zError('stub does not fit in a screen row')
+  return out
+
+def stub(entry, decoder, stream, start):
+  """Return the code of the two halves of the stub. The entry code,
+     executed first, switches the video off on ROMv4 and later, then
+     jumps to the decoder. The decoder expands the stream and returns
+     to the entry code that restores the video and jumps to start."""
+  ecode = [
+    ('LD', romType), ('ANDI', 0xfc), ('SUBI', 0x38), ('BLT', 'go'),
+    ('LDWI', SYS_SetMode_v2_80), ('STW', sysFn),
+    ('LDWI', 1975), ('SYS', 230),                 # zombie mode
+    'go',
+    ('LDWI', stream), ('STW', S),
+    ('LDWI', decoder), ('STW', vLR), ('RET',),
+    'done',
+    ('LD', romType), ('ANDI', 0xfc), ('SUBI', 0x38), ('BLT', 'run'),
+    ('LDWI', SYS_SetMode_v2_80), ('STW', sysFn),
+    ('LDWI', 0xffff), ('SYS', 230),               # restore video mode
+    'run',
+    ('LDWI', start), ('STW', vLR), ('RET',) ]
+  done = entry + len(assemble(entry, ecode[:ecode.index('done')]))
+  dcode = [
+    'next',
+    ('LD', D), ('BNE', 'loop'), ('INC', D+1),     # page crossing
+    'loop',
+    ('LDW', S), ('PEEK',), ('INC', S), ('BEQ', 'seg'),
+    ('ST', N), ('ANDI', 0x80), ('BNE', 'lit'),
+    ('LD', N), ('XORI', 1), ('BEQ', 'row'),
+    ('LD', N), ('XORI', 0xff), ('ST', N),
+    ('LDW', S), ('DEEK',), ('STW', M), ('INC', S), ('INC', S),
+    'copy',
+    ('LDW', M), ('PEEK',), ('POKE', D), ('INC', M),
+    ('INC', D), ('INC', N), ('LD', N), ('BNE', 'copy'), ('BRA', 'next'),
+    'lit',
+    ('LDW', S), ('PEEK',), ('POKE', D), ('INC', S),
+    ('INC', D), ('INC', N), ('LD', N), ('BNE', 'lit'), ('BRA', 'next'),
+    'row',
+    ('LDW', S), ('PEEK',), ('ST', S+1), ('LDI', 0), ('ST', S), ('BRA', 'loop'),
+    'seg',
+    ('LDW', S), ('DEEK',), ('STW', D), ('INC', S), ('INC', S),
+    ('LD', D+1), ('BNE', 'loop'),
+    ('LDWI', done), ('STW', vLR), ('RET',) ]
+  return assemble(entry, ecode), assemble(decoder, dcode)
+
+def cycles(*ops):
+  return sum(opcodes[op][1] for op in ops)
+
+# Cost model of the decoder in vCPU cycles
+costByte = cycles('LDW', 'PEEK', 'POKE', 'INC', 'INC', 'INC', 'LD', 'BNE')
+costToken = cycles('LD', 'BNE', 'LDW', 'PEEK', 'INC', 'BEQ', 'ST', 'ANDI', 'BNE', 'BRA')
+costMatch = cycles('LD', 'XORI', 'BEQ', 'LD', 'XORI', 'ST', 'LDW', 'DEEK', 'STW', 'INC', 'INC')
+costOther = cycles('LDW', 'PEEK', 'INC', 'BEQ', 'LDW', 'DEEK', 'STW', 'INC', 'INC', 'LD', 'BNE')
+
+# Approximate vCPU cycles per second with video off (ROMv4 and later,
+# measured with gtsim) and in the default video mode 1 (older ROMs,
+# 161 free scanlines of about 138 usable cycles per frame)
+vcpuRateOff = 5.3e6
+vcpuRateMode1 = 1.3e6
+
+#-----------------------------------------------------------------------
+#       Compression
+#-----------------------------------------------------------------------
+
+MINMATCH, MAXMATCH, MAXLIT = 4, 128, 128
+
+def image(segments):
+  """Return the zero page segment and the list of runs (address, bytes)
+     of contiguous memory written by the other segments"""
+  zpage = None
+  mem = {}
+  for addr, buf in segments:
+    if addr < 256:
+      if zpage is not None or mem or addr + len(buf) > 256:
+        raise Gt1zError('zero page segment must come first')
+      zpage = (addr, buf)
+      continue
+    for i, b in enumerate(buf):
+      mem[(addr + i) & 0xffff] = b
+  runs = []
+  for addr in sorted(mem):
+    if runs and runs[-1][0] + len(runs[-1][1]) == addr:
+      runs[-1][1].append(mem[addr])
+    else:
+      runs.append((addr, bytearray([mem[addr]])))
+  return zpage, runs
+
+def tokenize(runs, depth=64):
+  """Greedy LZ parse of the runs into tokens ('seg', addr),
+     ('lit', bytes) and ('copy', source, length)"""
+  tokens = []
+  table = {}
+  data = bytearray()
+  addrs = []
+  limits = []
+  for addr, buf in runs:
+    base = len(data)
+    data += buf
+    addrs += range(addr, addr + len(buf))
+    limits += [base + len(buf)] * len(buf)
+  i = 0
+  for addr, buf in runs:
+    tokens.append(('seg', addr))
+    end = i + len(buf)
+    lit = bytearray()
+    while i < end:
+      room = min(end - i, 256 - (addrs[i] & 255))   # within the destination page
+      best, where = 0, None
+      if room >= MINMATCH:
+        for j in reversed(table.get(bytes(data[i:i+MINMATCH]), ())[-depth:]):
+          n = min(room, MAXMATCH, limits[j] - j, 256 - (addrs[j] & 255))
+          k = 0
+          while k < n and data[j+k] == data[i+k]:
+            k += 1
+          if k > best:
+            best, where = k, j
+            if k == n:
+              break
+      if best >= MINMATCH:
+        if lit:
+          tokens.append(('lit', bytes(lit)))
+          lit = bytearray()
+        tokens.append(('copy', addrs[where], best))
+        step = best
+      else:
+        lit.append(data[i])
+        step = 1
+        if len(lit) == MAXLIT or (addrs[i] & 255) == 255:
+          tokens.append(('lit', bytes(lit)))
+          lit = bytearray()
+      for k in range(i, i + step):
+        table.setdefault(bytes(data[k:k+MINMATCH]), []).append(k)
+      i += step
+    if lit:
+      tokens.append(('lit', bytes(lit)))
+  tokens.append(('seg', 0))
+  return tokens
+
+def layout(tokens, rows, first):
+  """Lay the tokens out in screen rows starting at address first.
+     Return the stream segments and the decoder cycle count."""
+  segs = []
+  row = bytearray()
+  pc = first
+  count = 0
+  def flush(nextpage):
+    nonlocal row, pc
+    if nextpage is not None:
+      row += bytes([1, nextpage])
+    segs.append((pc, bytes(row)))
+    row = bytearray()
+  for tok in tokens:
+    while True:
+      room = 0x9e - ((pc & 255) + len(row))
+      if tok[0] == 'lit' and room >= 2 and len(tok[1]) + 1 > room:
+        part, tok = tok[1][:room-1], ('lit', tok[1][room-1:])
+        row += bytes([256 - len(part)]) + part
+        count += costToken + costByte * len(part)
+        room = 0
+      if tok[0] == 'seg':
+        b = bytes([0, tok[1] & 255, tok[1] >> 8])
+      elif tok[0] == 'lit':
+        b = bytes([256 - len(tok[1])]) + tok[1]
+      else:
+        b = bytes([tok[2] - 1, tok[1] & 255, tok[1] >> 8])
+      if len(b) <= room:
+        break
+      if not rows:
+        raise Gt1zError('not enough free screen rows for the compressed data')
+      count += costToken + costOther
+      flush(rows[0])
+      pc = rows.pop(0) << 8
+    row += b
+    if tok[0] == 'seg':
+      count += costToken + costOther
+    elif tok[0] == 'lit':
+      count += costToken + costByte * len(tok[1])
+    else:
+      count += costToken + costMatch + costByte * tok[2]
+  flush(None)
+  return segs, count
+
+def freeRows(runs, zpage):
+  """Screen rows whose visible part is not used by the program"""
+  used = set()
+  for addr, buf in runs:
+    for a in range(addr, addr + len(buf)):
+      if (a & 255) < 0xa0:
+        used.add(a >> 8)
+  return [p for p in range(0x7f, 0x07, -1)
+          if p not in used and not 0x50 <= p <= 0x5b]
+
+def compress(data):
+  """Compress a GT1 file. Return the new file and a report dictionary."""
+  segments, start = parse(data)
+  if start == 0:
+    raise Gt1zError('GT1 file has no start address')
+  zpage, runs = image(segments)
+  rows = freeRows(runs, zpage)
+  if len(rows) < 3:
+    raise Gt1zError('not enough free screen rows for the compressed data')
+  entry = rows.pop(0) << 8
+  decoder = rows.pop(0) << 8
+  tokens = tokenize(runs)
+  first = entry + len(stub(entry, decoder, 0, start)[0])
+  stream, count = layout(tokens, rows, first)
+  ecode, dcode = stub(entry, decoder, first, start)
+  zsegments = [zpage] if zpage else []
+  zsegments += [(entry, ecode + stream[0][1])] + [(decoder, dcode)] + stream[1:]
+  zdata = unparse(zsegments, entry)
+  report = {
+    'size': len(data), 'zsize': len(zdata),
+    'frames': frames(segments), 'zframes': frames(zsegments),
+    'cycles': count, 'rows': len(zsegments) - (1 if zpage else 0) }
+  if report['zframes'] / 59.98 + count / vcpuRateOff >= report['frames'] / 59.98:
+    raise Gt1zError('compression does not reduce the load time (%d -> %d bytes)'
+                    % (len(data), len(zdata)))
+  return zdata, report
+
+def describe(report):
+  """Return a printable report comparing load and decompression times"""
+  load = report['frames'] / 59.98
+  zload = report['zframes'] / 59.98
+  off = report['cycles'] / vcpuRateOff
+  mode1 = report['cycles'] / vcpuRateMode1
+  return ('GT1 compression: %d -> %d bytes (%.0f%%) in %d screen rows\n'
+          '  load time %.1fs -> %.1fs, decompression %d cycles\n'
+          '  total %.1fs with ROMv4 and later (video off), %.1fs with older ROMs (mode 1)'
+          % (report['size'], report['zsize'], 100.0 * report['zsize'] / report['size'],
+             report['rows'], load, zload, report['cycles'], zload + off, zload + mode1))
+
+#-----------------------------------------------------------------------
+#       Main
+#-----------------------------------------------------------------------
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Compress GT1 file with a self-extracting stub')
+  parser.add_argument('-o', dest='output', help='output file (default: overwrite input)')
+  parser.add_argument('gt1File', help='GT1 file')
+  args = parser.parse_args()
+  with open(args.gt1File, 'rb') as fd:
+    data = fd.read()
+  try:
+    zdata, report = compress(data)
+  except Gt1zError as err:
+    print('%s: %s' % (args.gt1File, err), file=sys.stderr)
+    sys.exit(1)
+  with open(args.output or args.gt1File, 'wb') as fd:
+    fd.write(zdata)
+  print(describe(report))